@@ -43,13 +43,38 @@ class OnboardingConfig(PluginConfig):
         "create_management_interface_if_missing": True,
         "skip_device_type_on_update": False,
         "skip_manufacturer_on_update": False,
+        "skip_unchanged_devices": False,
         "platform_map": {},
         "onboarding_extensions_map": {
             "ios": "nautobot_device_onboarding.onboarding_extensions.ios",
         },
         "object_match_strategy": "loose",
+        "ssh_banner_fingerprints": {
+            r"^SSH-[\d.]+-Cisco-1\.": "cisco_ios",
+            r"^SSH-[\d.]+-Cisco-2\.": "cisco_xr",
+            r"^SSH-[\d.]+-OpenSSH_\S+ PKIX": "juniper_junos",
+        },
+        "batch_max_workers": 16,
+        "batch_size": 500,
+        "bulk_onboarding_max_tasks": 10000,
+        "reachability_concurrency": 512,
+        "prefix_onboarding_max_size": 4096,
+        "reuse_autodetect_connection": True,
+        "device_type_cache_timeout": 86400,
+        "dns_cache_timeout": 300,
+        "dns_negative_cache_timeout": 60,
+        "dns_timeout": 10,
+        "dns_concurrency": 64,
+        "reference_cache_timeout": 300,
+        "reference_cache_size": 1024,
+        "worker_recycle_sessions": 0,
     }
     caching_config = {}
 
+    def ready(self):
+        """Connect the signal handlers invalidating the plugin caches."""
+        super().ready()
+        from . import cache  # noqa: F401 pylint: disable=import-outside-toplevel,unused-import
+
 
 config = OnboardingConfig  # pylint:disable=invalid-name
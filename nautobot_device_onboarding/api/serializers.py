@@ -12,13 +12,24 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import netaddr
+from django.conf import settings
+from django.db import transaction
 from rest_framework import serializers
+from rest_framework.exceptions import PermissionDenied
 
-from nautobot.dcim.models import Site, DeviceRole, Platform
+from nautobot.dcim.models import DeviceType, Site, DeviceRole, Platform
 
+from nautobot_device_onboarding.helpers import bulk_create_onboarding_tasks, resolve_onboarding_tasks
 from nautobot_device_onboarding.models import OnboardingTask
 from nautobot_device_onboarding.utils.credentials import Credentials
-from nautobot_device_onboarding.worker import enqueue_onboarding_task
+from nautobot_device_onboarding.worker import (
+    enqueue_onboarding_batch,
+    enqueue_onboarding_task,
+    enqueue_prefix_onboarding,
+)
+
+PLUGIN_SETTINGS = settings.PLUGINS_CONFIG["nautobot_device_onboarding"]
 
 
 class OnboardingTaskSerializer(serializers.ModelSerializer):
@@ -95,6 +106,16 @@ class OnboardingTaskSerializer(serializers.ModelSerializer):
 
     message = serializers.CharField(required=False, read_only=True, help_text="Status message")
 
+    enqueued = serializers.DateTimeField(required=False, read_only=True, help_text="Time the task was enqueued")
+
+    started = serializers.DateTimeField(required=False, read_only=True, help_text="Time the processing started")
+
+    finished = serializers.DateTimeField(required=False, read_only=True, help_text="Time the processing finished")
+
+    phase_durations = serializers.JSONField(
+        required=False, read_only=True, help_text="Time spent in each onboarding phase, in seconds"
+    )
+
     class Meta:  # noqa: D106 "Missing docstring in public nested class"
         model = OnboardingTask
         fields = [
@@ -113,6 +134,10 @@ class OnboardingTaskSerializer(serializers.ModelSerializer):
             "status",
             "failed_reason",
             "message",
+            "enqueued",
+            "started",
+            "finished",
+            "phase_durations",
         ]
 
     def create(self, validated_data):
@@ -130,6 +155,234 @@ class OnboardingTaskSerializer(serializers.ModelSerializer):
 
         ot = OnboardingTask.objects.create(**validated_data)
 
-        enqueue_onboarding_task(ot.id, credentials)
+        # An FQDN failing to resolve fails the task right away
+        if resolve_onboarding_tasks([ot])[0]:
+            enqueue_onboarding_task(ot.id, credentials)
 
         return ot
+
+
+class OnboardingPrefixSerializer(serializers.Serializer):  # pylint: disable=abstract-method
+    """Serializer to request the discovery and onboarding of all the devices of a prefix."""
+
+    prefix = serializers.CharField(
+        required=True,
+        help_text="Prefix to scan for devices to onboard",
+    )
+
+    site = serializers.SlugRelatedField(
+        many=False,
+        read_only=False,
+        queryset=Site.objects.all(),
+        slug_field="slug",
+        required=True,
+        help_text="Nautobot site 'slug' value",
+    )
+
+    username = serializers.CharField(
+        required=False,
+        write_only=True,
+        help_text="Device username",
+    )
+
+    password = serializers.CharField(
+        required=False,
+        write_only=True,
+        help_text="Device password",
+    )
+
+    secret = serializers.CharField(
+        required=False,
+        write_only=True,
+        help_text="Device secret password",
+    )
+
+    port = serializers.IntegerField(required=False, default=22, help_text="Device PORT to scan for")
+
+    timeout = serializers.IntegerField(required=False, default=30, help_text="Timeout (sec) for device connect")
+
+    role = serializers.SlugRelatedField(
+        many=False,
+        read_only=False,
+        queryset=DeviceRole.objects.all(),
+        slug_field="slug",
+        required=False,
+        help_text="Nautobot device role 'slug' value",
+    )
+
+    platform = serializers.SlugRelatedField(
+        many=False,
+        read_only=False,
+        queryset=Platform.objects.all(),
+        slug_field="slug",
+        required=False,
+        help_text="Nautobot Platform 'slug' value",
+    )
+
+    def validate_prefix(self, value):  # pylint: disable=no-self-use
+        """Validate the prefix and make sure it is not larger than allowed."""
+        try:
+            network = netaddr.IPNetwork(value)
+        except (netaddr.AddrFormatError, ValueError):
+            raise serializers.ValidationError(f"Invalid prefix: {value}")
+
+        max_size = PLUGIN_SETTINGS["prefix_onboarding_max_size"]
+        if network.size > max_size:
+            raise serializers.ValidationError(f"Prefix {network.cidr} is larger than {max_size} addresses")
+
+        return str(network.cidr)
+
+    def create(self, validated_data):
+        """Enqueue the discovery and onboarding of the devices of the prefix."""
+        credentials = Credentials(
+            username=validated_data.get("username", ""),
+            password=validated_data.get("password", ""),
+            secret=validated_data.get("secret", ""),
+        )
+
+        onboarding_task_kwargs = {
+            "site_id": str(validated_data["site"].id),
+            "port": validated_data["port"],
+            "timeout": validated_data["timeout"],
+            "role_id": str(validated_data["role"].id) if validated_data.get("role") else None,
+            "platform_id": str(validated_data["platform"].id) if validated_data.get("platform") else None,
+        }
+
+        # The worker applies the object permissions of the user to the tasks it creates
+        user_id = str(self.context["request"].user.pk)
+
+        enqueue_prefix_onboarding(validated_data["prefix"], onboarding_task_kwargs, credentials, user_id=user_id)
+
+        return validated_data
+
+
+class OnboardingBulkTaskSerializer(serializers.Serializer):  # pylint: disable=abstract-method
+    """Serializer of a device to onboard in a bulk onboarding request.
+
+    Site, role and platform slugs are resolved by OnboardingBulkSerializer for all the entries at once.
+    """
+
+    ip_address = serializers.CharField(required=True, help_text="IP Address to reach device")
+
+    site = serializers.SlugField(required=True, help_text="Nautobot site 'slug' value")
+
+    port = serializers.IntegerField(
+        required=False, min_value=1, max_value=65535, help_text="Device PORT to check for online"
+    )
+
+    timeout = serializers.IntegerField(required=False, min_value=1, help_text="Timeout (sec) for device connect")
+
+    role = serializers.SlugField(required=False, help_text="Nautobot device role 'slug' value")
+
+    device_type = serializers.CharField(required=False, help_text="Nautobot device type 'slug' value")
+
+    platform = serializers.SlugField(required=False, help_text="Nautobot Platform 'slug' value")
+
+
+class OnboardingBulkSerializer(serializers.Serializer):  # pylint: disable=abstract-method
+    """Serializer to request the onboarding of a list of devices sharing the same credentials."""
+
+    username = serializers.CharField(
+        required=False,
+        write_only=True,
+        help_text="Device username",
+    )
+
+    password = serializers.CharField(
+        required=False,
+        write_only=True,
+        help_text="Device password",
+    )
+
+    secret = serializers.CharField(
+        required=False,
+        write_only=True,
+        help_text="Device secret password",
+    )
+
+    tasks = OnboardingBulkTaskSerializer(many=True, write_only=True, help_text="Devices to onboard")
+
+    task_ids = serializers.ListField(
+        child=serializers.UUIDField(), read_only=True, help_text="IDs of the created onboarding tasks"
+    )
+
+    def validate_tasks(self, value):  # pylint: disable=no-self-use
+        """Make sure the list of devices is neither empty nor larger than allowed."""
+        max_tasks = PLUGIN_SETTINGS["bulk_onboarding_max_tasks"]
+
+        if not value:
+            raise serializers.ValidationError("At least one device must be provided")
+        if len(value) > max_tasks:
+            raise serializers.ValidationError(f"At most {max_tasks} devices can be onboarded per request")
+
+        return value
+
+    def validate(self, attrs):
+        """Resolve the site, role and platform slugs and check the device types of all the devices at once."""
+        tasks = attrs["tasks"]
+        related_models = {"site": Site, "role": DeviceRole, "platform": Platform}
+
+        slug_maps = {
+            field_name: dict(
+                model.objects.filter(slug__in={task[field_name] for task in tasks if task.get(field_name)})
+                .values_list("slug", "id")
+                .order_by()
+            )
+            for field_name, model in related_models.items()
+        }
+
+        # The device type is stored as a slug on the OnboardingTask, only make sure it exists
+        device_type_slugs = set(
+            DeviceType.objects.filter(slug__in={task["device_type"] for task in tasks if task.get("device_type")})
+            .values_list("slug", flat=True)
+            .order_by()
+        )
+
+        errors = []
+        for task in tasks:
+            task_errors = {}
+
+            for field_name, model in related_models.items():
+                slug = task.get(field_name)
+
+                if slug and slug not in slug_maps[field_name]:
+                    task_errors[field_name] = [f"{model._meta.verbose_name.capitalize()} not found: {slug}"]
+                elif slug:
+                    task[f"{field_name}_id"] = slug_maps[field_name][task.pop(field_name)]
+
+            device_type = task.get("device_type")
+            if device_type and device_type not in device_type_slugs:
+                task_errors["device_type"] = [f"Device type not found: {device_type}"]
+
+            errors.append(task_errors)
+
+        if any(errors):
+            raise serializers.ValidationError({"tasks": errors})
+
+        return attrs
+
+    def create(self, validated_data):
+        """Create all the OnboardingTasks at once, resolve their FQDN and enqueue them as batch onboarding jobs."""
+        credentials = Credentials(
+            username=validated_data.get("username", ""),
+            password=validated_data.get("password", ""),
+            secret=validated_data.get("secret", ""),
+        )
+
+        queryset = OnboardingTask.objects.restrict(self.context["request"].user, "add")
+
+        with transaction.atomic():
+            onboarding_tasks = bulk_create_onboarding_tasks(
+                [OnboardingTask(**task) for task in validated_data["tasks"]]
+            )
+
+            # Enforce object-level permissions, raising rolls back the creation of all the tasks
+            if queryset.filter(pk__in=[ot.pk for ot in onboarding_tasks]).count() != len(onboarding_tasks):
+                raise PermissionDenied()
+
+        resolved, _ = resolve_onboarding_tasks(onboarding_tasks)
+        enqueue_onboarding_batch([ot.id for ot in resolved], credentials)
+
+        task_ids = [ot.id for ot in onboarding_tasks]
+
+        return {"task_ids": task_ids}
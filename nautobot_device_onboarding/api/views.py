@@ -15,10 +15,12 @@ limitations under the License.
 # from drf_yasg.openapi import Parameter, TYPE_STRING
 # from drf_yasg.utils import swagger_auto_schema
 
-from rest_framework import mixins, viewsets
-
-# from rest_framework.decorators import action
-# from rest_framework.response import Response
+import netaddr
+from django.db import transaction
+from rest_framework import mixins, status, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import PermissionDenied
+from rest_framework.response import Response
 
 # from nautobot.utilities.api import IsAuthenticatedOrLoginNotRequired
 
@@ -28,7 +30,7 @@ from nautobot_device_onboarding.models import OnboardingTask
 from nautobot_device_onboarding.filters import OnboardingTaskFilter
 
 # from nautobot_device_onboarding.choices import OnboardingStatusChoices
-from .serializers import OnboardingTaskSerializer
+from .serializers import OnboardingBulkSerializer, OnboardingPrefixSerializer, OnboardingTaskSerializer
 
 
 class OnboardingTaskView(
@@ -43,6 +45,42 @@ class OnboardingTaskView(
     In-place updates (PUT, PATCH) of tasks are not permitted.
     """
 
-    queryset = OnboardingTask.objects.all()
+    queryset = OnboardingTask.objects.select_related("site", "platform", "role", "created_device")
     filterset_class = OnboardingTaskFilter
     serializer_class = OnboardingTaskSerializer
+
+    @action(detail=False, methods=["post"], serializer_class=OnboardingBulkSerializer)
+    def bulk(self, request):
+        """Onboard a list of devices as batches, return the IDs of the created onboarding tasks."""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=["post"], serializer_class=OnboardingPrefixSerializer)
+    def prefix(self, request):
+        """Discover the devices listening on the onboarding port in a prefix and onboard them as a batch."""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        # Enforce object-level permissions on a sample of the tasks to create, discarded right away
+        data = serializer.validated_data
+        with transaction.atomic():
+            sample_task = OnboardingTask.objects.create(
+                ip_address=str(netaddr.IPNetwork(data["prefix"]).network),
+                site=data["site"],
+                port=data["port"],
+                timeout=data["timeout"],
+                role=data.get("role"),
+                platform=data.get("platform"),
+            )
+            permitted = OnboardingTask.objects.restrict(request.user, "add").filter(pk=sample_task.pk).exists()
+            transaction.set_rollback(True)
+
+        if not permitted:
+            raise PermissionDenied()
+
+        serializer.save()
+
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
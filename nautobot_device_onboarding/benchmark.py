@@ -0,0 +1,244 @@
+"""Offline benchmark of the onboarding pipeline, with mocked devices.
+
+(c) 2020-2021 Network To Code
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+  http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import ipaddress
+import math
+import time
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from nautobot.dcim.choices import InterfaceTypeChoices
+from nautobot.dcim.models import Device, DeviceRole, DeviceType, Interface, Manufacturer, Platform, Site
+from nautobot.extras.models import CustomField, Status
+from nautobot.ipam.models import IPAddress
+
+from .models import OnboardingTask
+from .netdev_keeper import NetdevKeeper
+from .onboard import OnboardingManager
+from .utils.credentials import Credentials
+
+PLUGIN_SETTINGS = settings.PLUGINS_CONFIG["nautobot_device_onboarding"]
+
+# Management addresses of the devices already present in Nautobot, and of the new devices
+EXISTING_DEVICES_NETWORK = ipaddress.IPv4Network("10.0.0.0/9")
+NEW_DEVICES_NETWORK = ipaddress.IPv4Network("10.128.0.0/9")
+MGMT_PREFIX_LENGTH = 9
+MGMT_IFNAME = "Management1"
+
+
+def device_name(ip_address):
+    """Return the hostname reported by the benchmark device at ip_address."""
+    return "bench-" + ip_address.replace(".", "-")
+
+
+class BenchmarkNapalmDriver:
+    """NAPALM driver of the benchmark devices, facts are derived from the device hostname (its IP address).
+
+    The `latency` class attribute, in seconds, is waited by each call to simulate device round trips.
+    """
+
+    latency = 0
+
+    def __init__(self, hostname, *args, **kwargs):
+        """Create a driver for the device at hostname."""
+        self.hostname = hostname
+
+    def _wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def open(self):
+        """Open the simulated session."""
+        self._wait()
+
+    def close(self):
+        """Close the simulated session."""
+
+    def get_facts(self):
+        """Return the device facts."""
+        self._wait()
+        return {
+            "hostname": device_name(self.hostname),
+            "model": "vEOS",
+            "serial_number": "BENCH" + self.hostname.replace(".", ""),
+            "vendor": "Arista",
+        }
+
+    def get_interfaces_ip(self):
+        """Return the management interface IP address."""
+        self._wait()
+        return {MGMT_IFNAME: {"ipv4": {self.hostname: {"prefix_length": MGMT_PREFIX_LENGTH}}}}
+
+
+def percentile(values, percent):
+    """Return the nearest-rank percentile of values, or None without values."""
+    if not values:
+        return None
+
+    values = sorted(values)
+    return values[max(0, math.ceil(len(values) * percent / 100) - 1)]
+
+
+def create_benchmark_fixtures(sites=50, devices=2000, custom_fields=10):
+    """Populate the database with the objects found in a production Nautobot.
+
+    Args:
+      sites (int): Number of sites, the devices being spread over them
+      devices (int): Number of devices already onboarded, each with a management interface and primary IP address
+      custom_fields (int): Number of custom fields with a default value, on devices, interfaces and IP addresses
+
+    Returns:
+      (list, Platform): the sites and the platform of the benchmark devices
+    """
+    device_status = Status.objects.get(name=PLUGIN_SETTINGS["default_device_status"])
+    ip_status = Status.objects.get(name=PLUGIN_SETTINGS["default_ip_status"])
+
+    site_objects = Site.objects.bulk_create(
+        [Site(name=f"Benchmark {index}", slug=f"bench-{index}", status=device_status) for index in range(sites)]
+    )
+    manufacturer = Manufacturer.objects.create(name="Arista", slug="arista")
+    device_type = DeviceType.objects.create(manufacturer=manufacturer, model="veos", slug="veos")
+    device_role = DeviceRole.objects.create(
+        name=PLUGIN_SETTINGS["default_device_role"],
+        slug=PLUGIN_SETTINGS["default_device_role"],
+        color=PLUGIN_SETTINGS["default_device_role_color"],
+    )
+    platform = Platform.objects.create(name="arista_eos", slug="arista_eos", napalm_driver="eos")
+
+    custom_field_data = {}
+    for index in range(custom_fields):
+        custom_field = CustomField.objects.create(name=f"bench_{index}", type="text", default=f"default-{index}")
+        custom_field.content_types.set(
+            [ContentType.objects.get_for_model(model) for model in (Device, Interface, IPAddress)]
+        )
+        custom_field_data[custom_field.name] = custom_field.default
+
+    hosts = EXISTING_DEVICES_NETWORK.hosts()
+    addresses = [str(next(hosts)) for _ in range(devices)]
+
+    device_objects = Device.objects.bulk_create(
+        [
+            Device(
+                name=device_name(address),
+                site=site_objects[index % sites],
+                device_type=device_type,
+                device_role=device_role,
+                platform=platform,
+                status=device_status,
+                serial="BENCH" + address.replace(".", ""),
+                _custom_field_data=custom_field_data,
+            )
+            for index, address in enumerate(addresses)
+        ]
+    )
+    interfaces = Interface.objects.bulk_create(
+        [
+            Interface(
+                name=MGMT_IFNAME,
+                device=device,
+                type=InterfaceTypeChoices.TYPE_OTHER,
+                _custom_field_data=custom_field_data,
+            )
+            for device in device_objects
+        ]
+    )
+    ip_addresses = IPAddress.objects.bulk_create(
+        [
+            IPAddress(
+                address=f"{address}/{MGMT_PREFIX_LENGTH}",
+                status=ip_status,
+                assigned_object=interface,
+                _custom_field_data=custom_field_data,
+            )
+            for address, interface in zip(addresses, interfaces)
+        ]
+    )
+
+    for device, ip_address in zip(device_objects, ip_addresses):
+        device.primary_ip4 = ip_address
+    Device.objects.bulk_update(device_objects, ["primary_ip4"])
+
+    return site_objects, platform
+
+
+def run_benchmark(sites, platform, tasks=200, existing_ratio=0.5, latency=0):
+    """Onboard mocked devices one task at a time, and measure the throughput of the pipeline.
+
+    Args:
+      sites (list): Sites the devices are spread over
+      platform (Platform): Platform of the devices
+      tasks (int): Number of onboarding tasks
+      existing_ratio (float): Share of the tasks re-onboarding a device created by create_benchmark_fixtures()
+      latency (float): Simulated round trip time of each NAPALM call, in seconds
+
+    Returns:
+      dict: tasks, failed tasks, tasks per second, mean and max queries per task, p95 latency overall and per phase
+    """
+    # Test tooling, only loaded when a benchmark is run
+    from unittest import mock  # pylint: disable=import-outside-toplevel
+
+    from django.db import connection  # pylint: disable=import-outside-toplevel
+    from django.test.utils import CaptureQueriesContext  # pylint: disable=import-outside-toplevel
+
+    existing = round(tasks * existing_ratio)
+    existing_hosts, new_hosts = EXISTING_DEVICES_NETWORK.hosts(), NEW_DEVICES_NETWORK.hosts()
+    addresses = [str(next(existing_hosts)) for _ in range(existing)]
+    addresses += [str(next(new_hosts)) for _ in range(tasks - existing)]
+
+    onboarding_tasks = [
+        OnboardingTask.objects.create(ip_address=address, site=sites[index % len(sites)], platform=platform)
+        for index, address in enumerate(addresses)
+    ]
+    credentials = Credentials("benchmark", "benchmark")
+
+    queries, latencies, errors = [], [], []
+    phase_latencies = {}
+
+    with mock.patch.object(BenchmarkNapalmDriver, "latency", latency), mock.patch(
+        "nautobot_device_onboarding.netdev_keeper.get_network_driver", return_value=BenchmarkNapalmDriver
+    ), mock.patch.object(NetdevKeeper, "check_reachability"):
+        started = time.monotonic()
+
+        for ot in onboarding_tasks:
+            task_started = time.monotonic()
+
+            with CaptureQueriesContext(connection) as captured:
+                try:
+                    OnboardingManager(
+                        ot=ot,
+                        username=credentials.username,
+                        password=credentials.password,
+                        secret=credentials.secret,
+                    )
+                except Exception as exc:  # pylint: disable=broad-except
+                    errors.append(f"{ot.ip_address}: {exc}")
+
+            latencies.append(time.monotonic() - task_started)
+            queries.append(len(captured))
+
+            for phase, duration in ot.phase_durations.items():
+                phase_latencies.setdefault(phase, []).append(duration)
+
+        elapsed = time.monotonic() - started
+
+    return {
+        "tasks": tasks,
+        "failed": len(errors),
+        "errors": errors[:10],
+        "tasks_per_second": round(tasks / elapsed, 2) if elapsed else None,
+        "queries_per_task": round(sum(queries) / len(queries), 1) if queries else None,
+        "queries_max": max(queries, default=None),
+        "latency_p95": percentile(latencies, 95),
+        "phases_p95": {phase: percentile(values, 95) for phase, values in sorted(phase_latencies.items())},
+    }
@@ -0,0 +1,246 @@
+"""Caching of onboarding lookups.
+
+(c) 2020-2021 Network To Code
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+  http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from nautobot.dcim.models import DeviceRole, DeviceType, Manufacturer, Platform, Site
+from nautobot.extras.models import CustomField, Status
+
+from .constants import NETMIKO_TO_NAPALM_STATIC
+
+PLUGIN_SETTINGS = settings.PLUGINS_CONFIG["nautobot_device_onboarding"]
+
+CACHE_KEY_PREFIX = "nautobot_device_onboarding"
+
+# Models looked up over and over again while onboarding devices, kept in memory by the reference cache
+REFERENCE_MODELS = (Site, Manufacturer, DeviceType, DeviceRole, Platform, Status, CustomField)
+
+
+def _device_type_cache_key(host, port, banner=None):
+    """Return the cache key of the Netmiko device type detected for host:port."""
+    key = f"{CACHE_KEY_PREFIX}:netmiko_device_type:{host}:{port}"
+
+    if banner:
+        key += ":" + hashlib.sha256(banner.encode()).hexdigest()
+
+    return key
+
+
+def get_cached_device_type(host, port, banner=None):
+    """Return the Netmiko device type previously detected for host:port, or None.
+
+    Args:
+      host (str): IP address of the device
+      port (int): Port used to connect to the device
+      banner (str): SSH server identification banner, to only match a device still running the same SSH server
+    """
+    if not PLUGIN_SETTINGS["device_type_cache_timeout"]:
+        return None
+
+    return cache.get(_device_type_cache_key(host, port, banner))
+
+
+def set_cached_device_type(host, port, device_type, banner=None):
+    """Remember the Netmiko device type detected for host:port for `device_type_cache_timeout` seconds."""
+    timeout = PLUGIN_SETTINGS["device_type_cache_timeout"]
+
+    if timeout:
+        cache.set(_device_type_cache_key(host, port, banner), device_type, timeout)
+
+
+def invalidate_cached_device_type(host, port, banner=None):
+    """Forget the Netmiko device type detected for host:port."""
+    cache.delete(_device_type_cache_key(host, port, banner))
+
+
+def _address_cache_key(hostname):
+    """Return the cache key of the IP address resolved for a hostname."""
+    return f"{CACHE_KEY_PREFIX}:address:" + hashlib.sha256(hostname.lower().encode()).hexdigest()
+
+
+def get_cached_addresses(hostnames):
+    """Return the IP addresses previously resolved for hostnames, for the hostnames found in the cache.
+
+    Returns:
+      dict: IP address, or None for a hostname that failed to resolve, keyed by hostname
+    """
+    cache_keys = {_address_cache_key(hostname): hostname for hostname in hostnames}
+
+    return {cache_keys[cache_key]: address or None for cache_key, address in cache.get_many(cache_keys).items()}
+
+
+def set_cached_addresses(addresses):
+    """Remember resolved IP addresses for `dns_cache_timeout` seconds, failures for `dns_negative_cache_timeout`.
+
+    Args:
+      addresses (dict): IP address, or None for a hostname that failed to resolve, keyed by hostname
+    """
+    for timeout, resolved in (
+        (PLUGIN_SETTINGS["dns_cache_timeout"], True),
+        (PLUGIN_SETTINGS["dns_negative_cache_timeout"], False),
+    ):
+        entries = {
+            _address_cache_key(hostname): address or ""
+            for hostname, address in addresses.items()
+            if bool(address) is resolved
+        }
+
+        if timeout and entries:
+            cache.set_many(entries, timeout)
+
+
+class ReferenceCache:
+    """In-process LRU cache of the reference objects shared by many onboarded devices.
+
+    Entries are grouped by model and dropped as soon as an object of their model is saved or deleted,
+    see `reference_object_changed`. Changes made by other processes are picked up once the entries
+    expire, after `reference_cache_timeout` seconds. Cached instances are shared by all the onboarding
+    tasks of the process and must not be modified.
+    """
+
+    def __init__(self):
+        """Create an empty cache."""
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._generations = {}
+
+    def get_or_load(self, model, key, loader):
+        """Return the cached value for (model, key), calling loader() to get it on a miss.
+
+        Exceptions raised by the loader, like DoesNotExist, are not cached. A value loaded inside a transaction
+        is only cached once the transaction is committed, as it may include objects that are rolled back later.
+
+        Args:
+          model (Model): Model class the value is derived from, used to invalidate the entry
+          key (hashable): Lookup criteria of the value within the model
+          loader (callable): Function returning the value
+        """
+        timeout = PLUGIN_SETTINGS["reference_cache_timeout"]
+        cache_key = (model._meta.label_lower, key)
+
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry and entry[1] > time.monotonic():
+                self._entries.move_to_end(cache_key)
+                return entry[0]
+            generation = self._generations.get(model._meta.label_lower, 0)
+
+        value = loader()
+
+        if timeout:
+            transaction.on_commit(lambda: self._store(cache_key, value, generation, timeout))
+
+        return value
+
+    def _store(self, cache_key, value, generation, timeout):
+        """Cache a value unless its model was changed since it was loaded."""
+        with self._lock:
+            if generation != self._generations.get(cache_key[0], 0):
+                return
+
+            self._entries[cache_key] = (value, time.monotonic() + timeout)
+            self._entries.move_to_end(cache_key)
+
+            while len(self._entries) > PLUGIN_SETTINGS["reference_cache_size"]:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, model=None):
+        """Drop the entries of a model, or all the entries."""
+        with self._lock:
+            if model is None:
+                labels = {label for label, _ in self._entries} | set(self._generations)
+            else:
+                labels = {model._meta.label_lower}
+
+            for label in labels:
+                self._generations[label] = self._generations.get(label, 0) + 1
+
+            for cache_key in [cache_key for cache_key in self._entries if cache_key[0] in labels]:
+                del self._entries[cache_key]
+
+
+reference_cache = ReferenceCache()
+
+
+def get_napalm_driver_map():
+    """Return the Netmiko device type (or Platform slug) to NAPALM driver map.
+
+    NETMIKO_TO_NAPALM_STATIC is updated with the NAPALM driver of every Nautobot Platform defining one.
+    The map is built once and shared by all the onboarding tasks of the process, see ReferenceCache.
+
+    Returns:
+      dict: NAPALM driver name keyed by Netmiko device type
+    """
+
+    def load():
+        platform_to_napalm_nautobot = dict(
+            Platform.objects.exclude(napalm_driver="").values_list("slug", "napalm_driver").order_by()
+        )
+        return {**NETMIKO_TO_NAPALM_STATIC, **platform_to_napalm_nautobot}
+
+    return reference_cache.get_or_load(Platform, "napalm_driver_map", load)
+
+
+def get_custom_field_defaults(model):
+    """Return the default value of the custom fields of a model defining one.
+
+    Args:
+      model (Model): Model class of the objects to create
+
+    Returns:
+      dict: Custom field default value keyed by custom field name, shared by all the callers and not to be modified
+    """
+    content_type = ContentType.objects.get_for_model(model)
+
+    return reference_cache.get_or_load(
+        CustomField,
+        content_type.pk,
+        lambda: {cf.name: cf.default for cf in CustomField.objects.get_for_model(model) if cf.default is not None},
+    )
+
+
+def invalidate_reference_objects(model):
+    """Invalidate the cached objects of a model now, and again once the current transaction is committed."""
+    reference_cache.invalidate(model)
+    transaction.on_commit(lambda: reference_cache.invalidate(model))
+
+
+def reference_object_changed(sender, **kwargs):  # pylint: disable=unused-argument
+    """Invalidate the cached objects of a model when one of them is saved or deleted."""
+    invalidate_reference_objects(sender)
+
+
+def status_content_types_changed(sender, **kwargs):  # pylint: disable=unused-argument
+    """Invalidate the cached Statuses when the content types a Status applies to are changed."""
+    invalidate_reference_objects(Status)
+
+
+def custom_field_content_types_changed(sender, **kwargs):  # pylint: disable=unused-argument
+    """Invalidate the cached custom field defaults when the content types of a CustomField are changed."""
+    invalidate_reference_objects(CustomField)
+
+
+for reference_model in REFERENCE_MODELS:
+    post_save.connect(reference_object_changed, sender=reference_model)
+    post_delete.connect(reference_object_changed, sender=reference_model)
+m2m_changed.connect(status_content_types_changed, sender=Status.content_types.through)
+m2m_changed.connect(custom_field_content_types_changed, sender=CustomField.content_types.through)
@@ -0,0 +1,109 @@
+"""Lifecycle of the connections opened to the onboarded devices.
+
+(c) 2020-2021 Network To Code
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+  http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import logging
+import os
+import threading
+from contextlib import contextmanager, nullcontext
+
+from .metrics import (
+    napalm_session_close_errors_counter,
+    napalm_sessions_counter,
+    napalm_sessions_open_gauge,
+    worker_open_fds_gauge,
+)
+
+logger = logging.getLogger("rq.worker")
+
+_lock = threading.Lock()
+_sessions_opened = 0
+_recycle_requested = False
+
+
+def count_open_fds():
+    """Return the number of file descriptors open by the current process, or None when unknown."""
+    try:
+        return len(os.listdir("/proc/self/fd"))
+    except OSError:
+        return None
+
+
+def update_open_fds_gauge():
+    """Refresh the gauge of the file descriptors open by the current process."""
+    open_fds = count_open_fds()
+
+    if open_fds is not None:
+        worker_open_fds_gauge.set(open_fds)
+
+
+@contextmanager
+def napalm_session(napalm_device, opened=False, open_phase=None):
+    """Open a NAPALM session and make sure it is closed whatever happens while it is used.
+
+    Args:
+      napalm_device (NetworkDriver): NAPALM driver instance of the device
+      opened (bool): True when the session is already open, e.g. handed over from Netmiko autodetection
+      open_phase (contextmanager): Context manager timing the opening of the session, see metrics.observe_phase()
+
+    Yields:
+      NetworkDriver: the NAPALM driver with its session open
+    """
+    global _sessions_opened  # pylint: disable=global-statement
+
+    with _lock:
+        _sessions_opened += 1
+
+    napalm_sessions_counter.inc()
+    napalm_sessions_open_gauge.inc()
+
+    try:
+        if not opened:
+            with open_phase or nullcontext():
+                napalm_device.open()
+            opened = True
+
+        yield napalm_device
+
+    finally:
+        try:
+            napalm_device.close()
+        except Exception as exc:  # pylint: disable=broad-except
+            # A session that failed to open has nothing to close, do not account it as leaked
+            if opened:
+                napalm_session_close_errors_counter.inc()
+                logger.warning("WARNING: unable to close NAPALM session to %s: %s", napalm_device.hostname, exc)
+
+        napalm_sessions_open_gauge.dec()
+        update_open_fds_gauge()
+
+
+def sessions_opened():
+    """Return the number of NAPALM sessions opened by the current process."""
+    return _sessions_opened
+
+
+def claim_recycle(max_sessions):
+    """Tell whether the current process must be recycled, once it has opened `max_sessions` NAPALM sessions.
+
+    Only the first call past the threshold returns True, so that the recycle is requested once.
+    """
+    global _recycle_requested  # pylint: disable=global-statement
+
+    with _lock:
+        if not max_sessions or _recycle_requested or _sessions_opened < max_sessions:
+            return False
+
+        _recycle_requested = True
+
+    return True
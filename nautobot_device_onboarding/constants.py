@@ -7,3 +7,14 @@ NETMIKO_TO_NAPALM_STATIC = {
     "juniper_junos": "junos",
     "cisco_xr": "iosxr",
 }
+
+# NAPALM drivers running on top of a Netmiko SSH session, with the Netmiko device type of the session
+NAPALM_NETMIKO_DEVICE_TYPES = {
+    "ios": "cisco_ios",
+    "nxos_ssh": "cisco_nxos",
+}
+
+# Maximum number of seconds to wait for the identification string of an SSH server, and its maximum length,
+# including the lines of text RFC 4253 allows the server to send before it
+SSH_BANNER_TIMEOUT = 5
+SSH_BANNER_MAX_LENGTH = 1024
@@ -12,8 +12,10 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+from datetime import timedelta
+
 import django_filters
-from django.db.models import Q
+from django.db.models import F, Q
 
 from nautobot.dcim.models import Site, DeviceRole, Platform
 from nautobot.utilities.filters import NameSlugSearchFilterSet
@@ -55,9 +57,43 @@ class OnboardingTaskFilter(NameSlugSearchFilterSet):
         label="Device Role (slug)",
     )
 
+    finished_after = django_filters.DateTimeFilter(
+        field_name="finished",
+        lookup_expr="gte",
+        label="Finished after",
+    )
+
+    finished_before = django_filters.DateTimeFilter(
+        field_name="finished",
+        lookup_expr="lt",
+        label="Finished before",
+    )
+
+    min_duration = django_filters.NumberFilter(
+        method="filter_min_duration",
+        label="Minimum processing duration (sec)",
+    )
+
+    min_queue_wait = django_filters.NumberFilter(
+        method="filter_min_queue_wait",
+        label="Minimum queue wait (sec)",
+    )
+
     class Meta:  # noqa: D106 "Missing docstring in public nested class"
         model = OnboardingTask
-        fields = ["id", "site", "site_id", "platform", "role", "status", "failed_reason"]
+        fields = [
+            "id",
+            "site",
+            "site_id",
+            "platform",
+            "role",
+            "status",
+            "failed_reason",
+            "finished_after",
+            "finished_before",
+            "min_duration",
+            "min_queue_wait",
+        ]
 
     def search(self, queryset, name, value):  # pylint: disable=unused-argument, no-self-use
         """Perform the filtered search."""
@@ -74,3 +110,11 @@ class OnboardingTaskFilter(NameSlugSearchFilterSet):
             | Q(message__icontains=value)
         )
         return queryset.filter(qs_filter)
+
+    def filter_min_duration(self, queryset, name, value):  # pylint: disable=unused-argument, no-self-use
+        """Return the tasks whose processing, from start to finish, took at least `value` seconds."""
+        return queryset.filter(finished__gte=F("started") + timedelta(seconds=float(value)))
+
+    def filter_min_queue_wait(self, queryset, name, value):  # pylint: disable=unused-argument, no-self-use
+        """Return the tasks that waited at least `value` seconds between being enqueued and started."""
+        return queryset.filter(started__gte=F("enqueued") + timedelta(seconds=float(value)))
@@ -12,16 +12,24 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import csv
+from io import StringIO
+
 from django import forms
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist, ValidationError
 from django.db import transaction
 
 from nautobot.utilities.forms import BootstrapMixin, CSVModelForm
 from nautobot.dcim.models import Site, Platform, DeviceRole, DeviceType
 
+from .helpers import bulk_create_onboarding_tasks, resolve_onboarding_tasks
 from .models import OnboardingTask
 from .choices import OnboardingStatusChoices, OnboardingFailChoices
 from .utils.credentials import Credentials
-from .worker import enqueue_onboarding_task
+from .worker import enqueue_onboarding_batches, enqueue_onboarding_task
+
+PLUGIN_SETTINGS = settings.PLUGINS_CONFIG["nautobot_device_onboarding"]
 
 BLANK_CHOICE = (("", "---------"),)
 
@@ -78,9 +86,12 @@ class OnboardingTaskForm(BootstrapMixin, forms.ModelForm):
         ]
 
     def save(self, commit=True, **kwargs):
-        """Save the model, and add it and the associated credentials to the onboarding worker queue."""
+        """Save the model, and add it and the associated credentials to the onboarding worker queue.
+
+        An FQDN is resolved right away, the task is failed without being enqueued when it does not resolve.
+        """
         model = super().save(commit=commit, **kwargs)
-        if commit:
+        if commit and resolve_onboarding_tasks([model])[0]:
             credentials = Credentials(self.data.get("username"), self.data.get("password"), self.data.get("secret"))
             transaction.on_commit(lambda: enqueue_onboarding_task(model.pk, credentials))
         return model
@@ -173,9 +184,150 @@ class OnboardingTaskFeedCSVForm(CSVModelForm):
         ]
 
     def save(self, commit=True, **kwargs):
-        """Save the model, and add it and the associated credentials to the onboarding worker queue."""
+        """Save the model, and add it and the associated credentials to the onboarding worker queue.
+
+        An FQDN is resolved right away, the task is failed without being enqueued when it does not resolve.
+        """
         model = super().save(commit=commit, **kwargs)
-        if commit:
+        if commit and resolve_onboarding_tasks([model])[0]:
             credentials = Credentials(self.data.get("username"), self.data.get("password"), self.data.get("secret"))
             transaction.on_commit(lambda: enqueue_onboarding_task(model.pk, credentials))
         return model
+
+
+class OnboardingTaskFeedCSVImportForm(BootstrapMixin, forms.Form):
+    """Form to paste the CSV data bulk-imported by import_onboarding_tasks.
+
+    Only the column headers are validated here, the rows are validated while they are imported.
+    """
+
+    csv = forms.CharField(widget=forms.Textarea, help_text="One device per line, with a first line of column headers")
+
+    def clean_csv(self):
+        """Validate the column headers against the fields of OnboardingTaskFeedCSVForm."""
+        value = self.cleaned_data["csv"].strip()
+        headers = [header.strip() for header in next(csv.reader(StringIO(value)), [])]
+
+        for header in headers:
+            if header not in OnboardingTaskFeedCSVForm.base_fields:
+                raise forms.ValidationError(f'Unexpected column header "{header}" found.')
+
+        for name, field in OnboardingTaskFeedCSVForm.base_fields.items():
+            if field.required and name not in headers:
+                raise forms.ValidationError(f'Required column header "{name}" not found.')
+
+        return value
+
+
+def import_onboarding_tasks(csv_data, queryset, chunk_size=None):
+    """Create and enqueue one OnboardingTask per row of CSV data.
+
+    The rows are read one at a time and inserted with bulk_create by chunks of `chunk_size` rows. The related
+    objects are resolved from slug maps built once per import. Once the transaction is committed, the tasks of
+    each chunk are enqueued as batch onboarding jobs, one per set of credentials, all the jobs at once. The caller
+    is expected to run the import in a transaction and to roll it back when an error is raised.
+
+    Args:
+      csv_data (str): CSV data with a first line of column headers, see OnboardingTaskFeedCSVForm for the columns
+      queryset (QuerySet): OnboardingTasks the user is allowed to create
+      chunk_size (int): Number of rows inserted per query, defaults to the `batch_size` plugin setting
+
+    Returns:
+      list: the created OnboardingTasks
+
+    Raises:
+      ValidationError: listing the invalid rows
+      ObjectDoesNotExist: when the user is not allowed to create some of the tasks
+    """
+    chunk_size = chunk_size or PLUGIN_SETTINGS["batch_size"]
+    related_objects = {
+        "site": {site.slug: site for site in Site.objects.all()},
+        "platform": {platform.slug: platform for platform in Platform.objects.all()},
+        "role": {role.slug: role for role in DeviceRole.objects.all()},
+    }
+    device_type_slugs = set(DeviceType.objects.values_list("slug", flat=True))
+
+    onboarding_tasks, batches, chunk, errors = [], [], [], []
+
+    reader = csv.reader(StringIO(csv_data))
+    headers = [header.strip() for header in next(reader)]
+
+    for row_number, row in enumerate(reader, start=1):
+        if len(row) != len(headers):
+            errors.append(f"Row {row_number}: Expected {len(headers)} columns but found {len(row)}")
+            continue
+
+        data = {header: value.strip() for header, value in zip(headers, row)}
+        row_errors = []
+        ot = OnboardingTask(ip_address=data["ip_address"])
+
+        if not ot.ip_address:
+            row_errors.append(f"Row {row_number} ip_address: This field is required.")
+
+        for field_name, objects in related_objects.items():
+            slug = data.get(field_name)
+            if slug and slug not in objects:
+                row_errors.append(f"Row {row_number} {field_name}: {field_name.capitalize()} not found")
+            elif slug:
+                setattr(ot, field_name, objects[slug])
+            elif OnboardingTaskFeedCSVForm.base_fields[field_name].required:
+                row_errors.append(f"Row {row_number} {field_name}: This field is required.")
+
+        if data.get("device_type") and data["device_type"] not in device_type_slugs:
+            row_errors.append(f"Row {row_number} device_type: DeviceType not found")
+        elif data.get("device_type"):
+            ot.device_type = data["device_type"]
+
+        for field_name in ("port", "timeout"):
+            if data.get(field_name):
+                try:
+                    setattr(ot, field_name, OnboardingTask._meta.get_field(field_name).clean(data[field_name], ot))
+                except ValidationError as err:
+                    row_errors.append(f"Row {row_number} {field_name}: {err.messages[0]}")
+
+        errors.extend(row_errors)
+
+        # Keep validating the following rows to report all the errors, but stop inserting
+        if errors:
+            continue
+
+        credentials = Credentials(data.get("username"), data.get("password"), data.get("secret"))
+        chunk.append((ot, credentials))
+
+        if len(chunk) == chunk_size:
+            onboarding_tasks.extend(_import_onboarding_tasks_chunk(chunk, queryset, batches))
+            chunk = []
+
+    if not errors and chunk:
+        onboarding_tasks.extend(_import_onboarding_tasks_chunk(chunk, queryset, batches))
+
+    if errors:
+        raise ValidationError(errors)
+
+    transaction.on_commit(lambda: enqueue_onboarding_batches(batches))
+
+    return onboarding_tasks
+
+
+def _import_onboarding_tasks_chunk(chunk, queryset, batches):
+    """Insert a chunk of (OnboardingTask, Credentials), add its batches of resolved tasks to enqueue to `batches`."""
+    onboarding_tasks = bulk_create_onboarding_tasks([ot for ot, _ in chunk])
+
+    # Enforce object-level permissions
+    if queryset.filter(pk__in=[ot.pk for ot in onboarding_tasks]).count() != len(onboarding_tasks):
+        raise ObjectDoesNotExist
+
+    _, failed = resolve_onboarding_tasks(onboarding_tasks)
+    failed_ids = {ot.pk for ot in failed}
+
+    task_ids_by_credentials = {}
+    for ot, credentials in chunk:
+        if ot.pk in failed_ids:
+            continue
+
+        key = (credentials.username, credentials.password, credentials.secret)
+        task_ids_by_credentials.setdefault(key, (credentials, []))[1].append(ot.pk)
+
+    batches.extend((task_ids, credentials) for credentials, task_ids in task_ids_by_credentials.values())
+
+    return onboarding_tasks
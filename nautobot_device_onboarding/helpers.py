@@ -12,28 +12,102 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import logging
 import socket
+from concurrent.futures import ThreadPoolExecutor, wait
 
 import netaddr
+from django.conf import settings
+from django.utils import timezone
 from netaddr.core import AddrFormatError
 
+from .cache import get_cached_addresses, set_cached_addresses
+from .choices import OnboardingFailChoices, OnboardingStatusChoices
 from .exceptions import OnboardException
+from .metrics import observe_phase, onboardingtask_results_counter
+from .models import OnboardingTask
 
+logger = logging.getLogger("rq.worker")
 
-def onboarding_task_fqdn_to_ip(ot):
-    """Method to assure OT has FQDN resolved to IP address and rewritten into OT.
+PLUGIN_SETTINGS = settings.PLUGINS_CONFIG["nautobot_device_onboarding"]
 
-    If it is a DNS name, attempt to resolve the DNS address and assign the IP address to the
-    name.
+
+def resolve_hostname(hostname):
+    """Resolve a hostname to an IP address, IPv4 preferably, IPv6 for hostnames without an IPv4 address.
 
     Returns:
-        None
+      str: IP address, or None when the hostname does not resolve
+    """
+    try:
+        with observe_phase("dns"):
+            try:
+                addr_infos = socket.getaddrinfo(hostname, None, proto=socket.IPPROTO_TCP)
+            except (socket.gaierror, UnicodeError) as exc:
+                raise OnboardException(reason="fail-dns", message=str(exc))
+    except OnboardException:
+        return None
+
+    addr_infos = sorted(addr_infos, key=lambda addr_info: addr_info[0] != socket.AF_INET)
+
+    return addr_infos[0][4][0] if addr_infos else None
+
+
+def resolve_hostnames(hostnames, timeout=None):
+    """Resolve many hostnames to an IP address concurrently, see resolve_hostname().
+
+    Resolved addresses are cached for `dns_cache_timeout` seconds and failures for `dns_negative_cache_timeout`
+    seconds. The hostnames still resolving after `timeout` seconds are failed without waiting for the resolver,
+    so that a DNS outage fails all the hostnames at once.
+
+    Args:
+      hostnames (iterable): Hostnames to resolve
+      timeout (int): Maximum number of seconds to wait for the resolution of all the hostnames, defaults to the
+        `dns_timeout` plugin setting
+
+    Returns:
+      dict: IP address, or None when the resolution failed, keyed by hostname
+    """
+    hostnames = list(dict.fromkeys(hostnames))
+    addresses = get_cached_addresses(hostnames)
+    pending = [hostname for hostname in hostnames if hostname not in addresses]
+
+    if not pending:
+        return addresses
+
+    logger.info("RESOLVE: %s hostnames", len(pending))
+    resolved = {}
+    executor = ThreadPoolExecutor(max_workers=min(PLUGIN_SETTINGS["dns_concurrency"], len(pending)))
+
+    try:
+        futures = {executor.submit(resolve_hostname, hostname): hostname for hostname in pending}
+        done, not_done = wait(futures, timeout=timeout or PLUGIN_SETTINGS["dns_timeout"])
+
+        for future in done:
+            resolved[futures[future]] = future.result()
+
+        for future in not_done:
+            future.cancel()
+            resolved[futures[future]] = None
+
+        if not_done:
+            logger.warning("RESOLVE: %s hostnames timed out", len(not_done))
+
+    finally:
+        # Hung lookups are left to complete in the background
+        executor.shutdown(wait=False)
+
+    set_cached_addresses(resolved)
+    addresses.update(resolved)
+
+    return addresses
+
+
+def _is_ip_address(ot):
+    """Tell whether an OnboardingTask was given an IP address, rather than an FQDN to resolve.
 
     Raises:
       OnboardException("fail-general"):
         When a prefix was entered for an IP address
-      OnboardException("fail-dns"):
-        When a Name lookup via DNS fails to resolve an IP address
     """
     try:
         # If successful, this is an IP address and can pass
@@ -43,10 +117,114 @@ def onboarding_task_fqdn_to_ip(ot):
         raise OnboardException(reason="fail-general", message=f"ERROR appears a prefix was entered: {ot.ip_address}")
     # An AddrFormatError exception means that there is not an IP address in the field, and should continue on
     except AddrFormatError:
+        return False
+
+    return True
+
+
+def onboarding_task_fqdn_to_ip(ot):
+    """Method to assure OT has FQDN resolved to IP address and rewritten into OT.
+
+    If it is a DNS name, attempt to resolve the DNS address and assign the IP address to the
+    name. The OnboardingTask is not saved.
+
+    Returns:
+        None
+
+    Raises:
+      OnboardException("fail-general"):
+        When a prefix was entered for an IP address
+      OnboardException("fail-dns"):
+        When a Name lookup via DNS fails to resolve an IP address
+    """
+    if _is_ip_address(ot):
+        return
+
+    address = resolve_hostnames([ot.ip_address])[ot.ip_address]
+
+    if not address:
+        # DNS Lookup has failed, Raise an exception for unable to complete DNS lookup
+        raise OnboardException(reason="fail-dns", message=f"ERROR failed to complete DNS lookup: {ot.ip_address}")
+
+    ot.ip_address = address
+
+
+def resolve_onboarding_tasks(onboarding_tasks):
+    """Resolve the FQDN of many OnboardingTasks to an IP address at once.
+
+    The FQDNs are resolved concurrently, see resolve_hostnames(). The resolved tasks are updated
+    with their IP address, and the tasks failing to resolve are marked as failed, each with a
+    single query.
+
+    Args:
+      onboarding_tasks (list): saved OnboardingTask instances
+
+    Returns:
+      (list, list): OnboardingTasks with an IP address, failed OnboardingTasks
+    """
+    to_resolve, resolved, failed = [], [], []
+
+    for ot in onboarding_tasks:
         try:
-            # Perform DNS Lookup
-            ot.ip_address = socket.gethostbyname(ot.ip_address)
-            ot.save()
-        except socket.gaierror:
-            # DNS Lookup has failed, Raise an exception for unable to complete DNS lookup
-            raise OnboardException(reason="fail-dns", message=f"ERROR failed to complete DNS lookup: {ot.ip_address}")
+            if not _is_ip_address(ot):
+                to_resolve.append(ot)
+        except OnboardException as exc:
+            ot.failed_reason, ot.message = exc.reason, exc.message
+            failed.append(ot)
+
+    addresses = resolve_hostnames(ot.ip_address for ot in to_resolve) if to_resolve else {}
+
+    for ot in to_resolve:
+        address = addresses[ot.ip_address]
+
+        if address:
+            ot.ip_address = address
+            resolved.append(ot)
+        else:
+            ot.failed_reason = OnboardingFailChoices.FAIL_DNS
+            ot.message = f"ERROR failed to complete DNS lookup: {ot.ip_address}"
+            failed.append(ot)
+
+    if resolved:
+        OnboardingTask.objects.bulk_update(resolved, ["ip_address"])
+
+    if failed:
+        now = timezone.now()
+        for ot in failed:
+            ot.status = OnboardingStatusChoices.STATUS_FAILED
+            ot.last_updated = now
+            ot.finished = now
+
+        OnboardingTask.objects.bulk_update(failed, ["status", "failed_reason", "message", "last_updated", "finished"])
+        onboardingtask_results_counter.labels(status=OnboardingStatusChoices.STATUS_FAILED).inc(len(failed))
+        logger.info("RESOLVE: %s of %s onboarding tasks failed", len(failed), len(onboarding_tasks))
+
+    failed_ids = {ot.pk for ot in failed}
+
+    return [ot for ot in onboarding_tasks if ot.pk not in failed_ids], failed
+
+
+def primary_ip_field(ip_address):
+    """Return the name of the Device primary IP field for an IP address, "primary_ip4" or "primary_ip6"."""
+    return "primary_ip6" if netaddr.IPAddress(ip_address).version == 6 else "primary_ip4"
+
+
+def bulk_create_onboarding_tasks(onboarding_tasks, batch_size=None):
+    """Label and insert many unsaved OnboardingTasks at once.
+
+    OnboardingTask.save() is bypassed by bulk_create, so the labels are reserved at once and assigned
+    here following the order of the given tasks.
+
+    Args:
+      onboarding_tasks (list): unsaved OnboardingTask instances
+      batch_size (int): Maximum number of rows inserted per query
+
+    Returns:
+      list: the created OnboardingTasks
+    """
+    onboarding_tasks = list(onboarding_tasks)
+
+    for ot, label in zip(onboarding_tasks, OnboardingTask.reserve_labels(len(onboarding_tasks))):
+        ot.label = label
+
+    return OnboardingTask.objects.bulk_create(onboarding_tasks, batch_size=batch_size)
@@ -0,0 +1 @@
+"""Django management commands for nautobot_device_onboarding plugin."""
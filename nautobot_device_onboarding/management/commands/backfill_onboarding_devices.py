@@ -0,0 +1,98 @@
+"""Record the latest onboarding task of the devices onboarded before it was tracked on OnboardingDevice.
+
+(c) 2020-2021 Network To Code
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+  http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from nautobot_device_onboarding.choices import OnboardingStatusChoices
+from nautobot_device_onboarding.models import OnboardingDevice, OnboardingTask
+
+UPDATE_FIELDS = ["last_task", "last_status", "last_attempt_date", "last_success_date"]
+
+
+class Command(BaseCommand):
+    """Backfill the last_* fields of OnboardingDevice from the existing OnboardingTasks."""
+
+    help = "Record the latest onboarding task of the devices onboarded before it was tracked on OnboardingDevice."
+
+    def add_arguments(self, parser):
+        """Add the command options."""
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Update all the devices, not only those without a latest onboarding task recorded",
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=1000, help="Number of devices processed per query (default 1000)"
+        )
+
+    def handle(self, *args, **options):
+        """Match the OnboardingTasks to the devices by primary IP address, one batch of devices at a time."""
+        onboarding_devices = OnboardingDevice.objects.filter(
+            Q(device__primary_ip4__isnull=False) | Q(device__primary_ip6__isnull=False)
+        ).select_related("device__primary_ip4", "device__primary_ip6")
+        if not options["all"]:
+            onboarding_devices = onboarding_devices.filter(last_task__isnull=True)
+
+        batch, updated = [], 0
+        for onboarding_device in onboarding_devices.iterator(chunk_size=options["batch_size"]):
+            batch.append(onboarding_device)
+
+            if len(batch) == options["batch_size"]:
+                updated += self.backfill(batch)
+                batch = []
+
+        if batch:
+            updated += self.backfill(batch)
+
+        self.stdout.write(self.style.SUCCESS(f"Recorded the latest onboarding task of {updated} devices"))
+
+    @staticmethod
+    def backfill(onboarding_devices):
+        """Update a batch of OnboardingDevices, return the number of updated devices."""
+        ip_addresses = {}
+        for onboarding_device in onboarding_devices:
+            ip_addresses[onboarding_device] = [
+                primary_ip.address.ip.format()
+                for primary_ip in (onboarding_device.device.primary_ip4, onboarding_device.device.primary_ip6)
+                if primary_ip is not None
+            ]
+
+        latest, latest_succeeded = {}, {}
+        onboarding_tasks = (
+            OnboardingTask.objects.filter(ip_address__in={ip for ips in ip_addresses.values() for ip in ips})
+            .only("id", "ip_address", "status", "created", "last_updated")
+            .order_by("last_updated")
+        )
+        for ot in onboarding_tasks:
+            latest[ot.ip_address] = ot
+            if ot.status == OnboardingStatusChoices.STATUS_SUCCEEDED:
+                latest_succeeded[ot.ip_address] = ot
+
+        updated = []
+        for onboarding_device, ips in ip_addresses.items():
+            # A device with both an IPv4 and an IPv6 primary address may have been onboarded through either
+            device_tasks = [latest[ip] for ip in ips if ip in latest]
+            if not device_tasks:
+                continue
+
+            onboarding_device.record_onboarding_task(max(device_tasks, key=lambda ot: ot.last_updated))
+            device_succeeded = [latest_succeeded[ip] for ip in ips if ip in latest_succeeded]
+            if device_succeeded:
+                onboarding_device.last_success_date = max(device_succeeded, key=lambda ot: ot.last_updated).created
+            updated.append(onboarding_device)
+
+        OnboardingDevice.objects.bulk_update(updated, UPDATE_FIELDS)
+
+        return len(updated)
@@ -0,0 +1,85 @@
+"""Benchmark the onboarding pipeline with mocked devices, in a throwaway database.
+
+(c) 2020-2021 Network To Code
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+  http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_databases, teardown_databases
+
+from nautobot_device_onboarding.benchmark import create_benchmark_fixtures, run_benchmark
+
+
+class Command(BaseCommand):
+    """Measure the throughput of OnboardingManager and NautobotKeeper.ensure_device over a populated database."""
+
+    help = (
+        "Onboard mocked devices over a database populated with sites, devices and custom fields, and report "
+        "the tasks per second, queries per task and p95 latency per phase. The benchmark runs in a test "
+        "database created for the occasion, like the unit tests, and never contacts any device."
+    )
+
+    def add_arguments(self, parser):
+        """Add the command options."""
+        parser.add_argument("--sites", type=int, default=50, help="Number of sites (default 50)")
+        parser.add_argument("--devices", type=int, default=2000, help="Number of existing devices (default 2000)")
+        parser.add_argument(
+            "--custom-fields", type=int, default=10, help="Number of custom fields with a default (default 10)"
+        )
+        parser.add_argument("--tasks", type=int, default=200, help="Number of onboarding tasks (default 200)")
+        parser.add_argument(
+            "--existing-ratio",
+            type=float,
+            default=0.5,
+            help="Share of the tasks re-onboarding an existing device (default 0.5)",
+        )
+        parser.add_argument(
+            "--latency", type=float, default=0, help="Simulated latency of each NAPALM call, in seconds (default 0)"
+        )
+        parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+
+    def handle(self, *args, **options):
+        """Create the test database, run the benchmark and report its results."""
+        if options["tasks"] < 1:
+            raise CommandError("At least one onboarding task must be run")
+
+        old_config = setup_databases(verbosity=options["verbosity"], interactive=False)
+
+        try:
+            sites, platform = create_benchmark_fixtures(
+                sites=options["sites"], devices=options["devices"], custom_fields=options["custom_fields"]
+            )
+            report = run_benchmark(
+                sites,
+                platform,
+                tasks=options["tasks"],
+                existing_ratio=options["existing_ratio"],
+                latency=options["latency"],
+            )
+        finally:
+            teardown_databases(old_config, verbosity=options["verbosity"])
+
+        if options["json"]:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        self.stdout.write(f"Tasks:            {report['tasks']} ({report['failed']} failed)")
+        self.stdout.write(f"Tasks per second: {report['tasks_per_second']}")
+        self.stdout.write(f"Queries per task: {report['queries_per_task']} (max {report['queries_max']})")
+        self.stdout.write(f"Task latency p95: {report['latency_p95']:.3f}s")
+        self.stdout.write("Phase latency p95:")
+        for phase, latency in report["phases_p95"].items():
+            self.stdout.write(f"  {phase:<28} {latency:.3f}s")
+
+        for error in report["errors"]:
+            self.stdout.write(self.style.ERROR(error))
@@ -0,0 +1,119 @@
+"""Serve simulated SSH network devices, to load test the onboarding.
+
+(c) 2020-2021 Network To Code
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+  http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import json
+import logging
+import threading
+
+from django.core.management.base import BaseCommand, CommandError
+
+from nautobot_device_onboarding.simulator import PROFILES, DeviceSimulator, simulated_devices
+
+
+class Command(BaseCommand):
+    """Serve simulated IOS, EOS and NX-OS devices over SSH until interrupted."""
+
+    help = (
+        "Serve simulated network devices over SSH on consecutive local IP addresses, answering the Netmiko "
+        "autodetection and the NAPALM getters used by the onboarding with configurable latency, errors and "
+        "output size."
+    )
+
+    def add_arguments(self, parser):
+        """Add the command options."""
+        parser.add_argument("--count", type=int, default=100, help="Number of devices (default 100)")
+        parser.add_argument(
+            "--address",
+            default="127.0.1.1",
+            help="IP address of the first device, the next devices using the next addresses (default 127.0.1.1)",
+        )
+        parser.add_argument("--port", type=int, default=2222, help="SSH port of the devices (default 2222)")
+        parser.add_argument(
+            "--device-types",
+            nargs="+",
+            help=f"Netmiko device types of the devices, cycled over (default all: {', '.join(PROFILES)})",
+        )
+        parser.add_argument("--latency", type=float, default=0, help="Latency of each command, in seconds")
+        parser.add_argument("--jitter", type=float, default=0, help="Maximum random latency added, in seconds")
+        parser.add_argument("--auth-failure-rate", type=float, default=0, help="Share of the logins rejected")
+        parser.add_argument(
+            "--command-error-rate", type=float, default=0, help="Share of the commands answered with an error"
+        )
+        parser.add_argument(
+            "--output-lines", type=int, default=0, help="Number of filler lines added to the show version output"
+        )
+        parser.add_argument(
+            "--profiles",
+            help="JSON file of platform profiles, updating the built-in ones, e.g. to add or change command outputs",
+        )
+        parser.add_argument(
+            "--csv",
+            metavar="SITE",
+            help="Print the devices as CSV rows to import as onboarding tasks of the given site (slug)",
+        )
+
+    def handle(self, *args, **options):
+        """Serve the devices until interrupted."""
+        profiles = {name: dict(profile, commands=dict(profile["commands"])) for name, profile in PROFILES.items()}
+
+        if options["profiles"]:
+            with open(options["profiles"]) as profiles_file:
+                for name, profile in json.load(profiles_file).items():
+                    commands = {**profiles.get(name, {}).get("commands", {}), **profile.get("commands", {})}
+                    profiles[name] = {**profiles.get(name, {}), **profile, "commands": commands}
+
+        unknown = set(options["device_types"] or []) - set(profiles)
+        if unknown:
+            raise CommandError(f"No profile for the device types: {', '.join(sorted(unknown))}")
+
+        devices = simulated_devices(
+            options["count"],
+            address=options["address"],
+            port=options["port"],
+            device_types=options["device_types"] or list(profiles),
+            latency=options["latency"],
+            jitter=options["jitter"],
+            auth_failure_rate=options["auth_failure_rate"],
+            command_error_rate=options["command_error_rate"],
+            output_lines=options["output_lines"],
+            profiles=profiles,
+        )
+
+        # Reachability checks and SSH banner reads disconnect before the SSH handshake
+        logging.getLogger("paramiko").setLevel(logging.CRITICAL)
+
+        try:
+            simulator = DeviceSimulator(devices)
+            simulator.start()
+        except OSError as exc:
+            raise CommandError(
+                f"Unable to listen on {devices[0].address}:{devices[0].port} and the following addresses: {exc}"
+            )
+
+        if options["csv"]:
+            self.stdout.write("site,ip_address,port")
+            for device in devices:
+                self.stdout.write(f"{options['csv']},{device.address},{device.port}")
+
+        self.stderr.write(
+            f"Serving {len(devices)} devices from {devices[0].address} to {devices[-1].address} "
+            f"on port {options['port']}, interrupt to stop"
+        )
+
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            simulator.stop()
@@ -0,0 +1,52 @@
+"""Serve the metrics of all the onboarding worker processes of a host.
+
+(c) 2020-2021 Network To Code
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+  http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from wsgiref.simple_server import make_server
+
+from django.core.management.base import BaseCommand, CommandError
+from prometheus_client import CollectorRegistry, make_wsgi_app, multiprocess
+
+from nautobot_device_onboarding.metrics import MULTIPROCESS_DIR
+
+
+class Command(BaseCommand):
+    """Export over HTTP the metrics aggregated from the multiprocess directory of the worker processes."""
+
+    help = (
+        "Serve the Prometheus metrics of all the worker processes of this host, "
+        "aggregated from the PROMETHEUS_MULTIPROC_DIR directory they share."
+    )
+
+    def add_arguments(self, parser):
+        """Add the command options."""
+        parser.add_argument("--address", default="0.0.0.0", help="Address to listen on (default 0.0.0.0)")  # nosec
+        parser.add_argument("--port", type=int, default=9105, help="Port to listen on (default 9105)")
+
+    def handle(self, *args, **options):
+        """Serve the aggregated metrics until interrupted."""
+        if not MULTIPROCESS_DIR:
+            raise CommandError("PROMETHEUS_MULTIPROC_DIR must be set to the directory shared by the worker processes")
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry, path=MULTIPROCESS_DIR)
+
+        httpd = make_server(options["address"], options["port"], make_wsgi_app(registry))
+        self.stdout.write(f"Serving the metrics of {MULTIPROCESS_DIR} on {options['address']}:{options['port']}")
+
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            httpd.server_close()
@@ -11,8 +11,143 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
-from prometheus_client import Counter
+import os
+import time
+from contextlib import contextmanager
+
+from django.db import connection
+from prometheus_client import Counter, Gauge, Histogram, multiprocess
+
+from .choices import OnboardingFailChoices
+from .exceptions import OnboardException
+
+# With several worker processes, e.g. Celery prefork or many RQ workers, the metrics of all the processes of a host are
+# aggregated through files shared in this directory, see https://github.com/prometheus/client_python#multiprocess-mode
+MULTIPROCESS_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR") or os.environ.get("prometheus_multiproc_dir")
+
+PHASE_DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+PHASE_QUERIES_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+onboardingtask_processing_histogram = Histogram(
+    name="onboardingtask_processing_seconds",
+    documentation="Time spent processing onboarding request",
+    buckets=(0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600),
+)
 
 onboardingtask_results_counter = Counter(
     name="onboardingtask_results_total", documentation="Count of results for Onboarding Task", labelnames=("status",)
 )
+
+napalm_sessions_open_gauge = Gauge(
+    name="onboarding_napalm_sessions_open",
+    documentation="Number of NAPALM sessions currently open by the worker",
+    multiprocess_mode="liveall",
+)
+
+napalm_sessions_counter = Counter(
+    name="onboarding_napalm_sessions_total", documentation="Count of NAPALM sessions opened by the worker"
+)
+
+napalm_session_close_errors_counter = Counter(
+    name="onboarding_napalm_session_close_errors_total",
+    documentation="Count of NAPALM sessions the worker failed to close, possibly leaking their connection",
+)
+
+worker_open_fds_gauge = Gauge(
+    name="onboarding_worker_open_fds",
+    documentation="Number of file descriptors open by the worker process",
+    multiprocess_mode="liveall",
+)
+
+onboarding_phase_duration_histogram = Histogram(
+    name="onboarding_phase_duration_seconds",
+    documentation="Time spent in each phase of the onboarding of a device",
+    labelnames=("phase", "napalm_driver", "site", "failed_reason"),
+    buckets=PHASE_DURATION_BUCKETS,
+)
+
+onboarding_phase_queries_histogram = Histogram(
+    name="onboarding_phase_queries",
+    documentation="Number of database queries issued by each phase of the onboarding of a device",
+    labelnames=("phase",),
+    buckets=PHASE_QUERIES_BUCKETS,
+)
+
+
+class QueryCounter:
+    """Count the database queries executed through a connection, see count_queries()."""
+
+    def __init__(self):
+        """Start counting from zero."""
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        """Count a query and execute it."""
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+@contextmanager
+def count_queries():
+    """Count the database queries executed by the current thread within the block, yield a QueryCounter.
+
+    Unlike django.test.utils.CaptureQueriesContext, queries are counted without enabling the debug cursor,
+    so that this can be used in production.
+    """
+    query_counter = QueryCounter()
+
+    with connection.execute_wrapper(query_counter):
+        yield query_counter
+
+
+@contextmanager
+def observe_phase(phase, napalm_driver=None, site=None, durations=None):
+    """Time a phase of the onboarding of a device, recorded by onboarding_phase_duration_histogram.
+
+    The database queries of the phase are counted by onboarding_phase_queries_histogram. The `failed_reason`
+    label is the reason of the OnboardException raised by the phase, "fail-general" for any other exception,
+    and empty when the phase succeeds.
+
+    Args:
+      phase (str): Name of the phase, e.g. "autodetect" or "ensure_device_type"
+      napalm_driver (str): NAPALM driver of the device, when known
+      site (str): Slug of the site of the device, when known
+      durations (dict): Seconds spent in each phase, keyed by phase name, to add the duration of this phase to,
+        e.g. OnboardingTask.phase_durations
+    """
+    failed_reason = ""
+    query_counter = QueryCounter()
+    start = time.monotonic()
+
+    try:
+        with connection.execute_wrapper(query_counter):
+            yield
+
+    except OnboardException as exc:
+        failed_reason = exc.reason
+        raise
+
+    except Exception:
+        failed_reason = OnboardingFailChoices.FAIL_GENERAL
+        raise
+
+    finally:
+        duration = time.monotonic() - start
+        onboarding_phase_duration_histogram.labels(
+            phase=phase, napalm_driver=napalm_driver or "", site=site or "", failed_reason=failed_reason
+        ).observe(duration)
+        onboarding_phase_queries_histogram.labels(phase=phase).observe(query_counter.count)
+
+        if durations is not None:
+            durations[phase] = round(durations.get(phase, 0) + duration, 3)
+
+
+def mark_process_dead(pid=None):
+    """Drop the gauges of a worker process about to exit from the aggregated metrics, in multiprocess mode.
+
+    Args:
+      pid (int): ID of the exiting process, defaults to the current process
+    """
+    if MULTIPROCESS_DIR:
+        multiprocess.mark_process_dead(pid or os.getpid(), MULTIPROCESS_DIR)
@@ -0,0 +1,29 @@
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def create_label_counter(apps, schema_editor):
+    OnboardingTask = apps.get_model("nautobot_device_onboarding", "OnboardingTask")
+    OnboardingTaskLabelCounter = apps.get_model("nautobot_device_onboarding", "OnboardingTaskLabelCounter")
+
+    OnboardingTaskLabelCounter.objects.create(
+        name="onboardingtask", value=OnboardingTask.objects.aggregate(Max("label"))["label__max"] or 0
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("nautobot_device_onboarding", "0003_onboardingtask_label"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="OnboardingTaskLabelCounter",
+            fields=[
+                ("name", models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ("value", models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(create_label_counter, migrations.RunPython.noop),
+    ]
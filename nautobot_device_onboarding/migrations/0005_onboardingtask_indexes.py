@@ -0,0 +1,23 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("nautobot_device_onboarding", "0004_onboardingtasklabelcounter"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="onboardingtask",
+            index=models.Index(fields=["ip_address", "last_updated"], name="onboardingtask_ip_updated_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="onboardingtask",
+            index=models.Index(fields=["status", "last_updated"], name="onboardingtask_status_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="onboardingtask",
+            index=models.Index(fields=["label"], name="onboardingtask_label_idx"),
+        ),
+    ]
@@ -0,0 +1,50 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("nautobot_device_onboarding", "0005_onboardingtask_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="onboardingdevice",
+            name="last_task",
+            field=models.ForeignKey(
+                blank=True,
+                help_text="Latest onboarding task of the device",
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to="nautobot_device_onboarding.onboardingtask",
+            ),
+        ),
+        migrations.AddField(
+            model_name="onboardingdevice",
+            name="last_status",
+            field=models.CharField(
+                blank=True,
+                choices=[
+                    ("failed", "failed"),
+                    ("pending", "pending"),
+                    ("running", "running"),
+                    ("succeeded", "succeeded"),
+                    ("skipped", "skipped"),
+                ],
+                help_text="Status of the latest onboarding task",
+                max_length=255,
+            ),
+        ),
+        migrations.AddField(
+            model_name="onboardingdevice",
+            name="last_attempt_date",
+            field=models.DateField(blank=True, help_text="Date of the latest onboarding attempt", null=True),
+        ),
+        migrations.AddField(
+            model_name="onboardingdevice",
+            name="last_success_date",
+            field=models.DateField(blank=True, help_text="Date of the latest successful onboarding", null=True),
+        ),
+    ]
@@ -0,0 +1,33 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("nautobot_device_onboarding", "0006_onboardingdevice_last_task"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="onboardingtask",
+            name="enqueued",
+            field=models.DateTimeField(blank=True, help_text="Time the task was enqueued for a worker", null=True),
+        ),
+        migrations.AddField(
+            model_name="onboardingtask",
+            name="started",
+            field=models.DateTimeField(blank=True, help_text="Time a worker started processing the task", null=True),
+        ),
+        migrations.AddField(
+            model_name="onboardingtask",
+            name="finished",
+            field=models.DateTimeField(blank=True, help_text="Time the processing of the task finished", null=True),
+        ),
+        migrations.AddField(
+            model_name="onboardingtask",
+            name="phase_durations",
+            field=models.JSONField(
+                blank=True, default=dict, help_text="Time spent in each phase of the onboarding, in seconds"
+            ),
+        ),
+    ]
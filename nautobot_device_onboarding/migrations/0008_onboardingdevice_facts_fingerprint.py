@@ -0,0 +1,20 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("nautobot_device_onboarding", "0007_onboardingtask_timing"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="onboardingdevice",
+            name="facts_fingerprint",
+            field=models.CharField(
+                blank=True,
+                help_text="Fingerprint of the device facts at the latest successful onboarding",
+                max_length=64,
+            ),
+        ),
+    ]
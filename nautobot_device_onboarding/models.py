@@ -13,7 +13,8 @@ limitations under the License.
 """
 from django.db.models.signals import post_save
 from django.dispatch import receiver
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, Max
 from django.urls import reverse
 
 from nautobot.core.models import BaseModel
@@ -56,6 +57,22 @@ class OnboardingTask(BaseModel, ChangeLoggedModel):
         help_text="Timeout period in sec to wait while connecting to the device", default=30
     )
 
+    enqueued = models.DateTimeField(blank=True, null=True, help_text="Time the task was enqueued for a worker")
+    started = models.DateTimeField(blank=True, null=True, help_text="Time a worker started processing the task")
+    finished = models.DateTimeField(blank=True, null=True, help_text="Time the processing of the task finished")
+
+    phase_durations = models.JSONField(
+        default=dict, blank=True, help_text="Time spent in each phase of the onboarding, in seconds"
+    )
+
+    class Meta:  # noqa: D106 "Missing docstring in public nested class"
+        indexes = [
+            # Latest task of a device, see OnboardingDevice
+            models.Index(fields=["ip_address", "last_updated"], name="onboardingtask_ip_updated_idx"),
+            models.Index(fields=["status", "last_updated"], name="onboardingtask_status_idx"),
+            models.Index(fields=["label"], name="onboardingtask_label_idx"),
+        ]
+
     def __str__(self):
         """String representation of an OnboardingTask."""
         return f"{self.site} | {self.ip_address}"
@@ -64,86 +81,160 @@ class OnboardingTask(BaseModel, ChangeLoggedModel):
         """Provide absolute URL to an OnboardingTask."""
         return reverse("plugins:nautobot_device_onboarding:onboardingtask", kwargs={"pk": self.pk})
 
+    @property
+    def queue_wait(self):
+        """Time the task waited for a worker, as a timedelta, or None when unknown."""
+        if self.enqueued and self.started:
+            return self.started - self.enqueued
+        return None
+
+    @property
+    def duration(self):
+        """Time a worker spent processing the task, as a timedelta, or None when unknown."""
+        if self.started and self.finished:
+            return self.finished - self.started
+        return None
+
     def save(self, *args, **kwargs):
         """Overwrite method to get latest label value and update Task object."""
         if not self.label:
-            latest_task = OnboardingTask.objects.all().order_by("-label").first()
-            self.label = (latest_task.label if latest_task else 0) + 1
+            self.label = OnboardingTask.reserve_labels(1)[0]
         super(OnboardingTask, self).save(*args, **kwargs)
 
+    @staticmethod
+    def reserve_labels(count):
+        """Reserve consecutive labels for `count` new tasks.
+
+        Labels are allocated from the OnboardingTaskLabelCounter row, which stays locked until the
+        current transaction ends, so concurrent requests never get the same labels.
+
+        Args:
+          count (int): Number of labels to reserve
+
+        Returns:
+          range: the reserved labels
+        """
+        with transaction.atomic():
+            counter = OnboardingTaskLabelCounter.objects.filter(pk=OnboardingTaskLabelCounter.NAME)
+            if not counter.update(value=F("value") + count):
+                # Counter row missing, start from the tasks already labeled
+                try:
+                    with transaction.atomic():
+                        OnboardingTaskLabelCounter.objects.create(
+                            name=OnboardingTaskLabelCounter.NAME,
+                            value=(OnboardingTask.objects.aggregate(Max("label"))["label__max"] or 0) + count,
+                        )
+                except IntegrityError:
+                    counter.update(value=F("value") + count)
+
+            last_label = counter.values_list("value", flat=True).get()
+
+        return range(last_label - count + 1, last_label + 1)
+
     objects = RestrictedQuerySet.as_manager()
 
 
+class OnboardingTaskLabelCounter(models.Model):
+    """Last label allocated to an OnboardingTask, see OnboardingTask.reserve_labels."""
+
+    NAME = "onboardingtask"
+
+    name = models.CharField(max_length=50, primary_key=True)
+    value = models.PositiveIntegerField(default=0)
+
+
 class OnboardingDevice(BaseModel):
     """The status of each Onboarded Device is tracked in the OnboardingDevice table."""
 
     device = models.OneToOneField(to="dcim.Device", on_delete=models.CASCADE)
     enabled = models.BooleanField(default=True, help_text="Whether (re)onboarding of this device is permitted")
 
+    # Outcome of the latest onboarding tasks of the device, recorded by the worker when a task finishes
+    last_task = models.ForeignKey(
+        to="nautobot_device_onboarding.OnboardingTask",
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+        related_name="+",
+        help_text="Latest onboarding task of the device",
+    )
+    last_status = models.CharField(
+        max_length=255, choices=OnboardingStatusChoices, blank=True, help_text="Status of the latest onboarding task"
+    )
+    last_attempt_date = models.DateField(blank=True, null=True, help_text="Date of the latest onboarding attempt")
+    last_success_date = models.DateField(blank=True, null=True, help_text="Date of the latest successful onboarding")
+
+    # Re-onboarding the device is a no-op as long as a fresh collection of its facts matches, see OnboardingManager
+    facts_fingerprint = models.CharField(
+        max_length=64, blank=True, help_text="Fingerprint of the device facts at the latest successful onboarding"
+    )
+
+    def record_onboarding_task(self, ot):
+        """Record a finished OnboardingTask as the latest onboarding task of the device, without saving.
+
+        Returns:
+          list: names of the updated fields
+        """
+        self.last_task = ot
+        self.last_status = ot.status
+        self.last_attempt_date = ot.created
+        update_fields = ["last_task", "last_status", "last_attempt_date"]
+
+        if ot.status == OnboardingStatusChoices.STATUS_SUCCEEDED:
+            self.last_success_date = ot.created
+            update_fields.append("last_success_date")
+
+        return update_fields
+
+    def _latest_task(self, **kwargs):
+        """Query the latest OnboardingTask of the device primary IPs, for devices onboarded before last_task existed."""
+        ip_addresses = [
+            primary_ip.address.ip.format()
+            for primary_ip in (self.device.primary_ip4, self.device.primary_ip6)
+            if primary_ip is not None
+        ]
+        if not ip_addresses:
+            return None
+
+        try:
+            return OnboardingTask.objects.filter(ip_address__in=ip_addresses, **kwargs).latest("last_updated")
+        except OnboardingTask.DoesNotExist:
+            return None
+
     @property
     def last_check_attempt_date(self):
         """Date of last onboarding attempt for a device."""
-        if self.device.primary_ip4:
-            try:
-                return (
-                    OnboardingTask.objects.filter(
-                        ip_address=self.device.primary_ip4.address.ip.format()  # pylint: disable=no-member
-                    )
-                    .latest("last_updated")
-                    .created
-                )
-            except OnboardingTask.DoesNotExist:
-                return "unknown"
-        else:
-            return "unknown"
+        if self.last_task_id:
+            return self.last_attempt_date
+
+        latest_task = self._latest_task()
+        return latest_task.created if latest_task else "unknown"
 
     @property
     def last_check_successful_date(self):
         """Date of last successful onboarding for a device."""
-        if self.device.primary_ip4:
-            try:
-                return (
-                    OnboardingTask.objects.filter(
-                        ip_address=self.device.primary_ip4.address.ip.format(),  # pylint: disable=no-member
-                        status=OnboardingStatusChoices.STATUS_SUCCEEDED,
-                    )
-                    .latest("last_updated")
-                    .created
-                )
-            except OnboardingTask.DoesNotExist:
-                return "unknown"
-        else:
-            return "unknown"
+        if self.last_task_id:
+            return self.last_success_date or "unknown"
+
+        latest_task = self._latest_task(status=OnboardingStatusChoices.STATUS_SUCCEEDED)
+        return latest_task.created if latest_task else "unknown"
 
     @property
     def status(self):
         """Last onboarding status."""
-        if self.device.primary_ip4:
-            try:
-                return (
-                    OnboardingTask.objects.filter(
-                        ip_address=self.device.primary_ip4.address.ip.format()  # pylint: disable=no-member
-                    )
-                    .latest("last_updated")
-                    .status
-                )
-            except OnboardingTask.DoesNotExist:
-                return "unknown"
-        else:
-            return "unknown"
+        if self.last_task_id:
+            return self.last_status
+
+        latest_task = self._latest_task()
+        return latest_task.status if latest_task else "unknown"
 
     @property
     def last_ot(self):
         """Last onboarding task."""
-        if self.device.primary_ip4:
-            try:
-                return OnboardingTask.objects.filter(
-                    ip_address=self.device.primary_ip4.address.ip.format()  # pylint: disable=no-member
-                ).latest("last_updated")
-            except OnboardingTask.DoesNotExist:
-                return "unknown"
-        else:
-            return "unknown"
+        if self.last_task_id:
+            return self.last_task
+
+        return self._latest_task() or "unknown"
 
 
 @receiver(post_save, sender=Device)
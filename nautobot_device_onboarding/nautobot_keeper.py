@@ -12,35 +12,54 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import copy
 import logging
 import re
 
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ValidationError
+from django.db import transaction
 from django.utils.text import slugify
 from nautobot.dcim.choices import InterfaceTypeChoices
 from nautobot.dcim.models import Manufacturer, Device, Interface, DeviceType, DeviceRole
 from nautobot.dcim.models import Platform
 from nautobot.dcim.models import Site
 from nautobot.extras.models import Status
-from nautobot.extras.models.customfields import CustomField
 from nautobot.ipam.models import IPAddress
 
-from .constants import NETMIKO_TO_NAPALM_STATIC
+from .cache import get_custom_field_defaults, get_napalm_driver_map, reference_cache
 from .exceptions import OnboardException
+from .helpers import primary_ip_field
+from .metrics import observe_phase
 
 logger = logging.getLogger("rq.worker")
 
 PLUGIN_SETTINGS = settings.PLUGINS_CONFIG["nautobot_device_onboarding"]
 
 
-def ensure_default_cf(obj, model):
-    """Update objects's default custom fields."""
-    for cf in CustomField.objects.get_for_model(model):
-        if (cf.default is not None) and (cf.name not in obj.cf):
-            obj.cf[cf.name] = cf.default
+def apply_default_cf(obj, model):
+    """Set the default value of the custom fields missing from an object, without saving it.
 
+    Args:
+      obj (Model): Object to update
+      model (Model): Model class of the object
+
+    Returns:
+      bool: True if obj was updated
+    """
+    changed = False
+
+    for name, default in get_custom_field_defaults(model).items():
+        if name not in obj.cf:
+            obj.cf[name] = copy.deepcopy(default)
+            changed = True
+
+    return changed
+
+
+def save_validated(obj):
+    """Validate and save an object, raise OnboardException if it is not valid."""
     try:
         obj.validated_save()
     except ValidationError as err:
@@ -50,6 +69,47 @@ def ensure_default_cf(obj, model):
         )
 
 
+def ensure_default_cf(obj, model, changed=False):
+    """Update objects's default custom fields, then validate and save the object if it is new or was updated.
+
+    New objects are expected to be instantiated but not saved yet, so that they are written only once.
+
+    Args:
+      obj (Model): Object to update
+      model (Model): Model class of the object
+      changed (bool): True if obj was already updated and must be saved
+    """
+    changed = apply_default_cf(obj, model) or changed
+
+    if changed or obj._state.adding:  # pylint: disable=protected-access
+        save_validated(obj)
+
+
+def set_field_values(obj, values):
+    """Set the fields of an object, without saving it.
+
+    Related objects are compared by primary key, so that they are not fetched from the database.
+
+    Args:
+      obj (Model): Object to update
+      values (dict): New field values keyed by field name
+
+    Returns:
+      bool: True if at least one of the fields was changed
+    """
+    changed = False
+
+    for name, value in values.items():
+        field = obj._meta.get_field(name)  # pylint: disable=protected-access
+        new_value = value.pk if field.is_relation and value is not None else value
+
+        if getattr(obj, field.attname) != new_value:
+            setattr(obj, name, value)
+            changed = True
+
+    return changed
+
+
 def object_match(obj, search_array):
     """Used to search models for multiple criteria.
 
@@ -87,6 +147,30 @@ def object_match(obj, search_array):
         )
 
 
+def cached_object_match(obj, search_array):
+    """Same as object_match, the matching object is kept in the reference cache."""
+    key = (
+        PLUGIN_SETTINGS["object_match_strategy"],
+        tuple(tuple(sorted(search_array_element.items())) for search_array_element in search_array),
+    )
+
+    return reference_cache.get_or_load(obj, key, lambda: object_match(obj, search_array))
+
+
+def cached_get(obj, **kwargs):
+    """Same as obj.objects.get(**kwargs), the object is kept in the reference cache."""
+    return reference_cache.get_or_load(obj, tuple(sorted(kwargs.items())), lambda: obj.objects.get(**kwargs))
+
+
+def cached_status(model, name):
+    """Get the Status named `name` applying to `model`, the Status is kept in the reference cache."""
+    ct = ContentType.objects.get_for_model(model)  # pylint: disable=invalid-name
+
+    return reference_cache.get_or_load(
+        Status, (ct.pk, name), lambda: Status.objects.get(content_types__in=[ct], name=name)
+    )
+
+
 class NautobotKeeper:
     """Used to manage the information relating to the network device within the Nautobot server."""
 
@@ -105,8 +189,10 @@ class NautobotKeeper:
         netdev_mgmt_ifname=None,
         netdev_mgmt_pflen=None,
         netdev_netmiko_device_type=None,
+        netdev_napalm_driver=None,
         onboarding_class=None,
         driver_addon_result=None,
+        phase_durations=None,
     ):
         """Create an instance and initialize the managed attributes that are used throughout the onboard processing.
 
@@ -118,14 +204,16 @@ class NautobotKeeper:
             netdev_nb_device_type_slug (str): Device type's slug
             netdev_model (str): Device's model
             netdev_nb_role_color (str): Nautobot device's role color
-            netdev_mgmt_ip_address (str): IPv4 Address of a device
+            netdev_mgmt_ip_address (str): IPv4 or IPv6 Address of a device
             netdev_nb_platform_slug (str): Nautobot device's platform slug
             netdev_serial_number (str): Device's serial number
             netdev_mgmt_ifname (str): Device's management interface name
             netdev_mgmt_pflen (str): Device's management IP prefix-len
             netdev_netmiko_device_type (str): Device's Netmiko device type
+            netdev_napalm_driver (str): Device's NAPALM driver, used to label the metrics
             onboarding_class (Object): Onboarding Class (future use)
             driver_addon_result (Any): Attached extended result (future use)
+            phase_durations (dict): Seconds spent in each phase, keyed by phase name, updated as the phases complete
         """
         self.netdev_mgmt_ip_address = netdev_mgmt_ip_address
         self.netdev_nb_site_slug = netdev_nb_site_slug
@@ -141,9 +229,11 @@ class NautobotKeeper:
         self.netdev_mgmt_ifname = netdev_mgmt_ifname
         self.netdev_mgmt_pflen = netdev_mgmt_pflen
         self.netdev_netmiko_device_type = netdev_netmiko_device_type
+        self.netdev_napalm_driver = netdev_napalm_driver
 
         self.onboarding_class = onboarding_class
         self.driver_addon_result = driver_addon_result
+        self.phase_durations = phase_durations
 
         # these attributes are nautobot model instances as discovered/created
         # through the course of processing.
@@ -154,6 +244,7 @@ class NautobotKeeper:
         self.nb_platform = None
 
         self.device = None
+        self.device_changed = False
         self.onboarded_device = None
         self.nb_mgmt_ifname = None
         self.nb_primary_ip = None
@@ -166,7 +257,9 @@ class NautobotKeeper:
         """
         try:
             if self.netdev_mgmt_ip_address:
-                self.onboarded_device = Device.objects.get(primary_ip4__host=self.netdev_mgmt_ip_address)
+                self.onboarded_device = Device.objects.get(
+                    **{f"{primary_ip_field(self.netdev_mgmt_ip_address)}__host": self.netdev_mgmt_ip_address}
+                )
         except Device.DoesNotExist:
             logger.info(
                 "Could not find existing Nautobot device for requested primary IP address (%s)",
@@ -181,7 +274,7 @@ class NautobotKeeper:
     def ensure_device_site(self):
         """Ensure device's site."""
         try:
-            self.nb_site = Site.objects.get(slug=self.netdev_nb_site_slug)
+            self.nb_site = cached_get(Site, slug=self.netdev_nb_site_slug)
         except Site.DoesNotExist:
             raise OnboardException(reason="fail-config", message=f"Site not found: {self.netdev_nb_site_slug}")
 
@@ -205,10 +298,10 @@ class NautobotKeeper:
 
         try:
             search_array = [{"slug__iexact": nb_manufacturer_slug}]
-            self.nb_manufacturer = object_match(Manufacturer, search_array)
+            self.nb_manufacturer = cached_object_match(Manufacturer, search_array)
         except Manufacturer.DoesNotExist:
             if create_manufacturer:
-                self.nb_manufacturer = Manufacturer.objects.create(name=self.netdev_vendor, slug=nb_manufacturer_slug)
+                self.nb_manufacturer = Manufacturer(name=self.netdev_vendor, slug=nb_manufacturer_slug)
                 ensure_default_cf(obj=self.nb_manufacturer, model=Manufacturer)
             else:
                 raise OnboardException(
@@ -266,9 +359,9 @@ class NautobotKeeper:
                 {"part_number__iexact": self.netdev_model},
             ]
 
-            self.nb_device_type = object_match(DeviceType, search_array)
+            self.nb_device_type = cached_object_match(DeviceType, search_array)
 
-            if self.nb_device_type.manufacturer.id != self.nb_manufacturer.id:
+            if self.nb_device_type.manufacturer_id != self.nb_manufacturer.id:
                 raise OnboardException(
                     reason="fail-config",
                     message=f"ERROR device type {self.netdev_model} " f"already exists for vendor {self.netdev_vendor}",
@@ -277,7 +370,7 @@ class NautobotKeeper:
         except DeviceType.DoesNotExist:
             if create_device_type:
                 logger.info("CREATE: device-type: %s", self.netdev_model)
-                self.nb_device_type = DeviceType.objects.create(
+                self.nb_device_type = DeviceType(
                     slug=nb_device_type_slug,
                     model=nb_device_type_slug.upper(),
                     manufacturer=self.nb_manufacturer,
@@ -302,10 +395,10 @@ class NautobotKeeper:
             Nautobot.
         """
         try:
-            self.nb_device_role = DeviceRole.objects.get(slug=self.netdev_nb_role_slug)
+            self.nb_device_role = cached_get(DeviceRole, slug=self.netdev_nb_role_slug)
         except DeviceRole.DoesNotExist:
             if create_device_role:
-                self.nb_device_role = DeviceRole.objects.create(
+                self.nb_device_role = DeviceRole(
                     name=self.netdev_nb_role_slug,
                     slug=self.netdev_nb_role_slug,
                     color=self.netdev_nb_role_color,
@@ -344,25 +437,16 @@ class NautobotKeeper:
                     reason="fail-config", message=f"ERROR device platform not found: {self.netdev_hostname}"
                 )
 
-            self.nb_platform = Platform.objects.get(slug=self.netdev_nb_platform_slug)
+            self.nb_platform = cached_get(Platform, slug=self.netdev_nb_platform_slug)
 
             logger.info("PLATFORM: found in Nautobot %s", self.netdev_nb_platform_slug)
 
         except Platform.DoesNotExist:
             if create_platform_if_missing:
-                platform_to_napalm_nautobot = {
-                    platform.slug: platform.napalm_driver
-                    for platform in Platform.objects.all()
-                    if platform.napalm_driver
-                }
-
-                # Update Constants if Napalm driver is defined for Nautobot Platform
-                netmiko_to_napalm = {**NETMIKO_TO_NAPALM_STATIC, **platform_to_napalm_nautobot}
-
-                self.nb_platform = Platform.objects.create(
+                self.nb_platform = Platform(
                     name=self.netdev_nb_platform_slug,
                     slug=self.netdev_nb_platform_slug,
-                    napalm_driver=netmiko_to_napalm[self.netdev_netmiko_device_type],
+                    napalm_driver=get_napalm_driver_map()[self.netdev_netmiko_device_type],
                 )
                 ensure_default_cf(obj=self.nb_platform, model=Platform)
             else:
@@ -399,9 +483,8 @@ class NautobotKeeper:
             }
         else:
             # Construct lookup arguments if onboarded device does not exist in Nautobot
-            ct = ContentType.objects.get_for_model(Device)  # pylint: disable=invalid-name
             try:
-                device_status = Status.objects.get(content_types__in=[ct], name=default_status)
+                device_status = cached_status(Device, default_status)
             except Status.DoesNotExist:
                 raise OnboardException(
                     reason="fail-general",
@@ -426,37 +509,50 @@ class NautobotKeeper:
                 ),
             }
 
-        try:
-            self.device, created = Device.objects.update_or_create(**lookup_args)
-            ensure_default_cf(obj=self.device, model=Device)
-
-            if created:
-                logger.info("CREATED device: %s", self.netdev_hostname)
-            else:
-                logger.info("GOT/UPDATED device: %s", self.netdev_hostname)
+        defaults = lookup_args.pop("defaults")
 
+        try:
+            self.device = Device.objects.get(**lookup_args)
+            created = False
+        except Device.DoesNotExist:
+            self.device = Device(**lookup_args)
+            created = True
         except Device.MultipleObjectsReturned:
             raise OnboardException(
                 reason="fail-general",
                 message=f"ERROR multiple devices using same name in Nautobot: {self.netdev_hostname}",
             )
 
+        self.device_changed = set_field_values(self.device, defaults)
+        self.device_changed = apply_default_cf(self.device, Device) or self.device_changed
+
+        # New devices are saved right away, as their interfaces refer to them. Changes to existing
+        # devices are saved once by ensure_device, along with their primary IP address.
+        if created:
+            save_validated(self.device)
+            self.device_changed = False
+            logger.info("CREATED device: %s", self.netdev_hostname)
+        else:
+            logger.info("GOT/UPDATED device: %s", self.netdev_hostname)
+
     def ensure_interface(self):
         """Ensures that the interface associated with the mgmt_ipaddr exists and is assigned to the device."""
         if self.netdev_mgmt_ifname:
-            self.nb_mgmt_ifname, _ = Interface.objects.get_or_create(
-                name=self.netdev_mgmt_ifname, device=self.device, defaults=dict(type=InterfaceTypeChoices.TYPE_OTHER)
-            )
+            try:
+                self.nb_mgmt_ifname = Interface.objects.get(name=self.netdev_mgmt_ifname, device=self.device)
+            except Interface.DoesNotExist:
+                self.nb_mgmt_ifname = Interface(
+                    name=self.netdev_mgmt_ifname, device=self.device, type=InterfaceTypeChoices.TYPE_OTHER
+                )
             ensure_default_cf(obj=self.nb_mgmt_ifname, model=Interface)
 
     def ensure_primary_ip(self):
         """Ensure mgmt_ipaddr exists in IPAM, has the device interface, and is assigned as the primary IP address."""
         # see if the primary IP address exists in IPAM
         if self.netdev_mgmt_ip_address and self.netdev_mgmt_pflen:
-            ct = ContentType.objects.get_for_model(IPAddress)  # pylint: disable=invalid-name
             default_status_name = PLUGIN_SETTINGS["default_ip_status"]
             try:
-                ip_status = Status.objects.get(content_types__in=[ct], name=default_status_name)
+                ip_status = cached_status(IPAddress, default_status_name)
             except Status.DoesNotExist:
                 raise OnboardException(
                     reason="fail-general",
@@ -468,32 +564,62 @@ class NautobotKeeper:
                     message=f"ERROR multiple IP Address status using same name: {default_status_name}",
                 )
 
-            self.nb_primary_ip, created = IPAddress.objects.get_or_create(
-                address=f"{self.netdev_mgmt_ip_address}/{self.netdev_mgmt_pflen}", defaults={"status": ip_status}
+            address = f"{self.netdev_mgmt_ip_address}/{self.netdev_mgmt_pflen}"
+            try:
+                self.nb_primary_ip = IPAddress.objects.get(address=address)
+            except IPAddress.DoesNotExist:
+                self.nb_primary_ip = IPAddress(address=address, status=ip_status)
+
+            # New IP addresses are created already assigned to the interface
+            interface_ct = ContentType.objects.get_for_model(Interface)
+            needs_assignment = (self.nb_primary_ip.assigned_object_type_id, self.nb_primary_ip.assigned_object_id) != (
+                interface_ct.pk,
+                self.nb_mgmt_ifname.pk,
             )
-            ensure_default_cf(obj=self.nb_primary_ip, model=IPAddress)
-
-            if created or self.nb_primary_ip not in self.nb_mgmt_ifname.ip_addresses.all():
+            if needs_assignment:
+                self.nb_primary_ip.assigned_object = self.nb_mgmt_ifname
                 logger.info("ASSIGN: IP address %s to %s", self.nb_primary_ip.address, self.nb_mgmt_ifname.name)
-                self.nb_mgmt_ifname.ip_addresses.add(self.nb_primary_ip)
-                self.nb_mgmt_ifname.full_clean()
-                self.nb_mgmt_ifname.save()
+            ensure_default_cf(obj=self.nb_primary_ip, model=IPAddress, changed=needs_assignment)
 
-            # Ensure the primary IP is assigned to the device
-            self.device.primary_ip4 = self.nb_primary_ip
-            self.device.full_clean()
-            self.device.save()
+            # Ensure the primary IP is assigned to the device, saved by ensure_device
+            if set_field_values(self.device, {primary_ip_field(self.netdev_mgmt_ip_address): self.nb_primary_ip}):
+                self.device_changed = True
 
+    @transaction.atomic
     def ensure_device(self):
-        """Ensure that the device represented by the DevNetKeeper exists in the Nautobot system."""
-        self.ensure_onboarded_device()
-        self.ensure_device_site()
-        self.ensure_device_manufacturer()
-        self.ensure_device_type()
-        self.ensure_device_role()
-        self.ensure_device_platform()
-        self.ensure_device_instance()
+        """Ensure that the device represented by the DevNetKeeper exists in the Nautobot system.
+
+        All the objects are created or updated in a single transaction, nothing is left behind if onboarding fails.
+        The device is written once with its final state, or not at all if it is already up to date.
+        """
+        ensure_steps = [
+            "ensure_onboarded_device",
+            "ensure_device_site",
+            "ensure_device_manufacturer",
+            "ensure_device_type",
+            "ensure_device_role",
+            "ensure_device_platform",
+            "ensure_device_instance",
+        ]
 
         if PLUGIN_SETTINGS["create_management_interface_if_missing"]:
-            self.ensure_interface()
-            self.ensure_primary_ip()
+            ensure_steps += ["ensure_interface", "ensure_primary_ip"]
+
+        # Each step is timed as a phase named after its method
+        for ensure_step in ensure_steps:
+            with self.observe_phase(ensure_step):
+                getattr(self, ensure_step)()
+
+        if self.device_changed:
+            with self.observe_phase("save_device"):
+                save_validated(self.device)
+            self.device_changed = False
+
+    def observe_phase(self, phase):
+        """Time a phase of the onboarding of the device, labelled with its NAPALM driver and site."""
+        return observe_phase(
+            phase,
+            napalm_driver=self.netdev_napalm_driver,
+            site=self.netdev_nb_site_slug,
+            durations=self.phase_durations,
+        )
@@ -14,6 +14,7 @@ limitations under the License.
 
 import importlib
 import logging
+import re
 import socket
 
 from django.conf import settings
@@ -23,13 +24,20 @@ from napalm.base.netmiko_helpers import netmiko_args
 from netmiko import SSHDetect
 from netmiko import NetMikoAuthenticationException
 from netmiko import NetMikoTimeoutException
+from netmiko.ssh_dispatcher import redispatch
 from paramiko.ssh_exception import SSHException
 
-from nautobot.dcim.models import Platform
-
 from nautobot_device_onboarding.onboarding.onboarding import StandaloneOnboarding
-from .constants import NETMIKO_TO_NAPALM_STATIC
+from .cache import (
+    get_cached_device_type,
+    get_napalm_driver_map,
+    invalidate_cached_device_type,
+    set_cached_device_type,
+)
+from .connections import napalm_session
+from .constants import NAPALM_NETMIKO_DEVICE_TYPES, SSH_BANNER_MAX_LENGTH, SSH_BANNER_TIMEOUT
 from .exceptions import OnboardException
+from .metrics import observe_phase
 
 logger = logging.getLogger("rq.worker")
 
@@ -52,14 +60,71 @@ def get_mgmt_info(
     the interface addresses present on the device. We need to handle this.
     """
     for if_name, if_data in ip_ifs.items():
-        if "ipv4" in if_data:
-            for if_addr, if_addr_data in if_data["ipv4"].items():
+        for family in ("ipv4", "ipv6"):
+            for if_addr, if_addr_data in if_data.get(family, {}).items():
                 if if_addr == hostname:
                     return if_name, if_addr_data["prefix_length"]
 
     return default_mgmt_if, default_mgmt_pfxlen
 
 
+def read_ssh_banner(sock, timeout=SSH_BANNER_TIMEOUT):
+    """Read the identification string an SSH server sends upon connection, e.g. "SSH-2.0-Cisco-1.25".
+
+    Args:
+      sock (socket): Socket connected to the SSH server
+      timeout (int): Maximum number of seconds to wait for the identification string
+
+    Returns:
+      str: identification string, or None when none was received
+    """
+    sock.settimeout(timeout)
+    buffer = b""
+
+    try:
+        while len(buffer) < SSH_BANNER_MAX_LENGTH:
+            data = sock.recv(SSH_BANNER_MAX_LENGTH)
+            if not data:
+                break
+
+            buffer += data
+
+            # RFC 4253 allows other lines of text before the identification string
+            for line in buffer.split(b"\n")[:-1]:
+                if line.startswith(b"SSH-"):
+                    return line.rstrip(b"\r").decode("ascii", "replace")
+
+    except OSError as exc:
+        logger.info("INFO unable to read SSH banner: %s", exc)
+
+    return None
+
+
+def match_ssh_banner(banner, fingerprints=None):
+    """Find the Netmiko device type of a device from the identification string of its SSH server.
+
+    Args:
+      banner (str): SSH identification string of the device
+      fingerprints (dict): Netmiko device type keyed by regular expression matching the identification string,
+        defaults to the `ssh_banner_fingerprints` plugin setting
+
+    Returns:
+      str: Netmiko device type, or None when no fingerprint or fingerprints of different device types match
+    """
+    if not banner:
+        return None
+
+    if fingerprints is None:
+        fingerprints = PLUGIN_SETTINGS["ssh_banner_fingerprints"]
+
+    device_types = {device_type for pattern, device_type in fingerprints.items() if re.search(pattern, banner)}
+
+    if len(device_types) != 1:
+        return None
+
+    return device_types.pop()
+
+
 class NetdevKeeper:
     """Used to maintain information about the network device during the onboarding process."""
 
@@ -73,6 +138,9 @@ class NetdevKeeper:
         secret=None,
         napalm_driver=None,
         optional_args=None,
+        site=None,
+        phase_durations=None,
+        reachable=False,
     ):
         """Initialize the network device keeper instance and ensure the required configuration parameters are provided.
 
@@ -85,6 +153,9 @@ class NetdevKeeper:
           secret (str): Device secret password (if unspecified, NAPALM_ARGS["secret"] settings variable will be used)
           napalm_driver (str): Napalm driver name to use to onboard network device
           optional_args (dict): Optional arguments passed to NAPALM and Netmiko
+          site (str): Slug of the site of an onboarded device, used to label the metrics
+          phase_durations (dict): Seconds spent in each phase, keyed by phase name, updated as the phases complete
+          reachable (bool): The device was already found reachable, e.g. by the sweep of a batch onboarding job
 
         Raises:
           OnboardException('fail-config'):
@@ -98,6 +169,9 @@ class NetdevKeeper:
         self.password = password
         self.secret = secret
         self.napalm_driver = napalm_driver
+        self.site = site
+        self.phase_durations = phase_durations
+        self.reachable = reachable
 
         # Netmiko and NAPALM expects optional_args to be a dictionary.
         if isinstance(optional_args, dict):
@@ -112,15 +186,24 @@ class NetdevKeeper:
         self.netmiko_device_type = None
         self.onboarding_class = StandaloneOnboarding
         self.driver_addon_result = None
+        self.netmiko_connection = None
+        self.netmiko_device_type_cached = False
+        self.netmiko_device_type_from_banner = False
+        self.ssh_banner = None
 
         # Enable loading driver extensions
         self.load_driver_extension = True
 
+    def observe_phase(self, phase):
+        """Time a phase of the onboarding of the device, labelled with its NAPALM driver and site."""
+        return observe_phase(phase, napalm_driver=self.napalm_driver, site=self.site, durations=self.phase_durations)
+
     def check_reachability(self):
         """Ensure that the device at the mgmt-ipaddr provided is reachable.
 
         We do this check before attempting other "show" commands so that we know we've got a
-        device that can be reached.
+        device that can be reached. When the platform of the device is to be detected, the
+        identification string of its SSH server is kept to identify it.
 
         Raises:
           OnboardException('fail-connect'):
@@ -129,9 +212,13 @@ class NetdevKeeper:
         logger.info("CHECK: IP %s:%s", self.hostname, self.port)
 
         try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(self.timeout)
-            sock.connect((self.hostname, self.port))
+            family = socket.AF_INET6 if ":" in self.hostname else socket.AF_INET
+            with socket.socket(family, socket.SOCK_STREAM) as sock:
+                sock.settimeout(self.timeout)
+                sock.connect((self.hostname, self.port))
+
+                if not self.napalm_driver:
+                    self.ssh_banner = read_ssh_banner(sock, min(self.timeout or SSH_BANNER_TIMEOUT, SSH_BANNER_TIMEOUT))
 
         except (socket.error, socket.timeout, ConnectionError):
             raise OnboardException(
@@ -164,7 +251,7 @@ class NetdevKeeper:
         try:
             logger.info("INFO guessing device type: %s", self.hostname)
             guesser = SSHDetect(**remote_device)
-            guessed_device_type = guesser.autodetect()
+            guessed_device_type = self._autodetect(guesser)
             logger.info("INFO guessed device type: %s", guessed_device_type)
 
         except NetMikoAuthenticationException as err:
@@ -181,6 +268,7 @@ class NetdevKeeper:
 
         else:
             if guessed_device_type is None:
+                self.close_netmiko_connection()
                 logger.error("ERROR: Could not detect device type with SSHDetect")
                 raise OnboardException(
                     reason="fail-general", message="ERROR: Could not detect device type with SSHDetect"
@@ -188,91 +276,173 @@ class NetdevKeeper:
 
         return guessed_device_type
 
-    def set_napalm_driver_name(self):
-        """Sets napalm driver name."""
-        if not self.napalm_driver:
-            netmiko_device_type = self.guess_netmiko_device_type()
-            logger.info("Guessed Netmiko Device Type: %s", netmiko_device_type)
+    def _autodetect(self, guesser):
+        """Run SSHDetect autodetection, keeping its SSH session open to be reused by NAPALM when enabled.
 
-            self.netmiko_device_type = netmiko_device_type
+        SSHDetect.autodetect() only disconnects when the detection completes, the session is closed here
+        when it raises.
+        """
+        connection = getattr(guesser, "connection", None)
+        reuse = connection is not None and PLUGIN_SETTINGS["reuse_autodetect_connection"]
 
-            platform_to_napalm_nautobot = {
-                platform.slug: platform.napalm_driver for platform in Platform.objects.all() if platform.napalm_driver
-            }
+        if reuse:
+            # SSHDetect.autodetect() disconnects once done, neutralize it for the time of the detection
+            connection.disconnect = lambda: None
 
-            # Update Constants if Napalm driver is defined for Nautobot Platform
-            netmiko_to_napalm = {**NETMIKO_TO_NAPALM_STATIC, **platform_to_napalm_nautobot}
+        try:
+            guessed_device_type = guesser.autodetect()
+        except Exception:
+            if reuse:
+                # Restore the real disconnect first, the session would otherwise be left open
+                del connection.disconnect
+            self.netmiko_connection = connection
+            self.close_netmiko_connection()
+            raise
+
+        if reuse:
+            del connection.disconnect
+            self.netmiko_connection = connection
 
-            self.napalm_driver = netmiko_to_napalm.get(netmiko_device_type)
+        return guessed_device_type
 
-    def check_napalm_driver_name(self):
-        """Checks for napalm driver name."""
-        if not self.napalm_driver:
-            raise OnboardException(
-                reason="fail-general",
-                message=f"Onboarding for Platform {self.netmiko_device_type} not "
-                f"supported, as it has no specified NAPALM driver",
-            )
+    def close_netmiko_connection(self):
+        """Disconnect the SSH session kept open after autodetection, if it was not handed over to NAPALM."""
+        connection, self.netmiko_connection = self.netmiko_connection, None
 
-    def get_onboarding_facts(self):
-        """Gather information from the network device that is needed to onboard the device into the Nautobot system.
+        if connection is not None:
+            try:
+                connection.disconnect()
+            except Exception as exc:  # pylint: disable=broad-except
+                logger.warning("WARNING: unable to close autodetect SSH session: %s", exc)
 
-        Raises:
-          OnboardException('fail-login'):
-            When unable to login to device
+    def collection_failed(self):
+        """Clean up after a failure to collect the device information.
 
-          OnboardException('fail-execute'):
-            When unable to run commands to collect device information
+        The autodetect SSH session is closed if still open, and a cached device type is
+        forgotten as it may be the reason of the failure.
+        """
+        self.close_netmiko_connection()
 
-          OnboardException('fail-general'):
-            Any other unexpected device comms failure.
+        if self.netmiko_device_type_cached:
+            invalidate_cached_device_type(self.hostname, self.port, self.ssh_banner)
+
+    def handover_netmiko_connection(self, napalm_device):
+        """Hand the SSH session opened for autodetection over to the NAPALM driver.
+
+        Only NAPALM drivers built on top of a Netmiko SSH session can reuse it, the session
+        is closed otherwise.
+
+        Returns:
+          bool: True when NAPALM has been given the session and must not be opened again
         """
-        self.check_reachability()
+        connection, self.netmiko_connection = self.netmiko_connection, None
+        device_type = NAPALM_NETMIKO_DEVICE_TYPES.get(self.napalm_driver)
 
-        logger.info("COLLECT: device information %s", self.hostname)
+        if connection is None:
+            return False
+
+        if device_type is None or getattr(napalm_device, "transport", "ssh") != "ssh":
+            self.netmiko_connection = connection
+            self.close_netmiko_connection()
+            return False
 
         try:
-            # Get Napalm Driver with Netmiko if needed
-            self.set_napalm_driver_name()
+            # SSHDetect disables the verification of the echoed commands, the NAPALM driver
+            # gets the default of its device type as with a session it opens itself
+            connection.global_cmd_verify = None
+            redispatch(connection, device_type=device_type)
 
-            # Raise if no Napalm Driver not selected
-            self.check_napalm_driver_name()
+            if not getattr(napalm_device, "force_no_enable", False):
+                connection.enable()
+
+        except Exception as exc:  # pylint: disable=broad-except
+            logger.warning("WARNING: unable to reuse autodetect SSH session, opening a new one: %s", exc)
+            self.netmiko_connection = connection
+            self.close_netmiko_connection()
+            return False
+
+        # Same attributes as set by NetworkDriver._netmiko_open() when NAPALM opens the session itself
+        napalm_device._netmiko_device = connection  # pylint: disable=protected-access
+        napalm_device.device = connection
+        logger.info("INFO: reusing autodetect SSH session for NAPALM driver %s", self.napalm_driver)
 
-            driver = get_network_driver(self.napalm_driver)
+        return True
 
-            # Create NAPALM optional arguments
-            napalm_optional_args = self.optional_args.copy()
+    def set_napalm_driver_name(self):
+        """Sets napalm driver name."""
+        if not self.napalm_driver:
+            netmiko_device_type = get_cached_device_type(self.hostname, self.port, self.ssh_banner)
 
-            if self.port:
-                napalm_optional_args["port"] = self.port
+            if netmiko_device_type:
+                logger.info("Cached Netmiko Device Type: %s", netmiko_device_type)
+                self.netmiko_device_type_cached = True
+            else:
+                netmiko_device_type = match_ssh_banner(self.ssh_banner)
 
-            if self.secret:
-                napalm_optional_args["secret"] = self.secret
+                if netmiko_device_type:
+                    logger.info("SSH banner %s Netmiko Device Type: %s", self.ssh_banner, netmiko_device_type)
+                    self.netmiko_device_type_from_banner = True
+                else:
+                    with self.observe_phase("autodetect"):
+                        netmiko_device_type = self.guess_netmiko_device_type()
+                    logger.info("Guessed Netmiko Device Type: %s", netmiko_device_type)
 
-            napalm_device = driver(
-                hostname=self.hostname,
-                username=self.username,
-                password=self.password,
-                timeout=self.timeout,
-                optional_args=napalm_optional_args,
+            self.netmiko_device_type = netmiko_device_type
+            self.napalm_driver = get_napalm_driver_map().get(netmiko_device_type)
+
+    def check_napalm_driver_name(self):
+        """Checks for napalm driver name."""
+        if not self.napalm_driver:
+            raise OnboardException(
+                reason="fail-general",
+                message=f"Onboarding for Platform {self.netmiko_device_type} not "
+                f"supported, as it has no specified NAPALM driver",
             )
 
-            napalm_device.open()
+    def collect_napalm_facts(self):
+        """Collect the device facts and interface IP addresses with its NAPALM driver, run its driver extension."""
+        driver = get_network_driver(self.napalm_driver)
+
+        # Create NAPALM optional arguments
+        napalm_optional_args = self.optional_args.copy()
 
+        if self.port:
+            napalm_optional_args["port"] = self.port
+
+        if self.secret:
+            napalm_optional_args["secret"] = self.secret
+
+        napalm_device = driver(
+            hostname=self.hostname,
+            username=self.username,
+            password=self.password,
+            timeout=self.timeout,
+            optional_args=napalm_optional_args,
+        )
+
+        # The session is closed when leaving the block, including on failure
+        with napalm_session(
+            napalm_device,
+            opened=self.handover_netmiko_connection(napalm_device),
+            open_phase=self.observe_phase("napalm_open"),
+        ):
             logger.info("COLLECT: device facts")
-            self.facts = napalm_device.get_facts()
+            with self.observe_phase("napalm_get_facts"):
+                self.facts = napalm_device.get_facts()
 
             logger.info("COLLECT: device interface IPs")
-            self.ip_ifs = napalm_device.get_interfaces_ip()
+            with self.observe_phase("napalm_get_interfaces_ip"):
+                self.ip_ifs = napalm_device.get_interfaces_ip()
 
             module_name = PLUGIN_SETTINGS["onboarding_extensions_map"].get(self.napalm_driver)
 
             if module_name and self.load_driver_extension:
                 try:
                     module = importlib.import_module(module_name)
-                    driver_addon_class = module.OnboardingDriverExtensions(napalm_device=napalm_device)
-                    self.onboarding_class = driver_addon_class.onboarding_class
-                    self.driver_addon_result = driver_addon_class.ext_result
+                    with self.observe_phase("driver_extension"):
+                        driver_addon_class = module.OnboardingDriverExtensions(napalm_device=napalm_device)
+                        self.onboarding_class = driver_addon_class.onboarding_class
+                        self.driver_addon_result = driver_addon_class.ext_result
                 except ModuleNotFoundError:
                     raise OnboardException(
                         reason="fail-general",
@@ -288,15 +458,84 @@ class NetdevKeeper:
                     self.napalm_driver,
                 )
 
+    def get_onboarding_facts(self):
+        """Gather information from the network device that is needed to onboard the device into the Nautobot system.
+
+        Raises:
+          OnboardException('fail-login'):
+            When unable to login to device
+
+          OnboardException('fail-execute'):
+            When unable to run commands to collect device information
+
+          OnboardException('fail-general'):
+            Any other unexpected device comms failure.
+        """
+        # A device already found reachable is only connected to again to read its SSH banner, which
+        # identifies its platform when no NAPALM driver is known yet
+        if not (self.reachable and self.napalm_driver):
+            with self.observe_phase("reachability"):
+                self.check_reachability()
+
+        logger.info("COLLECT: device information %s", self.hostname)
+
+        try:
+            # Get Napalm Driver with Netmiko if needed
+            self.set_napalm_driver_name()
+
+            # Raise if no Napalm Driver not selected
+            self.check_napalm_driver_name()
+
+            try:
+                self.collect_napalm_facts()
+            except (
+                ConnectionException,
+                NetMikoAuthenticationException,
+                NetMikoTimeoutException,
+                SSHException,
+                OSError,
+            ):
+                # Authentication and connection failures do not depend on the platform, no other platform
+                # would fare any better
+                raise
+            except Exception as exc:  # pylint: disable=broad-except
+                if not self.netmiko_device_type_from_banner:
+                    raise
+
+                # Different platforms may share the same SSH banner, e.g. Cisco IOS and ASA
+                logger.warning(
+                    "WARNING: onboarding as %s, identified by its SSH banner, failed (%s), auto-detecting",
+                    self.netmiko_device_type,
+                    exc,
+                )
+                self.netmiko_device_type_from_banner = False
+
+                with self.observe_phase("autodetect"):
+                    netmiko_device_type = self.guess_netmiko_device_type()
+
+                if netmiko_device_type == self.netmiko_device_type:
+                    raise
+
+                self.netmiko_device_type = netmiko_device_type
+                self.napalm_driver = get_napalm_driver_map().get(netmiko_device_type)
+                self.check_napalm_driver_name()
+                self.collect_napalm_facts()
+
         except ConnectionException as exc:
+            self.collection_failed()
             raise OnboardException(reason="fail-login", message=exc.args[0])
 
         except CommandErrorException as exc:
+            self.collection_failed()
             raise OnboardException(reason="fail-execute", message=exc.args[0])
 
         except Exception as exc:
+            self.collection_failed()
             raise OnboardException(reason="fail-general", message=str(exc))
 
+        if self.netmiko_device_type and not self.netmiko_device_type_cached:
+            set_cached_device_type(self.hostname, self.port, self.netmiko_device_type, self.ssh_banner)
+
     def get_netdev_dict(self):
         """Construct network device dict."""
         netdev_dict = {
@@ -307,6 +546,7 @@ class NetdevKeeper:
             "netdev_mgmt_ifname": get_mgmt_info(hostname=self.hostname, ip_ifs=self.ip_ifs)[0],
             "netdev_mgmt_pflen": get_mgmt_info(hostname=self.hostname, ip_ifs=self.ip_ifs)[1],
             "netdev_netmiko_device_type": self.netmiko_device_type,
+            "netdev_napalm_driver": self.napalm_driver,
             "onboarding_class": self.onboarding_class,
             "driver_addon_result": self.driver_addon_result,
         }
@@ -12,12 +12,65 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import hashlib
+import json
+import logging
+
 from django.conf import settings
 
+from .models import OnboardingDevice
 from .netdev_keeper import NetdevKeeper
 
+logger = logging.getLogger("rq.worker")
+
 PLUGIN_SETTINGS = settings.PLUGINS_CONFIG["nautobot_device_onboarding"]
 
+# Onboarding kwargs determining what is written to Nautobot, see facts_fingerprint()
+FINGERPRINT_KWARGS = (
+    "netdev_mgmt_ip_address",
+    "netdev_nb_site_slug",
+    "netdev_nb_device_type_slug",
+    "netdev_nb_role_slug",
+    "netdev_nb_platform_slug",
+    "netdev_hostname",
+    "netdev_vendor",
+    "netdev_model",
+    "netdev_serial_number",
+    "netdev_mgmt_ifname",
+    "netdev_mgmt_pflen",
+    "netdev_netmiko_device_type",
+    "netdev_napalm_driver",
+)
+
+
+def facts_fingerprint(onboarding_kwargs, device):
+    """Return a fingerprint of what an onboarding writes to Nautobot, and of the device it was written to.
+
+    The fingerprint includes the `last_updated` time and primary IP addresses of the device, so that it no
+    longer matches once the device was changed by other means than the onboarding.
+
+    Args:
+      onboarding_kwargs (dict): Onboarding kwargs, as passed to the onboarding class
+      device (Device): Nautobot device as left by the onboarding
+
+    Returns:
+      str: SHA-256 hex digest
+    """
+    onboarding_class = onboarding_kwargs["onboarding_class"]
+    facts = {name: onboarding_kwargs[name] for name in FINGERPRINT_KWARGS}
+    facts["onboarding_class"] = f"{onboarding_class.__module__}.{onboarding_class.__qualname__}"
+    # Results without a stable representation never match, the device is then always onboarded
+    facts["driver_addon_result"] = repr(onboarding_kwargs["driver_addon_result"])
+    # Deleting the primary IP address of a device clears it without updating the device last_updated time
+    facts["device"] = [
+        str(device.pk),
+        device.last_updated.timestamp() if device.last_updated else None,
+        str(device.primary_ip4_id),
+        str(device.primary_ip6_id),
+    ]
+
+    return hashlib.sha256(json.dumps(facts, sort_keys=True, default=str).encode()).hexdigest()
+
 
 class OnboardingTaskManager:
     """Onboarding Task Manager."""
@@ -77,32 +130,77 @@ class OnboardingTaskManager:
         """Return ot's device platform."""
         return self.ot.platform
 
+    def get_credentials(self, username, password, secret):
+        """Return device username, password and secret, defaulting to the NAPALM settings when not provided."""
+        return (
+            username or settings.NAPALM_USERNAME,
+            password or settings.NAPALM_PASSWORD,
+            secret or self.optional_args.get("secret", None) or settings.NAPALM_ARGS.get("secret", None),
+        )
+
+
+def collect_netdev_dict(otm, username, password, secret, reachable=False):
+    """Connect to the network device of an Onboarding Task and return the discovered device information.
+
+    Only device I/O happens here, nothing is written to the Nautobot database, so it can be
+    safely executed from a worker thread.
+
+    Args:
+      otm (OnboardingTaskManager): Onboarding Task Manager of the task to process
+      username (str): Device username
+      password (str): Device password
+      secret (str): Device secret password
+      reachable (bool): The device was already found reachable, see NetdevKeeper
+
+    Returns:
+      dict: network device dict as returned by NetdevKeeper.get_netdev_dict()
+    """
+    netdev = NetdevKeeper(
+        hostname=otm.ip_address,
+        port=otm.port,
+        timeout=otm.timeout,
+        username=username,
+        password=password,
+        secret=secret,
+        napalm_driver=otm.napalm_driver,
+        optional_args=otm.optional_args or settings.NAPALM_ARGS,
+        site=otm.site.slug if otm.site else None,
+        phase_durations=otm.ot.phase_durations,
+        reachable=reachable,
+    )
+
+    netdev.get_onboarding_facts()
+
+    return netdev.get_netdev_dict()
+
 
 class OnboardingManager:
     """Onboarding Manager."""
 
-    def __init__(self, ot, username, password, secret):
-        """Inits class."""
+    def __init__(  # pylint: disable=R0913
+        self, ot, username, password, secret, netdev_dict=None, onboarded_device=None
+    ):
+        """Inits class.
+
+        When the facts collected from an onboarded device match the fingerprint recorded by its latest
+        successful onboarding, nothing is written to Nautobot and `unchanged` is set.
+
+        Args:
+          ot (OnboardingTask): Onboarding Task to process
+          username (str): Device username
+          password (str): Device password
+          secret (str): Device secret password
+          netdev_dict (dict): Device information already collected with collect_netdev_dict(),
+            the device is not contacted again when provided
+          onboarded_device (Device): Device already present in Nautobot with the IP address of the task
+        """
         # Create instance of Onboarding Task Manager class:
         otm = OnboardingTaskManager(ot)
 
-        self.username = username or settings.NAPALM_USERNAME
-        self.password = password or settings.NAPALM_PASSWORD
-        self.secret = secret or otm.optional_args.get("secret", None) or settings.NAPALM_ARGS.get("secret", None)
-
-        netdev = NetdevKeeper(
-            hostname=otm.ip_address,
-            port=otm.port,
-            timeout=otm.timeout,
-            username=self.username,
-            password=self.password,
-            secret=self.secret,
-            napalm_driver=otm.napalm_driver,
-            optional_args=otm.optional_args or settings.NAPALM_ARGS,
-        )
+        self.username, self.password, self.secret = otm.get_credentials(username, password, secret)
 
-        netdev.get_onboarding_facts()
-        netdev_dict = netdev.get_netdev_dict()
+        if netdev_dict is None:
+            netdev_dict = collect_netdev_dict(otm, self.username, self.password, self.secret)
 
         onboarding_kwargs = {
             # Kwargs extracted from OnboardingTask:
@@ -120,12 +218,31 @@ class OnboardingManager:
             "netdev_mgmt_ifname": netdev_dict["netdev_mgmt_ifname"],
             "netdev_mgmt_pflen": netdev_dict["netdev_mgmt_pflen"],
             "netdev_netmiko_device_type": netdev_dict["netdev_netmiko_device_type"],
+            "netdev_napalm_driver": netdev_dict["netdev_napalm_driver"],
             "onboarding_class": netdev_dict["onboarding_class"],
             "driver_addon_result": netdev_dict["driver_addon_result"],
+            # Time spent in each phase, recorded on the OnboardingTask
+            "phase_durations": ot.phase_durations,
         }
 
+        self.unchanged = False
+
+        if onboarded_device and PLUGIN_SETTINGS["skip_unchanged_devices"]:
+            self.facts_fingerprint = facts_fingerprint(onboarding_kwargs, onboarded_device)
+
+            if OnboardingDevice.objects.filter(
+                device=onboarded_device, facts_fingerprint=self.facts_fingerprint
+            ).exists():
+                logger.info("UNCHANGED: device %s, nothing to write", onboarded_device.name)
+                self.created_device = onboarded_device
+                self.unchanged = True
+                return
+
         onboarding_cls = netdev_dict["onboarding_class"]()
         onboarding_cls.credentials = {"username": self.username, "password": self.password, "secret": self.secret}
         onboarding_cls.run(onboarding_kwargs=onboarding_kwargs)
 
         self.created_device = onboarding_cls.created_device
+        self.facts_fingerprint = (
+            facts_fingerprint(onboarding_kwargs, self.created_device) if self.created_device else ""
+        )
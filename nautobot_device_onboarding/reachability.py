@@ -0,0 +1,144 @@
+"""Concurrent reachability checks of the devices to onboard.
+
+(c) 2020-2021 Network To Code
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+  http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import asyncio
+import logging
+
+import netaddr
+from django.conf import settings
+from django.db.models import CharField, F, Value
+from django.db.models.functions import Cast, Concat
+from django.utils import timezone
+
+from .choices import OnboardingFailChoices, OnboardingStatusChoices
+from .metrics import onboardingtask_results_counter
+from .models import OnboardingTask
+
+logger = logging.getLogger("rq.worker")
+
+PLUGIN_SETTINGS = settings.PLUGINS_CONFIG["nautobot_device_onboarding"]
+
+
+async def _probe(host, port, timeout, semaphore):
+    """Open and immediately close a TCP connection to host:port, return True when it succeeded."""
+    async with semaphore:
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout=timeout)
+        except (OSError, asyncio.TimeoutError):
+            return False
+
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except OSError:
+            pass
+
+        return True
+
+
+async def _probe_all(targets, concurrency):
+    """Probe all the targets with at most `concurrency` connections in flight."""
+    semaphore = asyncio.Semaphore(concurrency)
+    results = await asyncio.gather(*(_probe(host, port, timeout, semaphore) for host, port, timeout in targets))
+
+    return dict(zip(targets, results))
+
+
+def probe_reachability(targets, concurrency=None):
+    """TCP-probe many devices concurrently.
+
+    Args:
+      targets (iterable): (host, port, timeout) tuples to probe
+      concurrency (int): Maximum number of connections in flight, defaults to the
+        `reachability_concurrency` plugin setting
+
+    Returns:
+      dict: True or False reachability result, keyed by (host, port, timeout) target
+    """
+    targets = list(dict.fromkeys(targets))
+
+    if not targets:
+        return {}
+
+    concurrency = concurrency or PLUGIN_SETTINGS["reachability_concurrency"]
+    logger.info("CHECK: reachability of %s targets", len(targets))
+
+    return asyncio.run(_probe_all(targets, concurrency))
+
+
+def discover_hosts(prefix, port, timeout, concurrency=None):
+    """Find the hosts of a prefix accepting TCP connections on a given port.
+
+    Args:
+      prefix (str): Prefix to sweep, e.g. "10.20.0.0/22"
+      port (int): Port to probe, usually the SSH port
+      timeout (int): Connection timeout of each probe
+      concurrency (int): Maximum number of connections in flight
+
+    Returns:
+      list: IP addresses of the listening hosts, in prefix order
+    """
+    hosts = [str(ip) for ip in netaddr.IPNetwork(prefix).iter_hosts()]
+    results = probe_reachability(((host, port, timeout) for host in hosts), concurrency=concurrency)
+
+    return [host for host in hosts if results[(host, port, timeout)]]
+
+
+def sweep_onboarding_tasks(onboarding_tasks):
+    """Check the reachability of OnboardingTasks and fail the unreachable ones in bulk.
+
+    The IP address of the tasks is expected to be already resolved. Unreachable tasks are
+    updated with a single query and marked as failed with the `fail-connect` reason.
+
+    Args:
+      onboarding_tasks (list): OnboardingTask instances to check
+
+    Returns:
+      (list, list): reachable and unreachable OnboardingTasks
+    """
+    results = probe_reachability((ot.ip_address, ot.port, ot.timeout) for ot in onboarding_tasks)
+
+    reachable, unreachable = [], []
+    for ot in onboarding_tasks:
+        if results[(ot.ip_address, ot.port, ot.timeout)]:
+            reachable.append(ot)
+        else:
+            unreachable.append(ot)
+
+    if unreachable:
+        now = timezone.now()
+        OnboardingTask.objects.filter(id__in=[ot.id for ot in unreachable]).update(
+            status=OnboardingStatusChoices.STATUS_FAILED,
+            failed_reason=OnboardingFailChoices.FAIL_CONNECT,
+            message=Concat(
+                Value("ERROR device unreachable: "),
+                F("ip_address"),
+                Value(":"),
+                Cast(F("port"), output_field=CharField()),
+                output_field=CharField(),
+            ),
+            last_updated=now,
+            finished=now,
+        )
+
+        for ot in unreachable:
+            ot.finished = now
+            ot.status = OnboardingStatusChoices.STATUS_FAILED
+            ot.failed_reason = OnboardingFailChoices.FAIL_CONNECT
+            ot.message = f"ERROR device unreachable: {ot.ip_address}:{ot.port}"
+
+        onboardingtask_results_counter.labels(status=OnboardingStatusChoices.STATUS_FAILED).inc(len(unreachable))
+        logger.info("CHECK: %s of %s devices unreachable", len(unreachable), len(onboarding_tasks))
+
+    return reachable, unreachable
@@ -0,0 +1,421 @@
+"""Simulated SSH network devices, to load test the onboarding on a single host.
+
+(c) 2020-2021 Network To Code
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+  http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import ipaddress
+import json
+import logging
+import random
+import re
+import selectors
+import socket
+import threading
+import time
+from string import Template
+
+import paramiko
+
+logger = logging.getLogger("rq.worker")
+
+INVALID_INPUT = "% Invalid input detected at '^' marker."
+
+# Commands sent by Netmiko while preparing a session, accepted by all the simulated devices
+SESSION_COMMANDS = ("", "terminal length 0", "terminal width 511", "terminal pager 0", "enable")
+
+IOS_SHOW_VERSION = """\
+Cisco IOS Software, IOSv Software (VIOS-ADVENTERPRISEK9-M), Version 15.6(2)T, RELEASE SOFTWARE (fc2)
+Technical Support: http://www.cisco.com/techsupport
+Copyright (c) 1986-2016 by Cisco Systems, Inc.
+
+ROM: Bootstrap program is IOSv
+
+$hostname uptime is 1 week, 2 days, 3 hours, 4 minutes
+System returned to ROM by reload
+System image file is "flash0:/vios-adventerprisek9-m"
+
+cisco IOSv (revision 1.0) processor with 460033K/62464K bytes of memory.
+Processor board ID $serial
+1 Gigabit Ethernet interface
+256K bytes of non-volatile configuration memory.
+$padding
+Configuration register is 0x0"""
+
+NXOS_SHOW_VERSION = """\
+Cisco Nexus Operating System (NX-OS) Software
+TAC support: http://www.cisco.com/tac
+Copyright (C) 2002-2020, Cisco and/or its affiliates.
+
+Software
+  NXOS: version 9.3(3)
+  NXOS image file is: bootflash:///nxos.9.3.3.bin
+
+Hardware
+  cisco Nexus9000 C9300v Chassis
+  Intel(R) Xeon(R) CPU  @ 2.20GHz with 8161144 kB of memory.
+  Processor Board ID $serial
+
+  Device name: $hostname
+  bootflash: 4287040 kB
+$padding
+Kernel uptime is 1 day(s), 2 hour(s), 3 minute(s), 4 second(s)"""
+
+EOS_SHOW_VERSION = """\
+Arista vEOS
+Hardware version:
+Serial number: $serial
+System MAC address:  5000.00d7.ee0b
+
+Software image version: 4.22.4M
+Architecture:           i686
+Internal build version: 4.22.4M-15583082.4224M
+$padding
+Uptime:                 1 day and 2 hours
+Total memory:           2014480 kB
+Free memory:            1332976 kB"""
+
+# Prompt, SSH server banner and command outputs of each simulated platform, keyed by Netmiko device type.
+# The outputs cover the Netmiko autodetection and the getters used by the onboarding, with the NAPALM
+# ios, nxos_ssh and eos (`transport: ssh` optional argument) drivers. Templates are rendered with the
+# hostname, serial, address, network, prefix_length and padding variables of each simulated device.
+PROFILES = {
+    "cisco_ios": {
+        "banner": "SSH-2.0-Cisco-1.25",
+        "prompt": "$hostname#",
+        "commands": {
+            "show version": IOS_SHOW_VERSION,
+            "show hosts": "Default domain is sim.local\nName/address lookup uses static mappings",
+            "show ip interface brief": (
+                "Interface              IP-Address      OK? Method Status                Protocol\n"
+                "GigabitEthernet0/0     $address        YES NVRAM  up                    up"
+            ),
+            "show ip interface": (
+                "GigabitEthernet0/0 is up, line protocol is up\n"
+                "  Internet address is $address/$prefix_length\n"
+                "  Broadcast address is 255.255.255.255"
+            ),
+            "show ipv6 interface": "",
+            "dir": (
+                "Directory of flash0:/\n\n"
+                "    1  -rw-   147988420   Jan 1 2020 00:00:00 +00:00  vios-adventerprisek9-m\n\n"
+                "2142715904 bytes total (1994727484 bytes free)"
+            ),
+        },
+    },
+    "cisco_nxos": {
+        "banner": "SSH-2.0-OpenSSH_8.3",
+        "prompt": "$hostname#",
+        "commands": {
+            "show version": NXOS_SHOW_VERSION,
+            "show hostname": "$hostname",
+            "show hosts": "DNS lookup enabled\nDefault domain for vrf:default is sim.local",
+            "show interface status": (
+                "--------------------------------------------------------------------------------\n"
+                "Port          Name               Status    Vlan      Duplex  Speed   Type\n"
+                "--------------------------------------------------------------------------------\n"
+                "mgmt0         --                 connected routed    full    1000    --"
+            ),
+            "show ip interface vrf all": (
+                'IP Interface Status for VRF "management"(2)\n'
+                "mgmt0, Interface status: protocol-up/link-up/admin-up, iod: 2,\n"
+                "  IP address: $address, IP subnet: $network/$prefix_length route-preference: 0, tag: 0"
+            ),
+            "show ipv6 interface vrf all": "",
+        },
+    },
+    "arista_eos": {
+        "banner": "SSH-2.0-OpenSSH_7.8",
+        "prompt": "$hostname#",
+        "commands": {
+            "show version": EOS_SHOW_VERSION,
+            "show version | json": json.dumps(
+                {
+                    "modelName": "vEOS",
+                    "version": "4.22.4M",
+                    "serialNumber": "$serial",
+                    "systemMacAddress": "50:00:00:d7:ee:0b",
+                    "bootupTimestamp": 1600000000.0,
+                    "uptime": 93600.0,
+                    "memTotal": 2014480,
+                    "memFree": 1332976,
+                }
+            ),
+            "show hostname | json": json.dumps({"hostname": "$hostname", "fqdn": "$hostname.sim.local"}),
+            "show interfaces | json": json.dumps({"interfaces": {"Management1": {"name": "Management1"}}}),
+            "show ip interface | json": (
+                '{"interfaces": {"Management1": {"name": "Management1", "interfaceAddress": {'
+                '"primaryIp": {"address": "$address", "maskLen": $prefix_length}, "secondaryIpsOrderedList": []}}}}'
+            ),
+            "show ipv6 interface | json": json.dumps({"interfaces": {}}),
+        },
+    },
+}
+
+
+class SimulatedDevice:  # pylint: disable=too-many-instance-attributes
+    """A network device served over SSH by the DeviceSimulator.
+
+    Args:
+      address (str): IP address the device listens on, also reported as its management IP address
+      port (int): Port the device listens on
+      device_type (str): Netmiko device type of the device, a key of `profiles`
+      serial (str): Serial number of the device
+      prefix_length (int): Prefix length of the management IP address
+      latency (float): Time waited before answering each command, in seconds
+      jitter (float): Maximum random time added to the latency, in seconds
+      auth_failure_rate (float): Share of the SSH logins rejected
+      command_error_rate (float): Share of the commands answered with an error
+      output_lines (int): Number of filler lines added to the `show version` output
+      profiles (dict): Profiles of the simulated platforms, defaults to PROFILES
+    """
+
+    def __init__(  # pylint: disable=R0913
+        self,
+        address,
+        port,
+        device_type="cisco_ios",
+        serial="SIM0000001",
+        prefix_length=24,
+        latency=0,
+        jitter=0,
+        auth_failure_rate=0,
+        command_error_rate=0,
+        output_lines=0,
+        profiles=None,
+    ):
+        """Create a simulated device."""
+        self.address = address
+        self.port = port
+        self.device_type = device_type
+        self.profile = (profiles or PROFILES)[device_type]
+        self.hostname = f"sim-{address.replace('.', '-').replace(':', '-')}-{port}"
+        self.latency = latency
+        self.jitter = jitter
+        self.auth_failure_rate = auth_failure_rate
+        self.command_error_rate = command_error_rate
+
+        self.variables = {
+            "hostname": self.hostname,
+            "serial": serial,
+            "address": address,
+            "network": str(ipaddress.ip_interface(f"{address}/{prefix_length}").network.network_address),
+            "prefix_length": prefix_length,
+            "padding": "\n".join(f"License feature {index}: enabled" for index in range(output_lines)),
+        }
+        self.prompt = Template(self.profile["prompt"]).safe_substitute(self.variables)
+
+    @property
+    def banner(self):
+        """Return the SSH server identification banner of the device."""
+        return self.profile["banner"]
+
+    def authenticate(self):
+        """Return True when the login is accepted."""
+        return random.random() >= self.auth_failure_rate  # nosec
+
+    def run_command(self, command):
+        """Return the output of a command, after the simulated latency."""
+        command = " ".join(command.split())
+
+        if command in SESSION_COMMANDS:
+            return ""
+
+        if self.latency or self.jitter:
+            time.sleep(self.latency + random.uniform(0, self.jitter))  # nosec
+
+        output = self.profile["commands"].get(command)
+
+        if output is None or random.random() < self.command_error_rate:  # nosec
+            return INVALID_INPUT
+
+        return Template(output).safe_substitute(self.variables)
+
+
+class _SSHServer(paramiko.ServerInterface):
+    """SSH server side of a session with a simulated device, any user is accepted with any password."""
+
+    def __init__(self, device):
+        self.device = device
+        self.shell_requested = threading.Event()
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_auth_password(self, username, password):
+        if self.device.authenticate():
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_pty_request(self, *args):  # pylint: disable=arguments-differ
+        return True
+
+    def check_channel_shell_request(self, channel):
+        self.shell_requested.set()
+        return True
+
+
+def _send(channel, text):
+    """Send text to the SSH client with network device line endings."""
+    channel.sendall(re.sub(r"\r?\n", "\r\n", text).encode())
+
+
+def serve_shell(channel, device):
+    """Run the interactive shell of a simulated device on an SSH channel until the client leaves.
+
+    Commands are echoed back as they are received, and answered followed by the device prompt.
+    """
+    _send(channel, f"\n{device.prompt}")
+    line, last_char = "", ""
+
+    while True:
+        data = channel.recv(1024)
+        if not data:
+            return
+
+        for char in data.decode(errors="ignore"):
+            # Handle "\r\n" as a single line ending
+            if char == "\n" and last_char == "\r":
+                last_char = char
+                continue
+            last_char = char
+
+            if char not in "\r\n":
+                line += char
+                _send(channel, char)
+                continue
+
+            command, line = line.strip(), ""
+            if command in ("exit", "quit", "logout"):
+                return
+
+            output = device.run_command(command)
+            _send(channel, f"\n{output}\n{device.prompt}" if output else f"\n{device.prompt}")
+
+
+class DeviceSimulator:
+    """Serve many simulated devices over SSH, each on its own address and port.
+
+    A single thread accepts the connections of all the devices, each SSH session being served by its own
+    threads. Use as a context manager, or call start() and stop().
+
+    Args:
+      devices (list): SimulatedDevice instances to serve
+      host_key (paramiko.PKey): SSH host key shared by all the devices, generated when not provided
+    """
+
+    def __init__(self, devices, host_key=None):
+        """Create a simulator, not serving until started."""
+        self.devices = devices
+        self.host_key = host_key or paramiko.RSAKey.generate(2048)
+        self._selector = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start listening on the address and port of all the devices."""
+        self._selector = selectors.DefaultSelector()
+
+        for device in self.devices:
+            family = socket.AF_INET6 if ":" in device.address else socket.AF_INET
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind((device.address, device.port))
+            sock.listen(128)
+            sock.setblocking(False)
+            self._selector.register(sock, selectors.EVENT_READ, device)
+
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._accept_connections, name="device-simulator", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop listening, the sessions in progress are left to finish."""
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+
+        for key in list(self._selector.get_map().values()):
+            self._selector.unregister(key.fileobj)
+            key.fileobj.close()
+        self._selector.close()
+
+    def __enter__(self):
+        """Start the simulator."""
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        """Stop the simulator."""
+        self.stop()
+
+    def _accept_connections(self):
+        """Accept the connections to all the devices, until stopped."""
+        while not self._stopped.is_set():
+            for key, _ in self._selector.select(timeout=0.5):
+                try:
+                    sock, _ = key.fileobj.accept()
+                except OSError:
+                    continue
+
+                sock.setblocking(True)
+                threading.Thread(target=self._serve_session, args=(sock, key.data), daemon=True).start()
+
+    def _serve_session(self, sock, device):
+        """Serve an SSH session, closed when the client leaves or fails to log in."""
+        transport = paramiko.Transport(sock)
+        transport.local_version = device.banner
+        transport.add_server_key(self.host_key)
+        server = _SSHServer(device)
+
+        try:
+            transport.start_server(server=server)
+            channel = transport.accept(timeout=30)
+
+            if channel is not None and server.shell_requested.wait(timeout=10):
+                serve_shell(channel, device)
+
+        except (paramiko.SSHException, EOFError, OSError) as exc:
+            # Reachability checks and SSH banner reads disconnect before logging in
+            logger.debug("SIMULATOR: session with %s:%s ended: %s", device.address, device.port, exc)
+
+        finally:
+            transport.close()
+
+
+def simulated_devices(count, address="127.0.1.1", port=2222, device_types=None, **kwargs):
+    """Return `count` simulated devices on consecutive IP addresses, cycling over the device types.
+
+    Args:
+      count (int): Number of devices
+      address (str): IP address of the first device
+      port (int): Port of all the devices
+      device_types (list): Netmiko device types of the devices, defaults to all the simulated platforms
+      **kwargs: Other arguments of each SimulatedDevice
+    """
+    device_types = device_types or list(kwargs.get("profiles") or PROFILES)
+    first_address = ipaddress.ip_address(address)
+
+    return [
+        SimulatedDevice(
+            str(first_address + index),
+            port,
+            device_type=device_types[index % len(device_types)],
+            serial=f"SIM{index + 1:07d}",
+            **kwargs,
+        )
+        for index in range(count)
+    ]
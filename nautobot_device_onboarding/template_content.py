@@ -23,7 +23,7 @@ class DeviceContent(PluginTemplateExtension):  # pylint: disable=abstract-method
 
     def right_page(self):
         """Show table on right side of view."""
-        onboarding = OnboardingDevice.objects.filter(device=self.context["object"]).first()
+        onboarding = OnboardingDevice.objects.filter(device=self.context["object"]).select_related("last_task").first()
 
         if not onboarding or not onboarding.enabled:
             return ""
@@ -11,13 +11,18 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
+from unittest import mock
+
 from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APIClient
 
-from nautobot.users.models import Token
+from nautobot.users.models import ObjectPermission, Token
 from nautobot.dcim.models import Site
 
 from nautobot_device_onboarding.models import OnboardingTask
@@ -50,6 +55,22 @@ class OnboardingTaskTestCase(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data["count"], 2)
 
+    def test_list_onboarding_tasks_queries(self):
+        """Verify that the number of queries to list OnboardingTasks does not grow with the number of tasks."""
+        url = reverse(f"{self.base_url_lookup}-list")
+        # The first request records the use of the token
+        self.client.get(url)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+
+        for index in range(10):
+            OnboardingTask.objects.create(ip_address=f"10.10.20.{index}", site=self.site1)
+
+        with self.assertNumQueries(len(queries)):
+            response = self.client.get(url)
+        self.assertEqual(response.data["count"], 12)
+
     def test_get_onboarding_task(self):
         """Verify that an Onboardingtask can be retrieved."""
         url = reverse(f"{self.base_url_lookup}-detail", kwargs={"pk": self.onboarding_task1.pk})
@@ -106,3 +127,134 @@ class OnboardingTaskTestCase(TestCase):
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
         with self.assertRaises(OnboardingTask.DoesNotExist):
             OnboardingTask.objects.get(pk=self.onboarding_task1.pk)
+
+    @mock.patch("nautobot_device_onboarding.api.serializers.enqueue_prefix_onboarding")
+    def test_onboard_prefix(self, mock_enqueue):
+        """Verify that the onboarding of a prefix can be requested."""
+        url = reverse(f"{self.base_url_lookup}-prefix")
+        data = {"prefix": "10.20.0.7/22", "site": self.site1.slug, "username": "user"}
+
+        response = self.client.post(url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data["prefix"], "10.20.0.0/22")
+        self.assertNotIn("username", response.data)
+
+        prefix, onboarding_task_kwargs, credentials = mock_enqueue.call_args[0]
+        self.assertEqual(prefix, "10.20.0.0/22")
+        self.assertEqual(onboarding_task_kwargs["site_id"], str(self.site1.id))
+        self.assertEqual(onboarding_task_kwargs["port"], 22)
+        self.assertEqual(credentials.username, "user")
+        self.assertEqual(mock_enqueue.call_args[1]["user_id"], str(self.user.pk))
+        self.assertEqual(OnboardingTask.objects.count(), 2)
+
+    @mock.patch("nautobot_device_onboarding.api.serializers.enqueue_prefix_onboarding")
+    def test_onboard_prefix_object_permissions(self, mock_enqueue):
+        """Verify that the onboarding of a prefix is refused when its tasks violate the object permissions."""
+        site2 = Site.objects.create(name="USEAST", slug="useast")
+        self.user.is_superuser = False
+        self.user.save()
+        obj_perm = ObjectPermission.objects.create(
+            name="Onboard USWEST", constraints={"site__slug": self.site1.slug}, actions=["add", "view"]
+        )
+        obj_perm.users.add(self.user)
+        obj_perm.object_types.add(ContentType.objects.get_for_model(OnboardingTask))
+
+        url = reverse(f"{self.base_url_lookup}-prefix")
+        data = {"prefix": "10.20.0.0/22", "site": site2.slug}
+
+        response = self.client.post(url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(OnboardingTask.objects.count(), 2)
+        mock_enqueue.assert_not_called()
+
+    @mock.patch("nautobot_device_onboarding.api.serializers.enqueue_prefix_onboarding")
+    def test_onboard_prefix_too_large(self, mock_enqueue):
+        """Verify that prefixes larger than allowed are rejected."""
+        url = reverse(f"{self.base_url_lookup}-prefix")
+        data = {"prefix": "10.0.0.0/8", "site": self.site1.slug}
+
+        response = self.client.post(url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("prefix", response.data)
+        mock_enqueue.assert_not_called()
+
+    @mock.patch("nautobot_device_onboarding.api.serializers.enqueue_onboarding_batch")
+    def test_onboard_bulk(self, mock_enqueue):
+        """Verify that a list of devices can be onboarded with a single request."""
+        url = reverse(f"{self.base_url_lookup}-bulk")
+        data = {
+            "username": "user",
+            "tasks": [{"ip_address": f"10.30.0.{index}", "site": self.site1.slug} for index in range(1, 51)],
+        }
+        data["tasks"][0]["port"] = 2222
+
+        response = self.client.post(url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data["task_ids"]), 50)
+        self.assertNotIn("username", response.data)
+
+        onboarding_tasks = OnboardingTask.objects.filter(id__in=response.data["task_ids"]).order_by("label")
+        self.assertEqual(onboarding_tasks.count(), 50)
+        self.assertEqual(onboarding_tasks[0].ip_address, "10.30.0.1")
+        self.assertEqual(onboarding_tasks[0].port, 2222)
+        self.assertEqual(onboarding_tasks[1].port, 22)
+        self.assertEqual({ot.site for ot in onboarding_tasks}, {self.site1})
+
+        task_ids, credentials = mock_enqueue.call_args[0]
+        self.assertEqual(task_ids, response.data["task_ids"])
+        self.assertEqual(credentials.username, "user")
+
+    @mock.patch("nautobot_device_onboarding.api.serializers.enqueue_onboarding_batch")
+    def test_onboard_bulk_unknown_slug(self, mock_enqueue):
+        """Verify that the whole request is rejected when an entry refers to an unknown object."""
+        url = reverse(f"{self.base_url_lookup}-bulk")
+        data = {
+            "tasks": [
+                {"ip_address": "10.30.0.1", "site": self.site1.slug},
+                {"ip_address": "10.30.0.2", "site": "unknown"},
+            ],
+        }
+
+        response = self.client.post(url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data["tasks"][0], {})
+        self.assertIn("site", response.data["tasks"][1])
+        self.assertEqual(OnboardingTask.objects.count(), 2)
+        mock_enqueue.assert_not_called()
+
+    @mock.patch("nautobot_device_onboarding.api.serializers.enqueue_onboarding_batch")
+    def test_onboard_bulk_unknown_device_type(self, mock_enqueue):
+        """Verify that the whole request is rejected when an entry refers to an unknown device type."""
+        url = reverse(f"{self.base_url_lookup}-bulk")
+        data = {"tasks": [{"ip_address": "10.30.0.1", "site": self.site1.slug, "device_type": "unknown"}]}
+
+        response = self.client.post(url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("device_type", response.data["tasks"][0])
+        self.assertEqual(OnboardingTask.objects.count(), 2)
+        mock_enqueue.assert_not_called()
+
+    @mock.patch("nautobot_device_onboarding.api.serializers.enqueue_onboarding_batch")
+    def test_onboard_bulk_object_permissions(self, mock_enqueue):
+        """Verify that no task is created when an entry violates the object permissions of the user."""
+        site2 = Site.objects.create(name="USEAST", slug="useast")
+        self.user.is_superuser = False
+        self.user.save()
+        obj_perm = ObjectPermission.objects.create(
+            name="Onboard USWEST", constraints={"site__slug": self.site1.slug}, actions=["add", "view"]
+        )
+        obj_perm.users.add(self.user)
+        obj_perm.object_types.add(ContentType.objects.get_for_model(OnboardingTask))
+
+        url = reverse(f"{self.base_url_lookup}-bulk")
+        data = {
+            "tasks": [
+                {"ip_address": "10.30.0.1", "site": self.site1.slug},
+                {"ip_address": "10.30.0.2", "site": site2.slug},
+            ],
+        }
+
+        response = self.client.post(url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(OnboardingTask.objects.count(), 2)
+        mock_enqueue.assert_not_called()
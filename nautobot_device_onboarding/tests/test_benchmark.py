@@ -0,0 +1,40 @@
+"""Unit tests for nautobot_device_onboarding.benchmark module.
+
+(c) 2020-2021 Network To Code
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+  http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from django.test import TestCase
+from nautobot.dcim.models import Device
+
+from nautobot_device_onboarding.benchmark import create_benchmark_fixtures, percentile, run_benchmark
+
+
+class BenchmarkTestCase(TestCase):
+    """Test the onboarding benchmark on a small database."""
+
+    def test_percentile(self):
+        """Verify the nearest-rank percentile."""
+        self.assertEqual(percentile(list(range(1, 101)), 95), 95)
+        self.assertEqual(percentile([3, 1, 2], 50), 2)
+        self.assertIsNone(percentile([], 95))
+
+    def test_run_benchmark(self):
+        """Verify that new and existing mocked devices are onboarded and the throughput reported."""
+        sites, platform = create_benchmark_fixtures(sites=2, devices=4, custom_fields=2)
+
+        report = run_benchmark(sites, platform, tasks=4, existing_ratio=0.5)
+
+        self.assertEqual(report["failed"], 0, report["errors"])
+        self.assertEqual(Device.objects.count(), 6)
+        self.assertGreater(report["queries_per_task"], 0)
+        self.assertIn("ensure_device_instance", report["phases_p95"])
+        self.assertIn("napalm_get_facts", report["phases_p95"])
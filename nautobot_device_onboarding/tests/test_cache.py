@@ -0,0 +1,108 @@
+"""Unit tests for nautobot_device_onboarding.cache module.
+
+(c) 2020-2021 Network To Code
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+  http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from unittest import mock
+
+from django.conf import settings
+from django.test import TestCase
+from nautobot.dcim.models import Platform, Site
+
+from nautobot_device_onboarding.cache import get_napalm_driver_map, reference_cache
+from nautobot_device_onboarding.nautobot_keeper import cached_get
+
+PLUGIN_SETTINGS = settings.PLUGINS_CONFIG["nautobot_device_onboarding"]
+
+
+# TestCase never commits, run the on_commit callbacks right away as if it did
+@mock.patch("nautobot_device_onboarding.cache.transaction.on_commit", side_effect=lambda func: func())
+class NapalmDriverMapTestCase(TestCase):
+    """Test the cached NAPALM driver map."""
+
+    def setUp(self):
+        """Start every test with an empty cache."""
+        reference_cache.invalidate()
+        self.platform = Platform.objects.create(name="cisco_xe", slug="cisco_xe", napalm_driver="ios")
+
+    def tearDown(self):
+        """Do not leak the Platforms of the test to other tests."""
+        reference_cache.invalidate()
+
+    def test_napalm_driver_map(self, mock_on_commit):
+        """Verify that Platforms override the static map and that the map is built only once."""
+        napalm_driver_map = get_napalm_driver_map()
+
+        self.assertEqual(napalm_driver_map["cisco_xe"], "ios")
+        self.assertEqual(napalm_driver_map["arista_eos"], "eos")
+
+        with self.assertNumQueries(0):
+            self.assertIs(get_napalm_driver_map(), napalm_driver_map)
+
+    def test_napalm_driver_map_invalidation(self, mock_on_commit):
+        """Verify that the map is built again when a Platform is changed or deleted."""
+        self.assertEqual(get_napalm_driver_map()["cisco_xe"], "ios")
+
+        self.platform.napalm_driver = "iosxr"
+        self.platform.save()
+        self.assertEqual(get_napalm_driver_map()["cisco_xe"], "iosxr")
+
+        self.platform.delete()
+        self.assertNotIn("cisco_xe", get_napalm_driver_map())
+
+
+@mock.patch("nautobot_device_onboarding.cache.transaction.on_commit", side_effect=lambda func: func())
+class ReferenceCacheTestCase(TestCase):
+    """Test the cache of reference objects."""
+
+    def setUp(self):
+        """Start every test with an empty cache."""
+        reference_cache.invalidate()
+        self.sites = [Site.objects.create(name=f"SITE{index}", slug=f"site{index}") for index in range(3)]
+
+    def tearDown(self):
+        """Do not leak the objects of the test to other tests."""
+        reference_cache.invalidate()
+
+    def test_cached_get(self, mock_on_commit):
+        """Verify that an object is looked up once, and again after it is changed."""
+        self.assertEqual(cached_get(Site, slug="site0"), self.sites[0])
+
+        with self.assertNumQueries(0):
+            self.assertEqual(cached_get(Site, slug="site0"), self.sites[0])
+
+        self.sites[0].description = "updated"
+        self.sites[0].save()
+
+        with self.assertNumQueries(1):
+            self.assertEqual(cached_get(Site, slug="site0").description, "updated")
+
+    def test_cached_get_does_not_exist(self, mock_on_commit):
+        """Verify that missing objects are not cached."""
+        with self.assertRaises(Site.DoesNotExist):
+            cached_get(Site, slug="site9")
+
+        site = Site.objects.create(name="SITE9", slug="site9")
+        self.assertEqual(cached_get(Site, slug="site9"), site)
+
+    @mock.patch.dict(PLUGIN_SETTINGS, {"reference_cache_size": 2})
+    def test_cache_size(self, mock_on_commit):
+        """Verify that the least recently used objects are dropped first."""
+        for site in self.sites:
+            cached_get(Site, slug=site.slug)
+
+        with self.assertNumQueries(0):
+            cached_get(Site, slug="site2")
+            cached_get(Site, slug="site1")
+
+        with self.assertNumQueries(1):
+            cached_get(Site, slug="site0")
@@ -0,0 +1,72 @@
+"""Unit tests for nautobot_device_onboarding.forms module.
+
+(c) 2020-2021 Network To Code
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+  http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from unittest import mock
+
+from django.core.exceptions import ValidationError
+from django.test import TestCase
+from nautobot.dcim.models import Platform, Site
+
+from nautobot_device_onboarding.forms import OnboardingTaskFeedCSVImportForm, import_onboarding_tasks
+from nautobot_device_onboarding.models import OnboardingTask
+
+
+class ImportOnboardingTasksTestCase(TestCase):
+    """Test the bulk import of OnboardingTasks from CSV."""
+
+    def setUp(self):
+        """Prepare test objects."""
+        self.site = Site.objects.create(name="USWEST", slug="uswest")
+        self.platform = Platform.objects.create(name="cisco_ios", slug="cisco_ios")
+
+    # TestCase never commits, run the on_commit callbacks right away as if it did
+    @mock.patch("nautobot_device_onboarding.forms.transaction.on_commit", side_effect=lambda func: func())
+    @mock.patch("nautobot_device_onboarding.forms.enqueue_onboarding_batches")
+    def test_import_onboarding_tasks(self, mock_enqueue, mock_on_commit):
+        """Verify that tasks are inserted by chunks and enqueued together, batched per chunk and credentials."""
+        rows = ["site,ip_address,platform,port,username"]
+        rows += [f"uswest,10.40.0.{index},cisco_ios,2222,user{index % 2}" for index in range(1, 6)]
+
+        onboarding_tasks = import_onboarding_tasks("\n".join(rows), OnboardingTask.objects.all(), chunk_size=2)
+
+        self.assertEqual(len(onboarding_tasks), 5)
+        self.assertEqual(OnboardingTask.objects.filter(site=self.site, platform=self.platform, port=2222).count(), 5)
+        self.assertEqual(
+            [ot.label for ot in OnboardingTask.objects.order_by("label")], [ot.label for ot in onboarding_tasks]
+        )
+
+        # 3 chunks of 2, 2 and 1 rows, the first 2 chunks mixing 2 different usernames, enqueued at once
+        mock_enqueue.assert_called_once()
+        batches = mock_enqueue.call_args[0][0]
+        self.assertEqual(len(batches), 5)
+        enqueued_task_ids = [task_id for task_ids, _ in batches for task_id in task_ids]
+        self.assertEqual(sorted(enqueued_task_ids), sorted(ot.pk for ot in onboarding_tasks))
+
+    @mock.patch("nautobot_device_onboarding.forms.enqueue_onboarding_batches")
+    def test_import_onboarding_tasks_invalid(self, mock_enqueue):
+        """Verify that all the invalid rows are reported."""
+        csv_data = "site,ip_address,port\nuswest,10.40.0.1,22\nunknown,10.40.0.2,22\nuswest,10.40.0.3,abc\nuswest"
+
+        with self.assertRaises(ValidationError) as exc_info:
+            import_onboarding_tasks(csv_data, OnboardingTask.objects.all())
+
+        self.assertEqual(len(exc_info.exception.messages), 3)
+        self.assertEqual(exc_info.exception.messages[0], "Row 2 site: Site not found")
+        mock_enqueue.assert_not_called()
+
+    def test_import_form_headers(self):
+        """Verify that the CSV column headers are validated."""
+        self.assertTrue(OnboardingTaskFeedCSVImportForm({"csv": "site,ip_address\nuswest,10.40.0.1"}).is_valid())
+        self.assertFalse(OnboardingTaskFeedCSVImportForm({"csv": "ip_address\n10.40.0.1"}).is_valid())
+        self.assertFalse(OnboardingTaskFeedCSVImportForm({"csv": "site,ip_address,foo\nuswest,10.40.0.1,"}).is_valid())
@@ -11,14 +11,20 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
 from django.test import TestCase
+from django.utils import timezone
 
 from nautobot.dcim.models import Site, DeviceRole, DeviceType, Manufacturer, Device, Interface
 from nautobot.ipam.models import IPAddress
 
-from nautobot_device_onboarding.models import OnboardingTask
+from nautobot_device_onboarding.models import OnboardingTask, OnboardingTaskLabelCounter
 from nautobot_device_onboarding.models import OnboardingDevice
 from nautobot_device_onboarding.choices import OnboardingStatusChoices
+from nautobot_device_onboarding.filters import OnboardingTaskFilter
 
 
 class OnboardingDeviceModelTestCase(TestCase):
@@ -103,3 +109,104 @@ class OnboardingDeviceModelTestCase(TestCase):
         """Verify created tasks are with labels following creation order."""
         for index, task_object in enumerate(OnboardingTask.objects.order_by("created"), start=1):
             self.assertEqual(index, task_object.label)
+
+    def test_reserve_labels(self):
+        """Verify labels are reserved in consecutive blocks following the existing tasks."""
+        last_label = OnboardingTask.objects.count()
+
+        self.assertEqual(list(OnboardingTask.reserve_labels(3)), [last_label + 1, last_label + 2, last_label + 3])
+        self.assertEqual(list(OnboardingTask.reserve_labels(1)), [last_label + 4])
+
+        ot = OnboardingTask.objects.create(ip_address="10.10.10.20", site=self.site)
+        self.assertEqual(ot.label, last_label + 5)
+
+    def test_reserve_labels_missing_counter(self):
+        """Verify the label counter is recreated from the existing tasks."""
+        OnboardingTaskLabelCounter.objects.all().delete()
+        last_label = OnboardingTask.objects.count()
+
+        self.assertEqual(list(OnboardingTask.reserve_labels(2)), [last_label + 1, last_label + 2])
+
+    def test_recorded_onboarding_task(self):
+        """Verify the recorded latest onboarding task is used without querying the tasks."""
+        onboarding_device = OnboardingDevice.objects.get(device=self.device)
+        onboarding_device.save(update_fields=onboarding_device.record_onboarding_task(self.succeeded_task1))
+
+        onboarding_device = OnboardingDevice.objects.select_related("last_task").get(device=self.device)
+        with self.assertNumQueries(0):
+            self.assertEqual(onboarding_device.status, OnboardingStatusChoices.STATUS_SUCCEEDED)
+            self.assertEqual(onboarding_device.last_ot, self.succeeded_task1)
+            self.assertEqual(onboarding_device.last_check_attempt_date, self.succeeded_task1.created)
+            self.assertEqual(onboarding_device.last_check_successful_date, self.succeeded_task1.created)
+
+    def test_backfill_onboarding_devices(self):
+        """Verify the backfill command records the latest onboarding task of existing devices."""
+        call_command("backfill_onboarding_devices", stdout=StringIO())
+
+        onboarding_device = OnboardingDevice.objects.get(device=self.device)
+        self.assertEqual(onboarding_device.last_task, self.failed_task2)
+        self.assertEqual(onboarding_device.last_status, OnboardingStatusChoices.STATUS_FAILED)
+        self.assertEqual(onboarding_device.last_attempt_date, self.failed_task2.created)
+        self.assertEqual(onboarding_device.last_success_date, self.succeeded_task2.created)
+
+    def test_primary_ip6(self):
+        """Verify the onboarding tasks of a device are matched by its IPv6 primary address too."""
+        primary_ip6 = IPAddress.objects.create(address="2001:db8::10/128")
+        self.device.interfaces.get(name="test_intf").ip_addresses.add(primary_ip6)
+        self.device.primary_ip6 = primary_ip6
+        self.device.save()
+        ipv6_task = OnboardingTask.objects.create(
+            ip_address="2001:db8::10", site=self.site, status=OnboardingStatusChoices.STATUS_SUCCEEDED
+        )
+
+        onboarding_device = OnboardingDevice.objects.get(device=self.device)
+        self.assertEqual(onboarding_device.last_ot, ipv6_task)
+
+        call_command("backfill_onboarding_devices", stdout=StringIO())
+
+        onboarding_device = OnboardingDevice.objects.get(device=self.device)
+        self.assertEqual(onboarding_device.last_task, ipv6_task)
+        self.assertEqual(onboarding_device.last_status, OnboardingStatusChoices.STATUS_SUCCEEDED)
+        self.assertEqual(onboarding_device.last_success_date, ipv6_task.created)
+
+
+class OnboardingTaskTimingTestCase(TestCase):
+    """Test the timing recorded on the Onboarding Tasks."""
+
+    def setUp(self):
+        """Create tasks waiting and running for different durations."""
+        site = Site.objects.create(name="USWEST", slug="uswest")
+        now = timezone.now()
+
+        self.fast_task = OnboardingTask.objects.create(
+            ip_address="10.10.10.10",
+            site=site,
+            enqueued=now - timedelta(seconds=12),
+            started=now - timedelta(seconds=10),
+            finished=now - timedelta(seconds=5),
+        )
+        self.slow_task = OnboardingTask.objects.create(
+            ip_address="10.10.10.11",
+            site=site,
+            enqueued=now - timedelta(seconds=600),
+            started=now - timedelta(seconds=100),
+            finished=now,
+        )
+        self.pending_task = OnboardingTask.objects.create(ip_address="10.10.10.12", site=site, enqueued=now)
+
+    def test_queue_wait_and_duration(self):
+        """Verify the queue wait and duration of the tasks."""
+        self.assertEqual(self.fast_task.queue_wait, timedelta(seconds=2))
+        self.assertEqual(self.fast_task.duration, timedelta(seconds=5))
+        self.assertIsNone(self.pending_task.queue_wait)
+        self.assertIsNone(self.pending_task.duration)
+
+    def test_timing_filters(self):
+        """Verify the tasks are filtered on their duration and queue wait."""
+        queryset = OnboardingTask.objects.all()
+
+        self.assertEqual(list(OnboardingTaskFilter({"min_duration": 60}, queryset).qs), [self.slow_task])
+        self.assertEqual(list(OnboardingTaskFilter({"min_queue_wait": 60}, queryset).qs), [self.slow_task])
+        self.assertEqual(
+            list(OnboardingTaskFilter({"finished_before": self.slow_task.finished}, queryset).qs), [self.fast_task]
+        )
@@ -11,10 +11,13 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
+from unittest import mock
+
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
 from django.test import TestCase
 from django.utils.text import slugify
+from prometheus_client import REGISTRY
 from nautobot.dcim.choices import InterfaceTypeChoices
 from nautobot.dcim.models import Site, Manufacturer, DeviceType, DeviceRole, Device, Interface, Platform
 from nautobot.ipam.models import IPAddress
@@ -22,7 +25,8 @@ from nautobot.extras.choices import CustomFieldTypeChoices
 from nautobot.extras.models import CustomField, Status
 
 from nautobot_device_onboarding.exceptions import OnboardException
-from nautobot_device_onboarding.nautobot_keeper import NautobotKeeper
+from nautobot_device_onboarding.metrics import count_queries, observe_phase
+from nautobot_device_onboarding.nautobot_keeper import NautobotKeeper, save_validated
 
 PLUGIN_SETTINGS = settings.PLUGINS_CONFIG["nautobot_device_onboarding"]
 
@@ -561,3 +565,231 @@ class NautobotKeeperTestCase(TestCase):
         self.assertEqual(device.device_type.manufacturer.cf["cf_manufacturer"], "Foobar!")
         self.assertEqual(device.interfaces.get(name="Management0").cf["cf_interface"], "2016-06-23")
         self.assertEqual(device.primary_ip.cf["cf_ipaddress"], "http://example.com/")
+
+    def test_ensure_custom_fields_single_save(self):
+        """Verify new objects are saved once, with their default custom fields."""
+        onboarding_kwargs = {
+            "netdev_hostname": "sw1",
+            "netdev_nb_role_slug": "switch",
+            "netdev_vendor": "Cisco",
+            "netdev_model": "c2960",
+            "netdev_nb_site_slug": self.site1.slug,
+        }
+
+        nbk = NautobotKeeper(**onboarding_kwargs)
+
+        with mock.patch.object(Manufacturer, "save", autospec=True, side_effect=Manufacturer.save) as mock_save:
+            nbk.ensure_device_manufacturer(create_manufacturer=True)
+
+        self.assertEqual(mock_save.call_count, 1)
+        self.assertEqual(Manufacturer.objects.get(slug="cisco").cf["cf_manufacturer"], "Foobar!")
+
+    def test_ensure_device_unchanged(self):
+        """Verify an up to date device is not saved again."""
+        onboarding_kwargs = {
+            "netdev_hostname": "sw1",
+            "netdev_nb_role_slug": "switch",
+            "netdev_vendor": "Cisco",
+            "netdev_model": "c2960",
+            "netdev_nb_site_slug": self.site1.slug,
+            "netdev_netmiko_device_type": "cisco_ios",
+            "netdev_serial_number": "123456",
+            "netdev_mgmt_ip_address": "192.0.2.15",
+            "netdev_mgmt_ifname": "Management0",
+            "netdev_mgmt_pflen": 24,
+            "netdev_nb_role_color": "ff0000",
+        }
+
+        NautobotKeeper(**onboarding_kwargs).ensure_device()
+
+        nbk = NautobotKeeper(**onboarding_kwargs)
+        with mock.patch.object(Device, "save", autospec=True, side_effect=Device.save) as mock_save:
+            nbk.ensure_device()
+
+        mock_save.assert_not_called()
+        self.assertEqual(str(nbk.device.primary_ip4), "192.0.2.15/24")
+
+    def test_ensure_device_rollback(self):
+        """Verify nothing is left behind when onboarding fails."""
+        onboarding_kwargs = {
+            "netdev_hostname": "sw1",
+            "netdev_nb_role_slug": "switch",
+            "netdev_vendor": "Cisco",
+            "netdev_model": "c2960",
+            "netdev_nb_site_slug": self.site1.slug,
+            "netdev_netmiko_device_type": "cisco_ios",
+            "netdev_mgmt_ip_address": "192.0.2.15",
+            "netdev_mgmt_ifname": "Management0",
+            "netdev_mgmt_pflen": 24,
+            "netdev_nb_role_color": "ff0000",
+        }
+
+        nbk = NautobotKeeper(**onboarding_kwargs)
+        with mock.patch.object(
+            NautobotKeeper, "ensure_primary_ip", side_effect=OnboardException(reason="fail-general", message="ERROR")
+        ):
+            with self.assertRaises(OnboardException):
+                nbk.ensure_device()
+
+        self.assertFalse(Device.objects.filter(name="sw1").exists())
+        self.assertFalse(Manufacturer.objects.filter(slug="cisco").exists())
+
+    def test_ensure_device_phases(self):
+        """Verify that the duration of each step is observed, labelled with the outcome of the step."""
+        onboarding_kwargs = {
+            "netdev_hostname": "sw2",
+            "netdev_nb_role_slug": "switch",
+            "netdev_vendor": "Cisco",
+            "netdev_model": "c2960",
+            "netdev_nb_site_slug": self.site1.slug,
+            "netdev_netmiko_device_type": "cisco_ios",
+            "netdev_napalm_driver": "ios",
+            "netdev_mgmt_ip_address": "192.0.2.16",
+            "netdev_mgmt_ifname": "Management0",
+            "netdev_mgmt_pflen": 24,
+            "netdev_nb_role_color": "ff0000",
+        }
+        labels = {"napalm_driver": "ios", "site": self.site1.slug}
+
+        def phase_count(phase, failed_reason=""):
+            return (
+                REGISTRY.get_sample_value(
+                    "onboarding_phase_duration_seconds_count",
+                    {"phase": phase, "failed_reason": failed_reason, **labels},
+                )
+                or 0
+            )
+
+        device_type_count = phase_count("ensure_device_type")
+        primary_ip_failed_count = phase_count("ensure_primary_ip", "fail-general")
+
+        nbk = NautobotKeeper(**onboarding_kwargs)
+        with mock.patch.object(
+            NautobotKeeper, "ensure_primary_ip", side_effect=OnboardException(reason="fail-general", message="ERROR")
+        ):
+            with self.assertRaises(OnboardException):
+                nbk.ensure_device()
+
+        self.assertEqual(phase_count("ensure_device_type"), device_type_count + 1)
+        self.assertEqual(phase_count("ensure_primary_ip", "fail-general"), primary_ip_failed_count + 1)
+
+
+# Number of queries of each phase of NautobotKeeper.ensure_device, besides those of Nautobot validating and saving
+# objects, for a new device and for the re-onboarding of an existing device, once the manufacturer, device type, role
+# and platform exist. The reference cache is not populated within a TestCase, every lookup is a query.
+ENSURE_DEVICE_QUERIES = {
+    "ensure_onboarded_device": (1, 1),
+    "ensure_device_site": (1, 1),
+    "ensure_device_manufacturer": (1, 1),
+    "ensure_device_type": (1, 1),
+    "ensure_device_role": (1, 1),
+    "ensure_device_platform": (1, 1),
+    "ensure_device_instance": (3, 2),
+    "ensure_interface": (2, 2),
+    "ensure_primary_ip": (3, 3),
+    "save_device": (0, 0),
+}
+
+# Models of the objects saved by each phase of NautobotKeeper.ensure_device for a new device,
+# nothing is saved when re-onboarding an unchanged device
+ENSURE_DEVICE_SAVES = {
+    "ensure_device_instance": ["device"],
+    "ensure_interface": ["interface"],
+    "ensure_primary_ip": ["ipaddress"],
+    "save_device": ["device"],
+}
+
+
+class NautobotKeeperQueriesTestCase(TestCase):
+    """Test the number of database queries of NautobotKeeper.ensure_device."""
+
+    def setUp(self):
+        """Onboard a first device, creating the objects shared by all the devices."""
+        self.site = Site.objects.create(name="USWEST", slug="uswest")
+
+        for model in (Device, Interface, IPAddress):
+            custom_field = CustomField.objects.create(
+                type=CustomFieldTypeChoices.TYPE_TEXT, name=f"cf_{model._meta.model_name}", default="Foobar!"
+            )
+            custom_field.content_types.set([ContentType.objects.get_for_model(model)])
+
+        self.ensure_device("192.0.2.1")
+
+    def ensure_device(self, ip_address):
+        """Onboard the device at ip_address.
+
+        The queries of Nautobot validating and saving objects depend on the Nautobot version, they are
+        counted apart from those of the phases.
+
+        Returns:
+          (dict, dict): number of queries of each phase besides saving objects, and models of the objects saved
+        """
+        onboarding_kwargs = {
+            "netdev_hostname": "sw-" + ip_address.replace(".", "-"),
+            "netdev_nb_role_slug": "switch",
+            "netdev_vendor": "Cisco",
+            "netdev_model": "c2960",
+            "netdev_serial_number": "SN" + ip_address.replace(".", ""),
+            "netdev_nb_site_slug": self.site.slug,
+            "netdev_netmiko_device_type": "cisco_ios",
+            "netdev_mgmt_ip_address": ip_address,
+            "netdev_mgmt_ifname": "Management0",
+            "netdev_mgmt_pflen": 24,
+            "netdev_nb_role_color": "ff0000",
+        }
+
+        def phase_queries():
+            return {
+                phase: REGISTRY.get_sample_value("onboarding_phase_queries_sum", {"phase": phase}) or 0
+                for phase in ENSURE_DEVICE_QUERIES
+            }
+
+        phases, saves = [], {}
+        save_queries = dict.fromkeys(ENSURE_DEVICE_QUERIES, 0)
+
+        def observe(phase, **kwargs):
+            phases.append(phase)
+            return observe_phase(phase, **kwargs)
+
+        def counted_save(obj):
+            with count_queries() as queries:
+                save_validated(obj)
+            saves.setdefault(phases[-1], []).append(obj._meta.model_name)
+            save_queries[phases[-1]] += queries.count
+
+        before = phase_queries()
+        with mock.patch("nautobot_device_onboarding.nautobot_keeper.observe_phase", side_effect=observe), mock.patch(
+            "nautobot_device_onboarding.nautobot_keeper.save_validated", side_effect=counted_save
+        ):
+            NautobotKeeper(**onboarding_kwargs).ensure_device()
+        after = phase_queries()
+
+        return {phase: after[phase] - before[phase] - save_queries[phase] for phase in ENSURE_DEVICE_QUERIES}, saves
+
+    def test_new_device_queries(self):
+        """Verify the number of queries of each phase to onboard a new device."""
+        queries, saves = self.ensure_device("192.0.2.2")
+
+        for phase, (count, _) in ENSURE_DEVICE_QUERIES.items():
+            self.assertEqual(queries[phase], count, f"{phase} queries")
+        self.assertEqual(saves, ENSURE_DEVICE_SAVES)
+
+    def test_existing_device_queries(self):
+        """Verify the number of queries of each phase to re-onboard an existing device."""
+        new_device_queries, _ = self.ensure_device("192.0.2.2")
+        queries, saves = self.ensure_device("192.0.2.2")
+
+        for phase, (_, count) in ENSURE_DEVICE_QUERIES.items():
+            self.assertEqual(queries[phase], count, f"{phase} queries")
+        self.assertEqual(saves, {})
+        self.assertLess(sum(queries.values()), sum(new_device_queries.values()))
+
+    def test_queries_do_not_grow(self):
+        """Verify that the number of queries of each phase does not grow with the number of devices in Nautobot."""
+        queries, _ = self.ensure_device("192.0.2.2")
+
+        for index in range(10, 30):
+            self.ensure_device(f"192.0.2.{index}")
+
+        for phase, count in self.ensure_device("192.0.2.3")[0].items():
+            self.assertEqual(count, queries[phase], f"{phase} queries grew")
@@ -12,15 +12,74 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
-from socket import gaierror
+import threading
+from socket import AF_INET, AF_INET6, IPPROTO_TCP, SOCK_STREAM, gaierror
 from unittest import mock
 
+from django.conf import settings
 from django.test import TestCase
+from napalm.base.exceptions import ConnectionException
 from nautobot.dcim.models import Site, DeviceRole, Platform
 
+from nautobot_device_onboarding.cache import (
+    get_cached_device_type,
+    invalidate_cached_device_type,
+    set_cached_device_type,
+)
 from nautobot_device_onboarding.exceptions import OnboardException
-from nautobot_device_onboarding.helpers import onboarding_task_fqdn_to_ip
+from nautobot_device_onboarding.helpers import onboarding_task_fqdn_to_ip, resolve_onboarding_tasks
+from nautobot_device_onboarding.metrics import napalm_sessions_open_gauge
 from nautobot_device_onboarding.models import OnboardingTask
+from nautobot_device_onboarding.netdev_keeper import NetdevKeeper, match_ssh_banner
+
+PLUGIN_SETTINGS = settings.PLUGINS_CONFIG["nautobot_device_onboarding"]
+
+
+class NetmikoConnectionMock:
+    """Netmiko connection mock class for tests."""
+
+    def __init__(self):
+        self.disconnected = False
+        self.enabled = False
+        self.global_cmd_verify = False
+
+    def disconnect(self):
+        self.disconnected = True
+
+    def enable(self):
+        self.enabled = True
+
+
+class SSHDetectMock:
+    """SSHDetect mock class for tests, disconnecting its session once done like SSHDetect does."""
+
+    def __init__(self, *args, **kwargs):
+        self.connection = NetmikoConnectionMock()
+
+    def autodetect(self):
+        self.connection.disconnect()
+        return "cisco_ios"
+
+
+class NapalmMockIos:
+    """Napalm mock class for tests, failing when opening a new session."""
+
+    def __init__(self, *args, **kwargs):
+        self.transport = "ssh"
+        self.device = None
+
+    def open(self):
+        raise Exception("A new session should not be opened")
+
+    def close(self):
+        if self.device:
+            self.device.disconnect()
+
+    def get_facts(self):
+        return {"hostname": "ios-device", "vendor": "Cisco", "model": "CSR1000V", "serial_number": "9KXI0D7TVFI"}
+
+    def get_interfaces_ip(self):
+        return {"GigabitEthernet1": {"ipv4": {"192.0.2.10": {"prefix_length": 24}}}}
 
 
 class NetdevKeeperTestCase(TestCase):
@@ -46,11 +105,12 @@ class NetdevKeeperTestCase(TestCase):
             ip_address="192.0.2.1/32", site=self.site1, role=self.device_role1, platform=self.platform1
         )
 
-    @mock.patch("nautobot_device_onboarding.helpers.socket.gethostbyname")
-    def test_check_ip(self, mock_get_hostbyname):
+    @mock.patch.dict(PLUGIN_SETTINGS, {"dns_cache_timeout": 0, "dns_negative_cache_timeout": 0})
+    @mock.patch("nautobot_device_onboarding.helpers.socket.getaddrinfo")
+    def test_check_ip(self, mock_getaddrinfo):
         """Check DNS to IP address."""
         # Look up response value
-        mock_get_hostbyname.return_value = "192.0.2.1"
+        mock_getaddrinfo.return_value = [(AF_INET, SOCK_STREAM, IPPROTO_TCP, "", ("192.0.2.1", 0))]
 
         # FQDN -> IP
         onboarding_task_fqdn_to_ip(ot=self.onboarding_task4)
@@ -58,11 +118,12 @@ class NetdevKeeperTestCase(TestCase):
         # Run the check to change the IP address
         self.assertEqual(self.onboarding_task4.ip_address, "192.0.2.1")
 
-    @mock.patch("nautobot_device_onboarding.helpers.socket.gethostbyname")
-    def test_failed_check_ip(self, mock_get_hostbyname):
+    @mock.patch.dict(PLUGIN_SETTINGS, {"dns_cache_timeout": 0, "dns_negative_cache_timeout": 0})
+    @mock.patch("nautobot_device_onboarding.helpers.socket.getaddrinfo")
+    def test_failed_check_ip(self, mock_getaddrinfo):
         """Check DNS to IP address failing."""
         # Look up a failed response
-        mock_get_hostbyname.side_effect = gaierror(8)
+        mock_getaddrinfo.side_effect = gaierror(8)
 
         # Check for bad.local raising an exception
         with self.assertRaises(OnboardException) as exc_info:
@@ -75,3 +136,209 @@ class NetdevKeeperTestCase(TestCase):
             onboarding_task_fqdn_to_ip(ot=self.onboarding_task7)
             self.assertEqual(exc_info.exception.reason, "fail-prefix")
             self.assertEqual(exc_info.exception.message, "ERROR appears a prefix was entered: 192.0.2.1/32")
+
+    @mock.patch.dict(PLUGIN_SETTINGS, {"dns_cache_timeout": 0, "dns_negative_cache_timeout": 0, "dns_timeout": 1})
+    @mock.patch("nautobot_device_onboarding.helpers.socket.getaddrinfo")
+    def test_resolve_onboarding_tasks(self, mock_getaddrinfo):
+        """Verify that FQDNs are resolved at once, IPv6 included, and that failing tasks are failed in bulk."""
+        hung_lookup = threading.Event()
+
+        def getaddrinfo(hostname, *args, **kwargs):
+            if hostname == "ntc123.local":
+                return [
+                    (AF_INET6, SOCK_STREAM, IPPROTO_TCP, "", ("2001:db8::1", 0, 0, 0)),
+                    (AF_INET, SOCK_STREAM, IPPROTO_TCP, "", ("192.0.2.1", 0)),
+                ]
+            if hostname == "v6.local":
+                return [(AF_INET6, SOCK_STREAM, IPPROTO_TCP, "", ("2001:db8::2", 0, 0, 0))]
+            if hostname == "hung.local":
+                hung_lookup.wait(5)
+            raise gaierror(8)
+
+        mock_getaddrinfo.side_effect = getaddrinfo
+        ot_v6 = OnboardingTask.objects.create(ip_address="v6.local", site=self.site1)
+        ot_hung = OnboardingTask.objects.create(ip_address="hung.local", site=self.site1)
+        ot_ip = OnboardingTask.objects.create(ip_address="192.0.2.3", site=self.site1)
+
+        try:
+            resolved, failed = resolve_onboarding_tasks(
+                [self.onboarding_task4, self.onboarding_task5, self.onboarding_task7, ot_v6, ot_hung, ot_ip]
+            )
+        finally:
+            hung_lookup.set()
+
+        self.assertEqual(resolved, [self.onboarding_task4, ot_v6, ot_ip])
+        self.assertEqual(failed, [self.onboarding_task7, self.onboarding_task5, ot_hung])
+
+        self.onboarding_task4.refresh_from_db()
+        self.assertEqual(self.onboarding_task4.ip_address, "192.0.2.1")
+        ot_v6.refresh_from_db()
+        self.assertEqual(ot_v6.ip_address, "2001:db8::2")
+
+        ot_hung.refresh_from_db()
+        self.assertEqual(ot_hung.status, "failed")
+        self.assertEqual(ot_hung.failed_reason, "fail-dns")
+        self.assertEqual(ot_hung.message, "ERROR failed to complete DNS lookup: hung.local")
+        self.onboarding_task7.refresh_from_db()
+        self.assertEqual(self.onboarding_task7.failed_reason, "fail-general")
+
+    @mock.patch("nautobot_device_onboarding.netdev_keeper.socket")
+    @mock.patch("nautobot_device_onboarding.netdev_keeper.redispatch")
+    @mock.patch("nautobot_device_onboarding.netdev_keeper.SSHDetect")
+    @mock.patch("nautobot_device_onboarding.netdev_keeper.get_network_driver")
+    def test_autodetect_connection_reused(self, mock_napalm, mock_ssh_detect, mock_redispatch, mock_socket):
+        """Verify that the autodetect SSH session is handed over to NAPALM."""
+        mock_socket.socket.return_value.__enter__.return_value.recv.return_value = b""
+        mock_napalm.return_value = NapalmMockIos
+        guesser = SSHDetectMock()
+        mock_ssh_detect.return_value = guesser
+        invalidate_cached_device_type("192.0.2.10", 22)
+
+        netdev = NetdevKeeper(hostname="192.0.2.10", port=22, timeout=30, username="user", password="pass")
+        netdev.load_driver_extension = False
+        netdev.get_onboarding_facts()
+
+        self.assertEqual(netdev.napalm_driver, "ios")
+        self.assertEqual(netdev.facts["hostname"], "ios-device")
+        mock_redispatch.assert_called_once_with(guesser.connection, device_type="cisco_ios")
+        self.assertTrue(guesser.connection.enabled)
+        self.assertIsNone(guesser.connection.global_cmd_verify)
+        # Closed by NAPALM once the device information is collected
+        self.assertTrue(guesser.connection.disconnected)
+        self.assertIsNone(netdev.netmiko_connection)
+        self.assertEqual(get_cached_device_type("192.0.2.10", 22), "cisco_ios")
+
+    @mock.patch.dict(PLUGIN_SETTINGS, {"reuse_autodetect_connection": True})
+    @mock.patch("nautobot_device_onboarding.netdev_keeper.SSHDetect")
+    def test_autodetect_connection_closed_on_error(self, mock_ssh_detect):
+        """Verify that the autodetect SSH session is closed when the autodetection raises."""
+        guesser = SSHDetectMock()
+        guesser.autodetect = mock.Mock(side_effect=Exception("Pattern not detected"))
+        mock_ssh_detect.return_value = guesser
+
+        netdev = NetdevKeeper(hostname="192.0.2.13", port=22, timeout=30, username="user", password="pass")
+
+        with self.assertRaises(OnboardException) as exc_info:
+            netdev.guess_netmiko_device_type()
+
+        self.assertEqual(exc_info.exception.reason, "fail-general")
+        self.assertTrue(guesser.connection.disconnected)
+        self.assertNotIn("disconnect", vars(guesser.connection))
+        self.assertIsNone(netdev.netmiko_connection)
+
+    @mock.patch("nautobot_device_onboarding.netdev_keeper.socket")
+    @mock.patch("nautobot_device_onboarding.netdev_keeper.SSHDetect")
+    @mock.patch("nautobot_device_onboarding.netdev_keeper.get_network_driver")
+    def test_cached_device_type(self, mock_napalm, mock_ssh_detect, mock_socket):
+        """Verify that a cached device type skips autodetection and is forgotten when onboarding fails."""
+        mock_socket.socket.return_value.__enter__.return_value.recv.return_value = b""
+        mock_napalm.return_value = NapalmMockIos
+        set_cached_device_type("192.0.2.11", 22, "cisco_ios")
+
+        netdev = NetdevKeeper(hostname="192.0.2.11", port=22, timeout=30, username="user", password="pass")
+
+        with self.assertRaises(OnboardException):
+            netdev.get_onboarding_facts()
+
+        mock_ssh_detect.assert_not_called()
+        self.assertEqual(netdev.napalm_driver, "ios")
+        self.assertIsNone(get_cached_device_type("192.0.2.11", 22))
+
+    @mock.patch("nautobot_device_onboarding.netdev_keeper.socket")
+    @mock.patch("nautobot_device_onboarding.netdev_keeper.get_network_driver")
+    def test_napalm_session_closed(self, mock_napalm, mock_socket):
+        """Verify that the NAPALM session is closed when collecting the device information fails."""
+        napalm_device = mock.Mock(hostname="192.0.2.12")
+        napalm_device.get_facts.side_effect = Exception("Command failed")
+        mock_napalm.return_value.return_value = napalm_device
+        sessions_open = napalm_sessions_open_gauge._value.get()  # pylint: disable=protected-access
+
+        netdev = NetdevKeeper(
+            hostname="192.0.2.12", port=22, timeout=30, username="user", password="pass", napalm_driver="eos"
+        )
+
+        with self.assertRaises(OnboardException):
+            netdev.get_onboarding_facts()
+
+        napalm_device.open.assert_called_once()
+        napalm_device.close.assert_called_once()
+        self.assertEqual(napalm_sessions_open_gauge._value.get(), sessions_open)  # pylint: disable=protected-access
+
+    @mock.patch("nautobot_device_onboarding.netdev_keeper.socket")
+    @mock.patch("nautobot_device_onboarding.netdev_keeper.SSHDetect")
+    @mock.patch("nautobot_device_onboarding.netdev_keeper.get_network_driver")
+    def test_ssh_banner_fingerprint(self, mock_napalm, mock_ssh_detect, mock_socket):
+        """Verify that a device identified by its SSH banner is not auto-detected."""
+        mock_socket.socket.return_value.__enter__.return_value.recv.side_effect = [
+            b"Authorized access only\r\nSSH-2.0-Cis",
+            b"co-1.25\r\n",
+        ]
+        mock_napalm.return_value.return_value = mock.Mock(hostname="192.0.2.13")
+        invalidate_cached_device_type("192.0.2.13", 22, "SSH-2.0-Cisco-1.25")
+
+        netdev = NetdevKeeper(hostname="192.0.2.13", port=22, timeout=30, username="user", password="pass")
+        netdev.load_driver_extension = False
+        netdev.get_onboarding_facts()
+
+        mock_ssh_detect.assert_not_called()
+        self.assertEqual(netdev.ssh_banner, "SSH-2.0-Cisco-1.25")
+        self.assertEqual(netdev.netmiko_device_type, "cisco_ios")
+        self.assertEqual(netdev.napalm_driver, "ios")
+        self.assertEqual(get_cached_device_type("192.0.2.13", 22, "SSH-2.0-Cisco-1.25"), "cisco_ios")
+
+    @mock.patch.dict(PLUGIN_SETTINGS, {"reuse_autodetect_connection": False})
+    @mock.patch("nautobot_device_onboarding.netdev_keeper.socket")
+    @mock.patch("nautobot_device_onboarding.netdev_keeper.SSHDetect")
+    @mock.patch("nautobot_device_onboarding.netdev_keeper.get_network_driver")
+    def test_ssh_banner_fingerprint_fallback(self, mock_napalm, mock_ssh_detect, mock_socket):
+        """Verify that a device is auto-detected when onboarding it as identified by its SSH banner fails."""
+        mock_socket.socket.return_value.__enter__.return_value.recv.return_value = b"SSH-2.0-Cisco-1.25\r\n"
+        ios_device = mock.Mock(hostname="192.0.2.14")
+        ios_device.get_facts.side_effect = Exception("Invalid input detected")
+        nxos_device = mock.Mock(hostname="192.0.2.14")
+        mock_napalm.side_effect = lambda driver: mock.Mock(
+            return_value={"ios": ios_device, "nxos_ssh": nxos_device}[driver]
+        )
+        mock_ssh_detect.return_value.autodetect.return_value = "cisco_nxos"
+        invalidate_cached_device_type("192.0.2.14", 22, "SSH-2.0-Cisco-1.25")
+
+        netdev = NetdevKeeper(hostname="192.0.2.14", port=22, timeout=30, username="user", password="pass")
+        netdev.load_driver_extension = False
+        netdev.get_onboarding_facts()
+
+        mock_ssh_detect.return_value.autodetect.assert_called_once()
+        self.assertEqual(netdev.netmiko_device_type, "cisco_nxos")
+        self.assertEqual(netdev.napalm_driver, "nxos_ssh")
+        self.assertEqual(netdev.facts, nxos_device.get_facts.return_value)
+        ios_device.close.assert_called_once()
+        self.assertEqual(get_cached_device_type("192.0.2.14", 22, "SSH-2.0-Cisco-1.25"), "cisco_nxos")
+
+    @mock.patch("nautobot_device_onboarding.netdev_keeper.socket")
+    @mock.patch("nautobot_device_onboarding.netdev_keeper.SSHDetect")
+    @mock.patch("nautobot_device_onboarding.netdev_keeper.get_network_driver")
+    def test_ssh_banner_fingerprint_no_fallback_on_login_failure(self, mock_napalm, mock_ssh_detect, mock_socket):
+        """Verify that a device identified by its SSH banner is not auto-detected when the login fails."""
+        mock_socket.socket.return_value.__enter__.return_value.recv.return_value = b"SSH-2.0-Cisco-1.25\r\n"
+        ios_device = mock.Mock(hostname="192.0.2.15")
+        ios_device.open.side_effect = ConnectionException("Authentication failed")
+        mock_napalm.return_value.return_value = ios_device
+        invalidate_cached_device_type("192.0.2.15", 22, "SSH-2.0-Cisco-1.25")
+
+        netdev = NetdevKeeper(hostname="192.0.2.15", port=22, timeout=30, username="user", password="pass")
+        netdev.load_driver_extension = False
+
+        with self.assertRaises(OnboardException) as exc_info:
+            netdev.get_onboarding_facts()
+
+        self.assertEqual(exc_info.exception.reason, "fail-login")
+        mock_ssh_detect.assert_not_called()
+
+    def test_match_ssh_banner(self):
+        """Verify that SSH banners are only matched to a device type when not ambiguous."""
+        self.assertEqual(match_ssh_banner("SSH-2.0-Cisco-1.25"), "cisco_ios")
+        self.assertEqual(match_ssh_banner("SSH-2.0-OpenSSH_7.5 PKIX[10.1]"), "juniper_junos")
+        self.assertIsNone(match_ssh_banner("SSH-2.0-OpenSSH_7.6"))
+        self.assertIsNone(match_ssh_banner(None))
+        self.assertIsNone(
+            match_ssh_banner("SSH-2.0-Cisco-1.25", {r"^SSH-2.0-Cisco-": "cisco_ios", r"-1\.25$": "cisco_asa"})
+        )
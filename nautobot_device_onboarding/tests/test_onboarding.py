@@ -18,6 +18,7 @@ from django.conf import settings
 from django.test import TestCase
 from nautobot.dcim.models import Site, Platform
 
+from nautobot_device_onboarding.cache import invalidate_cached_device_type
 from nautobot_device_onboarding.models import OnboardingTask
 from nautobot_device_onboarding.onboard import OnboardingManager
 
@@ -33,6 +34,9 @@ class NapalmMock:
     def open(self):
         pass
 
+    def close(self):
+        pass
+
 
 class NapalmMockNxos(NapalmMock):
     """Mock napalm for nxos tests."""
@@ -96,9 +100,13 @@ class OnboardingTestCase(TestCase):
             ip_address="2.2.2.2", site=self.site, platform=self.eos_platform, port=443
         )
 
+        # Make sure the device type is detected again for every test
+        invalidate_cached_device_type(self.onboarding_task1.ip_address, self.onboarding_task1.port)
+
         # Patch socket as it would be able to verify connectivity
         self.patcher = mock.patch("nautobot_device_onboarding.netdev_keeper.socket")
-        self.patcher.start()
+        mock_socket = self.patcher.start()
+        mock_socket.socket.return_value.__enter__.return_value.recv.return_value = b""
 
     def tearDown(self):
         """Disable patch on socket."""
@@ -0,0 +1,69 @@
+"""Unit tests for nautobot_device_onboarding.reachability module.
+
+(c) 2020-2021 Network To Code
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+  http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import socket
+
+from django.test import TestCase
+from nautobot.dcim.models import Site
+
+from nautobot_device_onboarding.choices import OnboardingFailChoices, OnboardingStatusChoices
+from nautobot_device_onboarding.models import OnboardingTask
+from nautobot_device_onboarding.reachability import probe_reachability, sweep_onboarding_tasks
+
+
+class ReachabilityTestCase(TestCase):
+    """Test the concurrent reachability checks."""
+
+    def setUp(self):
+        """Open a listening socket and find a closed port on localhost."""
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(16)
+        self.open_port = self.listener.getsockname()[1]
+
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.bind(("127.0.0.1", 0))
+            self.closed_port = sock.getsockname()[1]
+
+        self.site = Site.objects.create(name="USWEST", slug="uswest")
+
+    def tearDown(self):
+        """Close the listening socket."""
+        self.listener.close()
+
+    def test_probe_reachability(self):
+        """Verify that open and closed ports are told apart."""
+        targets = [("127.0.0.1", self.open_port, 2), ("127.0.0.1", self.closed_port, 2)]
+
+        results = probe_reachability(targets, concurrency=1)
+
+        self.assertEqual(results, {targets[0]: True, targets[1]: False})
+
+    def test_sweep_onboarding_tasks(self):
+        """Verify that unreachable OnboardingTasks are failed in bulk."""
+        reachable_ot = OnboardingTask.objects.create(ip_address="127.0.0.1", port=self.open_port, site=self.site)
+        unreachable_ot = OnboardingTask.objects.create(ip_address="127.0.0.1", port=self.closed_port, site=self.site)
+
+        reachable, unreachable = sweep_onboarding_tasks([reachable_ot, unreachable_ot])
+
+        self.assertEqual(reachable, [reachable_ot])
+        self.assertEqual(unreachable, [unreachable_ot])
+
+        unreachable_ot.refresh_from_db()
+        self.assertEqual(unreachable_ot.status, OnboardingStatusChoices.STATUS_FAILED)
+        self.assertEqual(unreachable_ot.failed_reason, OnboardingFailChoices.FAIL_CONNECT)
+        self.assertEqual(unreachable_ot.message, f"ERROR device unreachable: 127.0.0.1:{self.closed_port}")
+
+        reachable_ot.refresh_from_db()
+        self.assertEqual(reachable_ot.status, "")
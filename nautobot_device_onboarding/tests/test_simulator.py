@@ -0,0 +1,73 @@
+"""Unit tests for nautobot_device_onboarding.simulator module.
+
+(c) 2020-2021 Network To Code
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+  http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import json
+import socket
+
+from django.test import TestCase
+
+from nautobot_device_onboarding.netdev_keeper import read_ssh_banner
+from nautobot_device_onboarding.simulator import INVALID_INPUT, DeviceSimulator, SimulatedDevice, simulated_devices
+
+
+class SimulatorTestCase(TestCase):
+    """Test the simulated SSH devices."""
+
+    def test_run_command(self):
+        """Verify the command outputs are rendered for the device."""
+        device = SimulatedDevice("127.0.1.1", 2222, device_type="cisco_ios", serial="SIM0000042", output_lines=3)
+
+        show_version = device.run_command("show  version")
+        self.assertIn("Cisco IOS Software", show_version)
+        self.assertIn("sim-127-0-1-1-2222 uptime is", show_version)
+        self.assertIn("Processor board ID SIM0000042", show_version)
+        self.assertIn("License feature 2: enabled", show_version)
+        self.assertIn("Internet address is 127.0.1.1/24", device.run_command("show ip interface"))
+        self.assertEqual(device.run_command("terminal length 0"), "")
+        self.assertEqual(device.run_command("show running-config"), INVALID_INPUT)
+        self.assertEqual(device.prompt, "sim-127-0-1-1-2222#")
+
+    def test_run_command_errors(self):
+        """Verify the simulated errors."""
+        device = SimulatedDevice("127.0.1.1", 2222, device_type="cisco_nxos", auth_failure_rate=1, command_error_rate=1)
+
+        self.assertFalse(device.authenticate())
+        self.assertEqual(device.run_command("show version"), INVALID_INPUT)
+
+    def test_eos_json_output(self):
+        """Verify the JSON outputs of the EOS devices."""
+        device = SimulatedDevice("127.0.1.1", 2222, device_type="arista_eos", prefix_length=16)
+
+        interfaces = json.loads(device.run_command("show ip interface | json"))["interfaces"]
+        self.assertEqual(
+            interfaces["Management1"]["interfaceAddress"]["primaryIp"], {"address": "127.0.1.1", "maskLen": 16}
+        )
+
+    def test_simulated_devices(self):
+        """Verify the devices are created on consecutive addresses, cycling over the device types."""
+        devices = simulated_devices(3, address="127.0.1.254", device_types=["cisco_ios", "arista_eos"])
+
+        self.assertEqual([device.address for device in devices], ["127.0.1.254", "127.0.1.255", "127.0.2.0"])
+        self.assertEqual([device.device_type for device in devices], ["cisco_ios", "arista_eos", "cisco_ios"])
+        self.assertEqual(len({device.variables["serial"] for device in devices}), 3)
+
+    def test_ssh_banner(self):
+        """Verify the devices are served with the SSH banner of their platform."""
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+
+        with DeviceSimulator([SimulatedDevice("127.0.0.1", port, device_type="cisco_ios")]):
+            with socket.create_connection(("127.0.0.1", port), timeout=5) as sock:
+                self.assertEqual(read_ssh_banner(sock), "SSH-2.0-Cisco-1.25")
@@ -0,0 +1,434 @@
+"""Unit tests for nautobot_device_onboarding.worker module.
+
+(c) 2020-2021 Network To Code
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+  http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import signal
+import uuid
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.test import TestCase
+from nautobot.dcim.models import Device, Site, Platform
+from nautobot.users.models import ObjectPermission
+from prometheus_client import REGISTRY
+
+from nautobot_device_onboarding.choices import OnboardingStatusChoices
+from nautobot_device_onboarding.metrics import count_queries
+from nautobot_device_onboarding.models import OnboardingDevice, OnboardingTask
+from nautobot_device_onboarding.nautobot_keeper import save_validated
+from nautobot_device_onboarding.utils.credentials import Credentials
+from nautobot_device_onboarding.worker import (
+    enqueue_onboarding_batches,
+    onboard_device,
+    onboard_devices,
+    onboard_prefix,
+    recycle_worker,
+    retire_work_horse_metrics,
+)
+
+PLUGIN_SETTINGS = settings.PLUGINS_CONFIG["nautobot_device_onboarding"]
+
+User = get_user_model()
+
+# Number of queries to onboard a new device once its site, manufacturer, device type, role and platform exist,
+# besides those of Nautobot validating and saving the objects of ONBOARD_DEVICE_SAVES
+ONBOARD_DEVICE_QUERIES = 22
+
+# Models of the objects saved to onboard a new device, the device is saved again with its primary IP address
+ONBOARD_DEVICE_SAVES = ["device", "interface", "ipaddress", "device"]
+
+
+class NapalmMockEos:
+    """Mock napalm for eos tests, facts are derived from the device hostname."""
+
+    def __init__(self, hostname, *args, **kwargs):
+        self.hostname = hostname
+
+    def open(self):
+        if self.hostname == "10.0.0.3":
+            raise Exception("Connection refused")
+
+    def close(self):
+        pass
+
+    def get_facts(self):
+        return {
+            "hostname": f"arista-{self.hostname.replace('.', '-')}",
+            "model": "vEOS",
+            "serial_number": "",
+            "vendor": "Arista",
+        }
+
+    def get_interfaces_ip(self):
+        return {"Management1": {"ipv4": {self.hostname: {"prefix_length": 24}}}}
+
+
+class OnboardDevicesTestCase(TestCase):
+    """Test the batch onboarding worker."""
+
+    def setUp(self):
+        """Prepare test objects."""
+        PLUGIN_SETTINGS["platform_map"] = {}  # Reset platform map to default
+        self.site = Site.objects.create(name="TEST_SITE", slug="test-site")
+        self.eos_platform = Platform.objects.create(name="arista_eos", slug="arista_eos", napalm_driver="eos")
+
+        self.onboarding_tasks = [
+            OnboardingTask.objects.create(ip_address=f"10.0.0.{index}", site=self.site, platform=self.eos_platform)
+            for index in range(1, 4)
+        ]
+
+        # Patch socket as it would be able to verify connectivity
+        self.patcher = mock.patch("nautobot_device_onboarding.netdev_keeper.socket")
+        self.mock_socket = self.patcher.start()
+
+    def tearDown(self):
+        """Disable patch on socket."""
+        self.patcher.stop()
+
+    @mock.patch("nautobot_device_onboarding.reachability.probe_reachability")
+    @mock.patch("nautobot_device_onboarding.netdev_keeper.get_network_driver")
+    def test_onboard_devices(self, mock_napalm, mock_probe):
+        """Verify that all the tasks of a batch are processed and their result recorded."""
+        mock_napalm.return_value = NapalmMockEos
+        mock_probe.side_effect = lambda targets: {target: True for target in targets}
+
+        result = onboard_devices([ot.id for ot in self.onboarding_tasks], Credentials("user", "pass"), max_workers=2)
+
+        self.assertFalse(result["ok"])
+        self.assertEqual(len(result["results"]), 3)
+
+        for ot in self.onboarding_tasks:
+            ot.refresh_from_db()
+
+        self.assertEqual(self.onboarding_tasks[0].status, OnboardingStatusChoices.STATUS_SUCCEEDED)
+        self.assertEqual(self.onboarding_tasks[0].created_device.name, "arista-10-0-0-1")
+        self.assertEqual(str(self.onboarding_tasks[0].created_device.primary_ip4), "10.0.0.1/24")
+        self.assertEqual(self.onboarding_tasks[0].created_device.onboardingdevice.last_task, self.onboarding_tasks[0])
+        self.assertEqual(
+            self.onboarding_tasks[0].created_device.onboardingdevice.last_status,
+            OnboardingStatusChoices.STATUS_SUCCEEDED,
+        )
+        self.assertEqual(self.onboarding_tasks[1].status, OnboardingStatusChoices.STATUS_SUCCEEDED)
+        self.assertEqual(self.onboarding_tasks[1].created_device.name, "arista-10-0-0-2")
+
+        self.assertEqual(self.onboarding_tasks[2].status, OnboardingStatusChoices.STATUS_FAILED)
+        self.assertEqual(self.onboarding_tasks[2].failed_reason, "fail-general")
+        self.assertIsNone(self.onboarding_tasks[2].created_device)
+
+        # Devices found reachable by the sweep are not probed again
+        mock_probe.assert_called_once()
+        self.mock_socket.socket.assert_not_called()
+
+        for ot in self.onboarding_tasks:
+            self.assertLessEqual(ot.started, ot.finished)
+            self.assertNotIn("reachability", ot.phase_durations)
+        self.assertIn("napalm_get_facts", self.onboarding_tasks[0].phase_durations)
+        self.assertIn("ensure_device_instance", self.onboarding_tasks[0].phase_durations)
+        self.assertNotIn("napalm_get_facts", self.onboarding_tasks[2].phase_durations)
+
+    def onboard_device_queries(self, ot, credentials):
+        """Onboard the device of an OnboardingTask.
+
+        Returns:
+          (int, list): number of queries besides those of Nautobot saving objects, and models of the objects saved
+        """
+        saves = []
+
+        def counted_save(obj):
+            with count_queries() as queries:
+                save_validated(obj)
+            saves.append((obj._meta.model_name, queries.count))
+
+        with mock.patch("nautobot_device_onboarding.nautobot_keeper.save_validated", side_effect=counted_save):
+            with count_queries() as queries:
+                self.assertTrue(onboard_device(ot.id, credentials)["ok"])
+
+        return queries.count - sum(count for _, count in saves), [model for model, _ in saves]
+
+    @mock.patch("nautobot_device_onboarding.netdev_keeper.get_network_driver")
+    def test_onboard_device_queries(self, mock_napalm):
+        """Verify the number of queries to onboard a device, whatever the number of devices."""
+        mock_napalm.return_value = NapalmMockEos
+        credentials = Credentials("user", "pass")
+        onboard_device(self.onboarding_tasks[0].id, credentials)
+
+        queries, saves = self.onboard_device_queries(self.onboarding_tasks[1], credentials)
+        self.assertEqual(queries, ONBOARD_DEVICE_QUERIES)
+        self.assertEqual(saves, ONBOARD_DEVICE_SAVES)
+
+        device = Device.objects.get(name="arista-10-0-0-1")
+        for index in range(10):
+            Device.objects.create(
+                name=f"other-{index}",
+                site=self.site,
+                device_type=device.device_type,
+                device_role=device.device_role,
+                status=device.status,
+            )
+            OnboardingTask.objects.create(ip_address=f"10.0.1.{index}", site=self.site)
+
+        ot = OnboardingTask.objects.create(ip_address="10.0.0.4", site=self.site, platform=self.eos_platform)
+        more_devices_queries, _ = self.onboard_device_queries(ot, credentials)
+        self.assertEqual(more_devices_queries, ONBOARD_DEVICE_QUERIES)
+
+    @mock.patch.dict(PLUGIN_SETTINGS, {"skip_unchanged_devices": True})
+    @mock.patch("nautobot_device_onboarding.netdev_keeper.get_network_driver")
+    def test_onboard_device_unchanged(self, mock_napalm):
+        """Verify that re-onboarding a device with unchanged facts writes nothing, unless the device was modified."""
+        mock_napalm.return_value = NapalmMockEos
+        credentials = Credentials("user", "pass")
+        onboard_device(self.onboarding_tasks[0].id, credentials)
+
+        device = Device.objects.get(name="arista-10-0-0-1")
+        self.assertTrue(device.onboardingdevice.facts_fingerprint)
+
+        ot = OnboardingTask.objects.create(ip_address="10.0.0.1", site=self.site, platform=self.eos_platform)
+        self.assertTrue(onboard_device(ot.id, credentials)["ok"])
+
+        ot.refresh_from_db()
+        self.assertEqual(ot.status, OnboardingStatusChoices.STATUS_SUCCEEDED)
+        self.assertEqual(ot.created_device, device)
+        self.assertIn("unchanged", ot.message)
+        self.assertIn("napalm_get_facts", ot.phase_durations)
+        self.assertNotIn("ensure_device_instance", ot.phase_durations)
+        self.assertEqual(Device.objects.get(pk=device.pk).last_updated, device.last_updated)
+
+        device.serial = "MODIFIED"
+        device.save()
+
+        ot = OnboardingTask.objects.create(ip_address="10.0.0.1", site=self.site, platform=self.eos_platform)
+        self.assertTrue(onboard_device(ot.id, credentials)["ok"])
+
+        ot.refresh_from_db()
+        self.assertEqual(ot.message, "")
+        self.assertIn("ensure_device_instance", ot.phase_durations)
+        self.assertEqual(Device.objects.get(pk=device.pk).serial, "")
+
+    @mock.patch("nautobot_device_onboarding.reachability.probe_reachability")
+    @mock.patch("nautobot_device_onboarding.netdev_keeper.get_network_driver")
+    def test_onboard_device_skipped(self, mock_napalm, mock_probe):
+        """Verify that tasks of devices with onboarding disabled are recorded as skipped, one by one or in batches."""
+        mock_napalm.return_value = NapalmMockEos
+        mock_probe.side_effect = lambda targets: {target: True for target in targets}
+        credentials = Credentials("user", "pass")
+        onboard_device(self.onboarding_tasks[0].id, credentials)
+
+        device = Device.objects.get(name="arista-10-0-0-1")
+        OnboardingDevice.objects.filter(device=device).update(enabled=False)
+        mock_napalm.reset_mock()
+
+        for onboard in (
+            lambda ot: onboard_device(ot.id, credentials),
+            lambda ot: onboard_devices([ot.id], credentials),
+        ):
+            skipped = REGISTRY.get_sample_value("onboardingtask_results_total", {"status": "skipped"}) or 0
+            ot = OnboardingTask.objects.create(ip_address="10.0.0.1", site=self.site, platform=self.eos_platform)
+
+            self.assertTrue(onboard(ot)["ok"])
+
+            ot.refresh_from_db()
+            self.assertEqual(ot.status, OnboardingStatusChoices.STATUS_SKIPPED)
+            self.assertEqual(ot.created_device, device)
+            self.assertIsNotNone(ot.finished)
+
+            onboarding_device = OnboardingDevice.objects.get(device=device)
+            self.assertEqual(onboarding_device.last_task, ot)
+            self.assertEqual(onboarding_device.last_status, OnboardingStatusChoices.STATUS_SKIPPED)
+            self.assertEqual(
+                REGISTRY.get_sample_value("onboardingtask_results_total", {"status": "skipped"}), skipped + 1
+            )
+
+        mock_napalm.assert_not_called()
+
+    @mock.patch("nautobot_device_onboarding.netdev_keeper.get_network_driver")
+    def test_onboard_device_unchanged_disabled(self, mock_napalm):
+        """Verify that every onboarding updates the device by default, skip_unchanged_devices being opt-in."""
+        mock_napalm.return_value = NapalmMockEos
+        credentials = Credentials("user", "pass")
+        onboard_device(self.onboarding_tasks[0].id, credentials)
+
+        ot = OnboardingTask.objects.create(ip_address="10.0.0.1", site=self.site, platform=self.eos_platform)
+        self.assertTrue(onboard_device(ot.id, credentials)["ok"])
+
+        ot.refresh_from_db()
+        self.assertEqual(ot.message, "")
+        self.assertIn("ensure_device_instance", ot.phase_durations)
+
+    @mock.patch("nautobot_device_onboarding.reachability.probe_reachability")
+    @mock.patch("nautobot_device_onboarding.netdev_keeper.get_network_driver")
+    def test_onboard_devices_unreachable(self, mock_napalm, mock_probe):
+        """Verify that unreachable devices are failed without being contacted."""
+        mock_napalm.return_value = NapalmMockEos
+        mock_probe.side_effect = lambda targets: {target: target[0] != "10.0.0.2" for target in targets}
+
+        result = onboard_devices([ot.id for ot in self.onboarding_tasks[:2]], Credentials("user", "pass"))
+
+        self.assertEqual(
+            result["results"], {str(self.onboarding_tasks[0].id): True, str(self.onboarding_tasks[1].id): False}
+        )
+        self.assertEqual(mock_napalm.call_count, 1)
+
+        self.onboarding_tasks[1].refresh_from_db()
+        self.assertEqual(self.onboarding_tasks[1].status, OnboardingStatusChoices.STATUS_FAILED)
+        self.assertEqual(self.onboarding_tasks[1].failed_reason, "fail-connect")
+        self.assertEqual(self.onboarding_tasks[1].message, "ERROR device unreachable: 10.0.0.2:22")
+
+    @mock.patch("nautobot_device_onboarding.reachability.probe_reachability")
+    @mock.patch("nautobot_device_onboarding.netdev_keeper.get_network_driver")
+    def test_onboard_devices_reachable(self, mock_napalm, mock_probe):
+        """Verify that devices already found reachable, e.g. by a prefix discovery, are not probed again."""
+        mock_napalm.return_value = NapalmMockEos
+
+        result = onboard_devices(
+            [ot.id for ot in self.onboarding_tasks[:2]], Credentials("user", "pass"), reachable=True
+        )
+
+        self.assertTrue(result["ok"])
+        mock_probe.assert_not_called()
+        self.mock_socket.socket.assert_not_called()
+
+
+class OnboardPrefixTestCase(TestCase):
+    """Test the prefix onboarding worker."""
+
+    def setUp(self):
+        """Prepare test objects."""
+        self.site = Site.objects.create(name="TEST_SITE", slug="test-site")
+
+    @mock.patch("nautobot_device_onboarding.worker.enqueue_onboarding_batch")
+    @mock.patch("nautobot_device_onboarding.worker.discover_hosts")
+    def test_onboard_prefix(self, mock_discover_hosts, mock_enqueue):
+        """Verify that one task is created per discovered host and that they are enqueued together."""
+        mock_discover_hosts.return_value = ["10.20.0.1", "10.20.0.9"]
+        credentials = Credentials("user", "pass")
+
+        result = onboard_prefix("10.20.0.0/22", {"site_id": str(self.site.id), "port": 2222}, credentials)
+
+        mock_discover_hosts.assert_called_once_with("10.20.0.0/22", 2222, 30)
+        self.assertEqual(len(result["task_ids"]), 2)
+        mock_enqueue.assert_called_once_with(result["task_ids"], credentials, reachable=True)
+
+        onboarding_tasks = OnboardingTask.objects.filter(id__in=result["task_ids"]).order_by("label")
+        self.assertEqual([ot.ip_address for ot in onboarding_tasks], ["10.20.0.1", "10.20.0.9"])
+        self.assertEqual({ot.site for ot in onboarding_tasks}, {self.site})
+        self.assertEqual({ot.port for ot in onboarding_tasks}, {2222})
+        self.assertEqual([ot.label for ot in onboarding_tasks], [1, 2])
+
+    @mock.patch("nautobot_device_onboarding.worker.enqueue_onboarding_batch")
+    @mock.patch("nautobot_device_onboarding.worker.discover_hosts")
+    def test_onboard_prefix_object_permissions(self, mock_discover_hosts, mock_enqueue):
+        """Verify that no task is created when the tasks violate the object permissions of the user."""
+        mock_discover_hosts.return_value = ["10.20.0.1", "10.20.0.9"]
+        user = User.objects.create(username="testuser")
+        obj_perm = ObjectPermission.objects.create(
+            name="Onboard other site", constraints={"site__slug": "other-site"}, actions=["add"]
+        )
+        obj_perm.users.add(user)
+        obj_perm.object_types.add(ContentType.objects.get_for_model(OnboardingTask))
+
+        result = onboard_prefix(
+            "10.20.0.0/22", {"site_id": str(self.site.id)}, Credentials("user", "pass"), user_id=str(user.pk)
+        )
+
+        self.assertFalse(result["ok"])
+        self.assertEqual(result["task_ids"], [])
+        self.assertFalse(OnboardingTask.objects.exists())
+        mock_enqueue.assert_not_called()
+
+
+class EnqueueOnboardingBatchesTestCase(TestCase):
+    """Test the batched enqueuing of onboarding jobs."""
+
+    @mock.patch.dict(PLUGIN_SETTINGS, {"batch_size": 2})
+    @mock.patch("nautobot_device_onboarding.worker.CELERY_WORKER", False)
+    @mock.patch("nautobot_device_onboarding.worker.get_queue", create=True)
+    def test_enqueue_onboarding_batches_rq(self, mock_get_queue):
+        """Verify that all the batches are split by batch_size and enqueued in a single RQ call."""
+        queue = mock_get_queue.return_value
+        credentials = [Credentials("user1", "pass"), Credentials("user2", "pass")]
+        ids = [str(uuid.uuid4()) for _ in range(4)]
+
+        enqueue_onboarding_batches([(ids[:3], credentials[0]), (ids[3:], credentials[1])])
+
+        queue.enqueue_many.assert_called_once()
+        queue.enqueue.assert_not_called()
+        self.assertEqual(
+            [call[1]["args"] for call in queue.prepare_data.call_args_list],
+            [(ids[:2], credentials[0], False), (ids[2:3], credentials[0], False), (ids[3:], credentials[1], False)],
+        )
+
+    @mock.patch("nautobot_device_onboarding.worker.CELERY_WORKER", False)
+    @mock.patch("nautobot_device_onboarding.worker.get_queue", create=True)
+    def test_enqueue_onboarding_batches_timestamp(self, mock_get_queue):  # pylint: disable=unused-argument
+        """Verify that the enqueued tasks are timestamped."""
+        site = Site.objects.create(name="TEST_SITE", slug="test-site")
+        ot = OnboardingTask.objects.create(ip_address="10.0.0.1", site=site)
+
+        enqueue_onboarding_batches([([ot.id], Credentials("user", "pass"))])
+
+        ot.refresh_from_db()
+        self.assertIsNotNone(ot.enqueued)
+        self.assertIsNone(ot.started)
+
+    @mock.patch("nautobot_device_onboarding.worker.CELERY_WORKER", False)
+    @mock.patch("nautobot_device_onboarding.worker.get_queue", create=True)
+    def test_enqueue_onboarding_batches_empty(self, mock_get_queue):
+        """Verify that nothing is enqueued without tasks."""
+        enqueue_onboarding_batches([([], Credentials("user", "pass"))])
+
+        mock_get_queue.assert_not_called()
+
+
+class RecycleWorkerTestCase(TestCase):
+    """Test the recycling of the workers and the retirement of their metrics."""
+
+    @mock.patch.dict(PLUGIN_SETTINGS, {"worker_recycle_sessions": 100})
+    @mock.patch("nautobot_device_onboarding.connections._recycle_requested", False)
+    @mock.patch("nautobot_device_onboarding.connections._sessions_opened", 100)
+    @mock.patch("nautobot_device_onboarding.worker.CELERY_WORKER", False)
+    @mock.patch("nautobot_device_onboarding.worker.signal.getsignal")
+    @mock.patch("nautobot_device_onboarding.worker.os.kill")
+    def test_recycle_worker(self, mock_kill, mock_getsignal):
+        """Verify that a warm shutdown is requested once, when the sessions threshold is reached."""
+        mock_getsignal.return_value = mock.Mock()
+
+        recycle_worker()
+        recycle_worker()
+
+        mock_kill.assert_called_once()
+
+    @mock.patch.dict(PLUGIN_SETTINGS, {"worker_recycle_sessions": 0})
+    @mock.patch("nautobot_device_onboarding.connections._recycle_requested", False)
+    @mock.patch("nautobot_device_onboarding.connections._sessions_opened", 100)
+    @mock.patch("nautobot_device_onboarding.worker.os.kill")
+    def test_recycle_worker_disabled(self, mock_kill):
+        """Verify that workers are not recycled by default."""
+        recycle_worker()
+
+        mock_kill.assert_not_called()
+
+    @mock.patch("nautobot_device_onboarding.metrics.MULTIPROCESS_DIR", "/tmp/metrics")
+    @mock.patch("nautobot_device_onboarding.metrics.multiprocess.mark_process_dead")
+    @mock.patch("nautobot_device_onboarding.worker.signal.getsignal")
+    def test_retire_work_horse_metrics(self, mock_getsignal, mock_mark_process_dead):
+        """Verify that the gauges of RQ work horses, unlike those of RQ workers, are dropped once their job is done."""
+        mock_getsignal.return_value = mock.Mock()
+        retire_work_horse_metrics()
+        mock_mark_process_dead.assert_not_called()
+
+        mock_getsignal.return_value = signal.SIG_DFL
+        retire_work_horse_metrics()
+        mock_mark_process_dead.assert_called_once_with(os.getpid(), "/tmp/metrics")
@@ -13,12 +13,21 @@ limitations under the License.
 """
 import logging
 
+from django.contrib import messages
+from django.core.exceptions import ObjectDoesNotExist, ValidationError
+from django.db import transaction
 from django.shortcuts import get_object_or_404, render
 
 from nautobot.core.views import generic
 
 from .filters import OnboardingTaskFilter
-from .forms import OnboardingTaskForm, OnboardingTaskFilterForm, OnboardingTaskFeedCSVForm
+from .forms import (
+    OnboardingTaskForm,
+    OnboardingTaskFilterForm,
+    OnboardingTaskFeedCSVForm,
+    OnboardingTaskFeedCSVImportForm,
+    import_onboarding_tasks,
+)
 from .models import OnboardingTask
 from .tables import OnboardingTaskTable, OnboardingTaskFeedBulkTable
 
@@ -26,7 +35,7 @@ from .tables import OnboardingTaskTable, OnboardingTaskFeedBulkTable
 class OnboardingTaskView(generic.ObjectView):
     """View for presenting a single OnboardingTask."""
 
-    queryset = OnboardingTask.objects.all()
+    queryset = OnboardingTask.objects.select_related("site", "role", "platform", "created_device")
 
     def get(self, request, pk):  # pylint: disable=invalid-name, arguments-differ
         """Get request."""
@@ -40,7 +49,7 @@ class OnboardingTaskView(generic.ObjectView):
 class OnboardingTaskListView(generic.ObjectListView):
     """View for listing all extant OnboardingTasks."""
 
-    queryset = OnboardingTask.objects.all().order_by("-label")
+    queryset = OnboardingTask.objects.select_related("site", "platform", "created_device").order_by("-label")
     filterset = OnboardingTaskFilter
     filterset_form = OnboardingTaskFilterForm
     table = OnboardingTaskTable
@@ -60,15 +69,65 @@ class OnboardingTaskCreateView(generic.ObjectEditView):
 class OnboardingTaskBulkDeleteView(generic.BulkDeleteView):
     """View for deleting one or more OnboardingTasks."""
 
-    queryset = OnboardingTask.objects.filter().exclude(status="running")
+    queryset = OnboardingTask.objects.select_related("site", "platform", "created_device").exclude(status="running")
     table = OnboardingTaskTable
     default_return_url = "plugins:nautobot_device_onboarding:onboardingtask_list"
 
 
 class OnboardingTaskFeedBulkImportView(generic.BulkImportView):
-    """View for bulk-importing a CSV file to create OnboardingTasks."""
+    """View for bulk-importing a CSV file to create OnboardingTasks.
+
+    The rows are not validated and saved one form at a time, they are inserted in bulk by import_onboarding_tasks.
+    """
 
     queryset = OnboardingTask.objects.all()
     model_form = OnboardingTaskFeedCSVForm
     table = OnboardingTaskFeedBulkTable
     default_return_url = "plugins:nautobot_device_onboarding:onboardingtask_list"
+
+    def _import_form(self, *args, **kwargs):
+        return OnboardingTaskFeedCSVImportForm(*args, **kwargs)
+
+    def post(self, request):  # pylint: disable=arguments-differ
+        """Import the CSV data, re-render the form with the errors of the invalid rows if any."""
+        logger = logging.getLogger("nautobot.views.BulkImportView")
+        form = self._import_form(request.POST)
+
+        if form.is_valid():
+            try:
+                with transaction.atomic():
+                    new_objs = import_onboarding_tasks(form.cleaned_data["csv"], self.queryset)
+
+                if new_objs:
+                    msg = f"Imported {len(new_objs)} {OnboardingTask._meta.verbose_name_plural}"
+                    logger.info(msg)
+                    messages.success(request, msg)
+
+                    return render(
+                        request,
+                        "import_success.html",
+                        {
+                            "table": self.table(new_objs),
+                            "return_url": self.get_return_url(request),
+                        },
+                    )
+
+            except ValidationError as err:
+                for message in err.messages:
+                    form.add_error("csv", message)
+
+            except ObjectDoesNotExist:
+                msg = "Object import failed due to object-level permissions violation"
+                logger.debug(msg)
+                form.add_error(None, msg)
+
+        return render(
+            request,
+            self.template_name,
+            {
+                "form": form,
+                "fields": self.model_form().fields,
+                "obj_type": self.model_form._meta.model._meta.verbose_name,
+                "return_url": self.get_return_url(request),
+            },
+        )
@@ -12,37 +12,63 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 import logging
+import os
+import signal
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
+from django.conf import settings
+from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
-from prometheus_client import Summary
+from django.db import connection, transaction
+from django.utils import timezone
 
 from nautobot.dcim.models import Device
 
 from .choices import OnboardingFailChoices
 from .choices import OnboardingStatusChoices
+from .connections import claim_recycle, sessions_opened
 from .exceptions import OnboardException
-from .helpers import onboarding_task_fqdn_to_ip
-from .metrics import onboardingtask_results_counter
+from .helpers import bulk_create_onboarding_tasks
+from .helpers import onboarding_task_fqdn_to_ip, primary_ip_field, resolve_onboarding_tasks
+from .metrics import mark_process_dead, onboardingtask_processing_histogram, onboardingtask_results_counter
 from .models import OnboardingDevice
 from .models import OnboardingTask
-from .onboard import OnboardingManager
+from .onboard import OnboardingManager, OnboardingTaskManager, collect_netdev_dict
+from .reachability import discover_hosts, sweep_onboarding_tasks
 
 logger = logging.getLogger("rq.worker")
 
-
-REQUEST_TIME = Summary("onboardingtask_processing_seconds", "Time spent processing onboarding request")
-
+PLUGIN_SETTINGS = settings.PLUGINS_CONFIG["nautobot_device_onboarding"]
 
 try:
+    from celery import group
+    from celery.signals import worker_process_shutdown
     from nautobot.core.celery import nautobot_task
 
     CELERY_WORKER = True
 
+    @worker_process_shutdown.connect
+    def retire_worker_process_metrics(pid=None, **kwargs):  # pylint: disable=unused-argument
+        """Drop the gauges of an exiting Celery pool process from the aggregated metrics."""
+        mark_process_dead(pid)
+
     @nautobot_task
     def onboard_device_worker(task_id, credentials):
         """Onboard device with Celery worker."""
         return onboard_device(task_id=task_id, credentials=credentials)
 
+    @nautobot_task
+    def onboard_devices_worker(task_ids, credentials, reachable=False):
+        """Onboard batch of devices with Celery worker."""
+        return onboard_devices(task_ids=task_ids, credentials=credentials, reachable=reachable)
+
+    @nautobot_task
+    def onboard_prefix_worker(prefix, onboarding_task_kwargs, credentials, user_id=None):
+        """Onboard devices of a prefix with Celery worker."""
+        return onboard_prefix(
+            prefix=prefix, onboarding_task_kwargs=onboarding_task_kwargs, credentials=credentials, user_id=user_id
+        )
+
 except ImportError:
     logger.info("INFO: Celery was not found - using Django RQ Worker")
 
@@ -52,95 +78,454 @@ except ImportError:
 
     def onboard_device_worker(task_id, credentials):
         """Onboard device with RQ worker."""
-        return onboard_device(task_id=task_id, credentials=credentials)
+        try:
+            return onboard_device(task_id=task_id, credentials=credentials)
+        finally:
+            recycle_worker()
+            retire_work_horse_metrics()
 
+    def onboard_devices_worker(task_ids, credentials, reachable=False):
+        """Onboard batch of devices with RQ worker."""
+        try:
+            return onboard_devices(task_ids=task_ids, credentials=credentials, reachable=reachable)
+        finally:
+            recycle_worker()
+            retire_work_horse_metrics()
 
-@REQUEST_TIME.time()
-def onboard_device(task_id, credentials):  # pylint: disable=too-many-statements, too-many-branches
-    """Process a single OnboardingTask instance."""
-    username = credentials.username
-    password = credentials.password
-    secret = credentials.secret
+    def onboard_prefix_worker(prefix, onboarding_task_kwargs, credentials, user_id=None):
+        """Onboard devices of a prefix with RQ worker."""
+        return onboard_prefix(
+            prefix=prefix, onboarding_task_kwargs=onboarding_task_kwargs, credentials=credentials, user_id=user_id
+        )
 
-    ot = OnboardingTask.objects.get(id=task_id)
 
-    # Rewrite FQDN to IP for Onboarding Task
-    onboarding_task_fqdn_to_ip(ot)
+def recycle_worker():
+    """Request a warm shutdown of the RQ worker once it has opened `worker_recycle_sessions` NAPALM sessions.
 
-    logger.info("START: onboard device")
-    onboarded_device = None
+    The worker finishes its current job before exiting, and is expected to be restarted by its process
+    manager (systemd, supervisord, container orchestrator). RQ work horses are not recycled, as they
+    already exit, releasing all their resources, at the end of each job. Celery pool processes are
+    recycled by Celery itself, see its `worker_max_tasks_per_child` and `worker_max_memory_per_child`
+    settings, a shutdown request would stop the whole worker node.
+    """
+    if not claim_recycle(PLUGIN_SETTINGS["worker_recycle_sessions"]):
+        return
 
-    try:
-        try:
-            if ot.ip_address:
-                onboarded_device = Device.objects.get(primary_ip4__host=ot.ip_address)
+    logger.info("RECYCLE: %s NAPALM sessions opened, requesting a warm shutdown of the worker", sessions_opened())
 
-            if OnboardingDevice.objects.filter(device=onboarded_device, enabled=False):
-                ot.status = OnboardingStatusChoices.STATUS_SKIPPED
+    if not in_rq_work_horse():
+        os.kill(os.getpid(), signal.SIGTERM)
 
-                return dict(ok=True)
 
-        except Device.DoesNotExist as exc:
-            logger.info("Getting device with IP lookup failed: %s", str(exc))
-        except Device.MultipleObjectsReturned as exc:
-            logger.info("Getting device with IP lookup failed: %s", str(exc))
-            raise OnboardException(
-                reason="fail-general", message=f"ERROR Multiple devices exist for IP {ot.ip_address}"
-            )
-        except ValueError as exc:
-            logger.info("Getting device with IP lookup failed: %s", str(exc))
-        except ValidationError as exc:
-            logger.info("Getting device with IP lookup failed: %s", str(exc))
+def in_rq_work_horse():
+    """Tell whether the current process is an RQ work horse, exiting once its job is done.
 
-        ot.status = OnboardingStatusChoices.STATUS_RUNNING
-        ot.save()
+    The RQ worker process, unlike its work horses, handles SIGTERM as a warm shutdown request.
+    """
+    return not callable(signal.getsignal(signal.SIGTERM))
 
-        onboarding_manager = OnboardingManager(ot=ot, username=username, password=password, secret=secret)
 
-        if onboarding_manager.created_device:
-            ot.created_device = onboarding_manager.created_device
+def retire_work_horse_metrics():
+    """Drop the gauges of an RQ work horse from the aggregated metrics, as it exits once its job is done."""
+    if in_rq_work_horse():
+        mark_process_dead()
+
+
+def get_onboarded_device(ot):
+    """Return the Nautobot device already using the IP address of the OnboardingTask as primary IP, if any.
+
+    Raises:
+      OnboardException("fail-general"):
+        When multiple devices exist for the IP address
+    """
+    try:
+        if ot.ip_address:
+            return Device.objects.get(**{f"{primary_ip_field(ot.ip_address)}__host": ot.ip_address})
+
+    except Device.DoesNotExist as exc:
+        logger.info("Getting device with IP lookup failed: %s", str(exc))
+    except Device.MultipleObjectsReturned as exc:
+        logger.info("Getting device with IP lookup failed: %s", str(exc))
+        raise OnboardException(reason="fail-general", message=f"ERROR Multiple devices exist for IP {ot.ip_address}")
+    except ValueError as exc:
+        logger.info("Getting device with IP lookup failed: %s", str(exc))
+    except ValidationError as exc:
+        logger.info("Getting device with IP lookup failed: %s", str(exc))
+
+    return None
 
-        ot.status = OnboardingStatusChoices.STATUS_SUCCEEDED
-        ot.save()
-        logger.info("FINISH: onboard device")
-        onboarding_status = True
 
-    except OnboardException as exc:
-        if onboarded_device:
-            ot.created_device = onboarded_device
+def onboarding_task_failed(ot, exc, onboarded_device=None):
+    """Record the failure of an OnboardingTask."""
+    if onboarded_device:
+        ot.created_device = onboarded_device
 
+    if isinstance(exc, OnboardException):
         logger.error("%s", exc)
-        ot.status = OnboardingStatusChoices.STATUS_FAILED
         ot.failed_reason = exc.reason
         ot.message = exc.message
-        ot.save()
-        onboarding_status = False
-
-    except Exception as exc:  # pylint: disable=broad-except
-        if onboarded_device:
-            ot.created_device = onboarded_device
-
+    else:
         logger.error("Onboarding Error - Exception")
         logger.error(str(exc))
-        ot.status = OnboardingStatusChoices.STATUS_FAILED
         ot.failed_reason = OnboardingFailChoices.FAIL_GENERAL
         ot.message = str(exc)
-        ot.save()
+
+    ot.status = OnboardingStatusChoices.STATUS_FAILED
+    ot.finished = timezone.now()
+    ot.save()
+
+
+def onboarding_task_succeeded(ot, created_device, unchanged=False):
+    """Record the success of an OnboardingTask, `unchanged` when nothing had to be written to Nautobot."""
+    if created_device:
+        ot.created_device = created_device
+
+    if unchanged:
+        ot.message = "Device facts unchanged since the latest onboarding, nothing written"
+
+    ot.status = OnboardingStatusChoices.STATUS_SUCCEEDED
+    ot.finished = timezone.now()
+    ot.save()
+
+
+def onboarding_task_skipped(ot, onboarded_device):
+    """Record an OnboardingTask skipped as the onboarding of its device is disabled."""
+    ot.created_device = onboarded_device
+    ot.status = OnboardingStatusChoices.STATUS_SKIPPED
+    ot.finished = timezone.now()
+    ot.save()
+
+
+def onboarding_disabled(onboarded_device):
+    """Return True when the onboarding of a device already present in Nautobot is disabled."""
+    if not onboarded_device:
+        return False
+
+    return OnboardingDevice.objects.filter(device=onboarded_device, enabled=False).exists()
+
+
+def update_onboarding_device(ot, onboarded_device, facts_fingerprint=None):
+    """Record a finished OnboardingTask on the OnboardingDevice of its device.
+
+    The OnboardingDevice is created if the device was already present in Nautobot without one.
+
+    Args:
+      ot (OnboardingTask): Finished Onboarding Task
+      onboarded_device (Device): Device already present in Nautobot with the IP address of the task
+      facts_fingerprint (str): Fingerprint of the onboarded device facts, "" to clear it, None to leave it as is
+    """
+    device_id = ot.created_device_id or (onboarded_device.pk if onboarded_device else None)
+
+    if not device_id:
+        return
+
+    onboarding_device, _ = OnboardingDevice.objects.get_or_create(device_id=device_id)
+    update_fields = onboarding_device.record_onboarding_task(ot)
+
+    if facts_fingerprint is not None:
+        onboarding_device.facts_fingerprint = facts_fingerprint
+        update_fields.append("facts_fingerprint")
+
+    onboarding_device.save(update_fields=update_fields)
+
+
+@onboardingtask_processing_histogram.time()
+def onboard_device(task_id, credentials):
+    """Process a single OnboardingTask instance."""
+    username = credentials.username
+    password = credentials.password
+    secret = credentials.secret
+
+    ot = OnboardingTask.objects.select_related("site", "platform", "role").get(id=task_id)
+
+    # Rewrite FQDN to IP for Onboarding Task
+    onboarding_task_fqdn_to_ip(ot)
+
+    logger.info("START: onboard device")
+    onboarded_device = None
+    facts_fingerprint = None
+
+    try:
+        onboarded_device = get_onboarded_device(ot)
+
+        if onboarding_disabled(onboarded_device):
+            onboarding_task_skipped(ot, onboarded_device)
+            logger.info("SKIPPED: onboarding disabled for device %s", onboarded_device.name)
+        else:
+            ot.status = OnboardingStatusChoices.STATUS_RUNNING
+            ot.started = timezone.now()
+            ot.save()
+
+            onboarding_manager = OnboardingManager(
+                ot=ot, username=username, password=password, secret=secret, onboarded_device=onboarded_device
+            )
+            facts_fingerprint = onboarding_manager.facts_fingerprint
+
+            onboarding_task_succeeded(ot, onboarding_manager.created_device, onboarding_manager.unchanged)
+            logger.info("FINISH: onboard device")
+
+        onboarding_status = True
+
+    except Exception as exc:  # pylint: disable=broad-except
+        onboarding_task_failed(ot, exc, onboarded_device)
+        facts_fingerprint = ""
         onboarding_status = False
 
     finally:
-        if onboarded_device and not OnboardingDevice.objects.filter(device=onboarded_device):
-            OnboardingDevice.objects.create(device=onboarded_device)
+        update_onboarding_device(ot, onboarded_device, facts_fingerprint)
 
     onboardingtask_results_counter.labels(status=ot.status).inc()
 
     return dict(ok=onboarding_status)
 
 
+def _collect_netdev_dict(ot, credentials):
+    """Collect the device information of an OnboardingTask, used as the thread pool target of onboard_devices."""
+    try:
+        otm = OnboardingTaskManager(ot)
+        username, password, secret = otm.get_credentials(credentials.username, credentials.password, credentials.secret)
+        # Only the devices found reachable by the batch sweep are collected
+        return collect_netdev_dict(otm, username, password, secret, reachable=True)
+    finally:
+        # Django opens a database connection per thread, make sure it does not outlive the thread
+        connection.close()
+
+
+def onboard_devices(task_ids, credentials, max_workers=None, reachable=False):
+    """Process a batch of OnboardingTask instances.
+
+    The FQDNs not resolved at submission time are resolved concurrently, and the reachability of
+    all the devices is checked up front in a single concurrent sweep, unreachable tasks being
+    failed in bulk. Devices are not probed again before being contacted. Device I/O (platform
+    autodetection, NAPALM getters) of the reachable devices is then performed for up to
+    `max_workers` devices at once on a thread pool, while all the Nautobot database writes are
+    serialized on the calling thread as the device information becomes available.
+
+    Args:
+      task_ids (list): IDs of the OnboardingTasks to process
+      credentials (Credentials): Device credentials shared by all the tasks
+      max_workers (int): Maximum number of devices contacted concurrently, defaults to the
+        `batch_max_workers` plugin setting
+      reachable (bool): The devices were just found reachable, e.g. by a prefix discovery, the sweep is skipped
+
+    Returns:
+      dict: overall status and the status of each task, keyed by task ID
+    """
+    max_workers = max_workers or PLUGIN_SETTINGS["batch_max_workers"]
+    results = {}
+    ready = []
+
+    logger.info("START: onboard batch of %s devices", len(task_ids))
+
+    onboarding_tasks, failed = resolve_onboarding_tasks(
+        list(OnboardingTask.objects.filter(id__in=task_ids).select_related("site", "platform", "role"))
+    )
+
+    for ot in failed:
+        results[str(ot.id)] = False
+
+    for ot in onboarding_tasks:
+        onboarded_device = None
+
+        try:
+            onboarded_device = get_onboarded_device(ot)
+
+            if onboarding_disabled(onboarded_device):
+                onboarding_task_skipped(ot, onboarded_device)
+                update_onboarding_device(ot, onboarded_device)
+                onboardingtask_results_counter.labels(status=ot.status).inc()
+                results[str(ot.id)] = True
+                continue
+
+            ot.status = OnboardingStatusChoices.STATUS_RUNNING
+            ot.started = timezone.now()
+            ot.save()
+            ready.append((ot, onboarded_device))
+
+        except Exception as exc:  # pylint: disable=broad-except
+            onboarding_task_failed(ot, exc, onboarded_device)
+            update_onboarding_device(ot, onboarded_device)
+            onboardingtask_results_counter.labels(status=ot.status).inc()
+            results[str(ot.id)] = False
+
+    if ready and not reachable:
+        _, unreachable = sweep_onboarding_tasks([ot for ot, _ in ready])
+        unreachable_ids = {ot.id for ot in unreachable}
+
+        for ot, onboarded_device in ready:
+            if ot.id in unreachable_ids:
+                update_onboarding_device(ot, onboarded_device)
+                results[str(ot.id)] = False
+
+        ready = [(ot, onboarded_device) for ot, onboarded_device in ready if ot.id not in unreachable_ids]
+
+    if ready:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(ready))) as executor:
+            futures = {
+                executor.submit(_collect_netdev_dict, ot, credentials): (ot, onboarded_device)
+                for ot, onboarded_device in ready
+            }
+
+            for future in as_completed(futures):
+                ot, onboarded_device = futures[future]
+
+                try:
+                    onboarding_manager = OnboardingManager(
+                        ot=ot,
+                        username=credentials.username,
+                        password=credentials.password,
+                        secret=credentials.secret,
+                        netdev_dict=future.result(),
+                        onboarded_device=onboarded_device,
+                    )
+                    facts_fingerprint = onboarding_manager.facts_fingerprint
+                    onboarding_task_succeeded(ot, onboarding_manager.created_device, onboarding_manager.unchanged)
+                    results[str(ot.id)] = True
+
+                except Exception as exc:  # pylint: disable=broad-except
+                    onboarding_task_failed(ot, exc, onboarded_device)
+                    facts_fingerprint = ""
+                    results[str(ot.id)] = False
+
+                finally:
+                    update_onboarding_device(ot, onboarded_device, facts_fingerprint)
+
+                onboardingtask_results_counter.labels(status=ot.status).inc()
+
+    logger.info("FINISH: onboard batch of %s devices", len(task_ids))
+
+    return dict(ok=all(results.values()), results=results)
+
+
+def onboard_prefix(prefix, onboarding_task_kwargs, credentials, user_id=None):
+    """Discover the devices of a prefix and onboard them as a single batch.
+
+    All the hosts of the prefix are probed concurrently on the onboarding port, one
+    OnboardingTask is created for each host found listening and the tasks are enqueued
+    together as a batch onboarding job.
+
+    Args:
+      prefix (str): Prefix to discover, e.g. "10.20.0.0/22"
+      onboarding_task_kwargs (dict): OnboardingTask field values shared by all the created tasks
+        (site_id, port, timeout, platform_id, role_id)
+      credentials (Credentials): Device credentials shared by all the tasks
+      user_id (str): ID of the requesting user, none of the tasks are created if any of them violates
+        the object permissions of the user
+
+    Returns:
+      dict: status and IDs of the created OnboardingTasks
+    """
+    port = onboarding_task_kwargs.get("port") or OnboardingTask._meta.get_field("port").default
+    timeout = onboarding_task_kwargs.get("timeout") or OnboardingTask._meta.get_field("timeout").default
+
+    logger.info("DISCOVER: hosts listening on port %s in %s", port, prefix)
+    hosts = discover_hosts(prefix, port, timeout)
+    logger.info("DISCOVER: %s hosts found in %s", len(hosts), prefix)
+
+    with transaction.atomic():
+        onboarding_tasks = bulk_create_onboarding_tasks(
+            [
+                OnboardingTask(ip_address=host, **{**onboarding_task_kwargs, "port": port, "timeout": timeout})
+                for host in hosts
+            ]
+        )
+
+        if user_id is not None:
+            queryset = OnboardingTask.objects.restrict(get_user_model().objects.get(pk=user_id), "add")
+
+            if queryset.filter(pk__in=[ot.pk for ot in onboarding_tasks]).count() != len(onboarding_tasks):
+                transaction.set_rollback(True)
+                logger.error("DISCOVER: onboarding tasks for %s not permitted for user %s", prefix, user_id)
+                return dict(ok=False, task_ids=[])
+
+    task_ids = [str(ot.id) for ot in onboarding_tasks]
+
+    if task_ids:
+        # The discovered hosts were just probed, the batch onboarding job does not probe them again
+        enqueue_onboarding_batch(task_ids, credentials, reachable=True)
+
+    return dict(ok=True, task_ids=task_ids)
+
+
 def enqueue_onboarding_task(task_id, credentials):
     """Detect worker type and enqueue task."""
+    OnboardingTask.objects.filter(id=task_id).update(enqueued=timezone.now())
+
     if CELERY_WORKER:
         onboard_device_worker.delay(task_id, credentials)
 
     if not CELERY_WORKER:
         get_queue("default").enqueue("nautobot_device_onboarding.worker.onboard_device_worker", task_id, credentials)
+
+
+def enqueue_jobs(worker_name, jobs_args):
+    """Detect worker type and enqueue many jobs of the same worker at once.
+
+    With RQ, the jobs are written to Redis in a single pipeline (RQ >= 1.9, one job at a time with older
+    versions). With Celery, they are sent as a group.
+
+    Args:
+      worker_name (str): Name of the worker function of this module, e.g. "onboard_devices_worker"
+      jobs_args (list): Positional arguments of each job
+    """
+    if not jobs_args:
+        return
+
+    if CELERY_WORKER:
+        worker = globals()[worker_name]
+        group(worker.s(*job_args) for job_args in jobs_args).apply_async()
+
+    if not CELERY_WORKER:
+        queue = get_queue("default")
+        func = f"nautobot_device_onboarding.worker.{worker_name}"
+
+        if hasattr(queue, "enqueue_many"):
+            queue.enqueue_many([queue.prepare_data(func, args=job_args) for job_args in jobs_args])
+        else:
+            for job_args in jobs_args:
+                queue.enqueue(func, *job_args)
+
+
+def enqueue_onboarding_batches(batches, reachable=False):
+    """Detect worker type and enqueue batch onboarding jobs of at most `batch_size` tasks each, all at once.
+
+    Args:
+      batches (list): (task_ids, credentials) tuples, the tasks of each tuple sharing the same credentials
+      reachable (bool): The devices were just found reachable, the jobs skip their reachability sweep
+    """
+    batch_size = PLUGIN_SETTINGS["batch_size"]
+    jobs_args = []
+
+    for task_ids, credentials in batches:
+        task_ids = [str(task_id) for task_id in task_ids]
+
+        for start in range(0, len(task_ids), batch_size):
+            end = start + batch_size
+            jobs_args.append((task_ids[start:end], credentials, reachable))
+
+    # Timestamped before they are enqueued, as a worker may start processing them right away
+    enqueued_ids = [task_id for job_args in jobs_args for task_id in job_args[0]]
+    if enqueued_ids:
+        OnboardingTask.objects.filter(id__in=enqueued_ids).update(enqueued=timezone.now())
+
+    enqueue_jobs("onboard_devices_worker", jobs_args)
+
+
+def enqueue_onboarding_batch(task_ids, credentials, reachable=False):
+    """Detect worker type and enqueue batch onboarding jobs of at most `batch_size` of the given tasks each."""
+    enqueue_onboarding_batches([(task_ids, credentials)], reachable=reachable)
+
+
+def enqueue_prefix_onboarding(prefix, onboarding_task_kwargs, credentials, user_id=None):
+    """Detect worker type and enqueue the discovery and onboarding of the devices of a prefix."""
+    if CELERY_WORKER:
+        onboard_prefix_worker.delay(prefix, onboarding_task_kwargs, credentials, user_id)
+
+    if not CELERY_WORKER:
+        get_queue("default").enqueue(
+            "nautobot_device_onboarding.worker.onboard_prefix_worker",
+            prefix,
+            onboarding_task_kwargs,
+            credentials,
+            user_id,
+        )
@@ -272,6 +272,18 @@ def unittest(context):
     run_command(context, command)
 
 
+@task(
+    help={
+        "devices": "Number of devices already present in Nautobot (default 2000)",
+        "tasks": "Number of devices to onboard (default 200)",
+    }
+)
+def benchmark(context, devices=2000, tasks=200):
+    """Benchmark the onboarding pipeline with mocked devices."""
+    command = f"nautobot-server onboarding_benchmark --devices {devices} --tasks {tasks}"
+    run_command(context, command)
+
+
 @task
 def tests(context):
     """Run all tests for this plugin.